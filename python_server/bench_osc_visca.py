@@ -0,0 +1,255 @@
+'''
+Description:
+    End to end benchmark: OSC in, VISCA out, against emulated cameras.
+
+    Starts one camera_emulator per camera in the config (on 127.0.0.N),
+    starts osc_visca_server.py pointed at them, then plays what an
+    operator does on the panel at the same time:
+
+        joystick    pan_<direction> at 30 Hz with changing speeds and
+                    releases, on the first camera
+        fader       zoom_direct at 60 Hz sweeping wide to tele and back,
+                    on the second camera
+        recall      memory_recall every few seconds, round robin over
+                    all cameras
+
+    Every VISCA command an emulated camera receives is matched to the
+    oldest OSC message of the same kind that asked for exactly that
+    payload, and earlier unmatched ones are counted as coalesced (the
+    server sent a newer value instead, or skipped an unchanged one).
+    Reports throughput and OSC to camera latency percentiles per kind.
+
+    Usage:
+        python bench_osc_visca.py [config] [--duration 10] [--latency 2] [--loss 0.01] ...
+        python bench_osc_visca.py --no-server   (server already running on the emulated config)
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiosc
+
+import camera_emulator
+import visca_encoder as visca
+
+# --------------------------------------------------------
+#  Settings
+# --------------------------------------------------------
+default_duration = 10.0   # seconds of traffic
+joystick_rate = 30.0      # OSC messages per second while the stick is held
+fader_rate = 60.0         # OSC messages per second while the fader moves
+recall_interval = 3.0     # seconds between preset recalls
+settle_time = 1.0         # seconds to wait for the last commands after the traffic stops
+
+
+def command_kind(payload):
+    # which scenario a VISCA payload belongs to, None for the rest
+    prefix = payload[:4]
+    if prefix == b'\x81\x01\x06\x01':
+        return 'joystick'
+    if prefix == b'\x81\x01\x04\x47':
+        return 'fader'
+    if payload[:5] == b'\x81\x01\x04\x3F\x02':
+        return 'recall'
+    return None
+
+def percentile(samples, q):
+    # nearest rank, samples sorted
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, max(0, int(math.ceil(q * len(samples))) - 1))]
+
+
+# ==============================================================
+#  Matching OSC out to VISCA in
+# ==============================================================
+class LatencyRecorder:
+    '''OSC messages waiting for their VISCA command, per (camera, kind).'''
+
+    def __init__(self):
+        self.waiting = {}   # (camId, kind) -> [(payload, sentAt), ...] oldest first
+        self.sent = {}      # kind -> OSC messages sent
+        self.latency = {}   # kind -> [seconds, ...]
+        self.coalesced = {} # kind -> OSC messages that never got their own command
+        self.commands = 0
+        self.inquiries = 0
+        self.started = {}   # camId -> first datagram seen (the server is up)
+
+    def expect(self, camId, kind, payload):
+        self.sent[kind] = self.sent.get(kind, 0) + 1
+        self.waiting.setdefault((camId, kind), []).append((payload, time.perf_counter()))
+
+    def received(self, camId, payload_type, payload, receivedAt):
+        self.started.setdefault(camId, receivedAt)
+        if payload_type == visca.PAYLOAD_INQUIRY:
+            self.inquiries += 1
+            return
+        if payload_type != visca.PAYLOAD_COMMAND:
+            return
+        self.commands += 1
+        kind = command_kind(payload)
+        waiting = self.waiting.get((camId, kind))
+        if not waiting:
+            return
+        for i, (expected, sentAt) in enumerate(waiting):
+            if expected == payload:
+                self.latency.setdefault(kind, []).append(receivedAt - sentAt)
+                self.coalesced[kind] = self.coalesced.get(kind, 0) + i
+                del waiting[:i+1]
+                return
+
+    def finish(self):
+        # whatever is still waiting was coalesced or skipped
+        for (camId, kind), waiting in self.waiting.items():
+            self.coalesced[kind] = self.coalesced.get(kind, 0) + len(waiting)
+            waiting.clear()
+
+
+# ==============================================================
+#  Operator scenarios
+# ==============================================================
+class OscDriver:
+    def __init__(self, transport, recorder):
+        self.transport = transport
+        self.recorder = recorder
+        self.messages = 0
+
+    def send(self, camId, command, args, kind=None, payload=None):
+        if kind is not None:
+            self.recorder.expect(camId, kind, payload)
+        self.transport.sendto(aiosc.pack_message('/%s/%s' % (camId, command), *args))
+        self.messages += 1
+
+    async def joystick(self, camId, until):
+        loop = asyncio.get_running_loop()
+        directions = [name for name in visca.panDirections if name != 'pan_stop']
+        while loop.time() < until:
+            # hold the stick in one direction for a while, easing the speed around
+            direction = random.choice(directions)
+            panSpeed, tiltSpeed = random.randint(1, 18), random.randint(1, 17)
+            for _ in range(random.randint(5, 30)):
+                panSpeed = min(18, max(1, panSpeed + random.randint(-2, 2)))
+                tiltSpeed = min(17, max(1, tiltSpeed + random.randint(-2, 2)))
+                self.send(camId, direction, (panSpeed, tiltSpeed), 'joystick', visca.pan_drive(direction, panSpeed, tiltSpeed))
+                await asyncio.sleep(1.0/joystick_rate)
+            self.send(camId, direction, (0, 0), 'joystick', visca.pan_stop)
+            await asyncio.sleep(random.uniform(0.1, 0.5))
+
+    async def fader(self, camId, until):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        while loop.time() < until:
+            # triangle wave, 4 seconds wide to tele and back
+            phase = ((loop.time() - start) / 4.0) % 1.0
+            value = round(100.0 * (2 * phase if phase < 0.5 else 2 - 2 * phase), 1)
+            self.send(camId, 'zoom_direct', (value,), 'fader', visca.zoom_direct(visca.zoom_to_position(value)))
+            await asyncio.sleep(1.0/fader_rate)
+
+    async def recall(self, camIds, until):
+        loop = asyncio.get_running_loop()
+        n = 0
+        while loop.time() < until:
+            await asyncio.sleep(min(recall_interval, max(0.0, until - loop.time())))
+            if loop.time() >= until:
+                break
+            camId = camIds[n % len(camIds)]
+            memory = n % 4 + 1
+            self.send(camId, 'memory_recall', (memory,), 'recall', visca.memory_recall(memory))
+            n += 1
+
+
+# --------------------------------------------------------
+#  Report
+# --------------------------------------------------------
+def report(recorder, driver, elapsed, protocols):
+    print()
+    print('%-10s %8s %8s %9s %8s %8s %8s %8s' % ('kind', 'OSC', 'VISCA', 'coalesced', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+    for kind in ('joystick', 'fader', 'recall'):
+        samples = sorted(recorder.latency.get(kind, []))
+        quantiles = [percentile(samples, q) for q in (0.5, 0.9, 0.99, 1.0)]
+        print('%-10s %8d %8d %9d ' % (kind, recorder.sent.get(kind, 0), len(samples), recorder.coalesced.get(kind, 0))
+              + ' '.join('%8s' % ('-' if value is None else '%.1f' % (value * 1000)) for value in quantiles))
+    print()
+    print('OSC sent      %7.1f msg/s (%d in %.1f s)' % (driver.messages / elapsed, driver.messages, elapsed))
+    print('VISCA in      %7.1f cmd/s (%d commands, %d inquiries)' % (recorder.commands / elapsed, recorder.commands, recorder.inquiries))
+    print('Lost          %d datagrams (emulated loss)' % sum(protocol.lost for protocol in protocols.values()))
+
+
+# --------------------------------------------------------
+#  Run
+# --------------------------------------------------------
+async def wait_for_server(recorder, camIds, timeout):
+    # the server resets every camera's sequence number on startup
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        if all(camId in recorder.started for camId in camIds):
+            return True
+        await asyncio.sleep(0.1)
+    return False
+
+async def run(args, addresses, configs):
+    loop = asyncio.get_running_loop()
+    recorder = LatencyRecorder()
+    protocols = await camera_emulator.start_emulators(addresses, onReceive=recorder.received,
+                                                      **camera_emulator.emulator_settings(args))
+    camIds = sorted(addresses, key=int)
+
+    server = None
+    if not args.no_server:
+        configFile = os.path.join(tempfile.gettempdir(), 'bench_osc_visca_config.json')
+        with open(configFile, 'w') as json_file:
+            json.dump(camera_emulator.emulated_config(configs, addresses), json_file, indent=4)
+        log = open(args.server_log, 'w') if args.server_log else subprocess.DEVNULL
+        server = subprocess.Popen([sys.executable, 'osc_visca_server.py', configFile],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)), stdout=log, stderr=subprocess.STDOUT)
+        if not await wait_for_server(recorder, camIds, 15.0):
+            server.terminate()
+            raise SystemExit('osc_visca_server.py did not reach the emulated cameras')
+
+    transport, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol, remote_addr=(args.host, args.port))
+    driver = OscDriver(transport, recorder)
+    try:
+        started = loop.time()
+        until = started + args.duration
+        await asyncio.gather(driver.joystick(camIds[0], until),
+                             driver.fader(camIds[1 % len(camIds)], until),
+                             driver.recall(camIds, until))
+        elapsed = loop.time() - started
+        await asyncio.sleep(settle_time)
+        recorder.finish()
+        report(recorder, driver, elapsed, protocols)
+    finally:
+        transport.close()
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description='Drive osc_visca_server.py against emulated cameras')
+    parser.add_argument('config', nargs='?', default='osc_visca_config.json')
+    parser.add_argument('--duration', type=float, default=default_duration, help='seconds of traffic')
+    parser.add_argument('--host', default='127.0.0.1', help='OSC server address')
+    parser.add_argument('--port', type=int, default=8002, help='OSC server port')
+    parser.add_argument('--no-server', action='store_true', help="don't start osc_visca_server.py")
+    parser.add_argument('--server-log', help='write the server output to this file')
+    camera_emulator.add_arguments(parser)
+    args = parser.parse_args()
+
+    with open(args.config) as json_file:
+        configs = json.load(json_file)
+    addresses = camera_emulator.camera_addresses(configs, loopback=True)
+    asyncio.get_event_loop().run_until_complete(run(args, addresses, configs))
+
+if __name__ == '__main__':
+    main()
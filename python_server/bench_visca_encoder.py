@@ -0,0 +1,82 @@
+'''
+Description:
+    Microbenchmark for visca_encoder.
+
+    Prints the cost of encoding one complete VISCA-over-IP frame
+    (header + payload) per command type, next to the hex-string
+    templating the server used before (str.replace + bytearray.fromhex).
+
+    Usage:
+        python bench_visca_encoder.py [iterations]
+'''
+import sys
+import timeit
+
+import visca_encoder as visca
+
+# --------------------------------------------------------
+#  Legacy hex templating, kept here only as the baseline
+# --------------------------------------------------------
+legacy_pan_left = '81 01 06 01 VV WW 01 03 FF'
+legacy_pan_absolute = '81 01 06 02 VV WW 0Y1 0Y2 0Y3 0Y4 0Z1 0Z2 0Z3 0Z4 FF'
+legacy_zoom_direct = '81 01 04 47 0p 0q 0r 0s FF'
+legacy_memory_recall = '81 01 04 3F 02 0p FF'
+legacy_pan_stop = '81 01 06 01 15 15 03 03 FF'
+legacy_tally_on = '81 0A 02 02 02 FF'
+
+def legacy_frame(message_string, sequence_number=1):
+    payload_type = bytearray.fromhex('01 00')
+    payload = bytearray.fromhex(message_string)
+    payload_length = len(payload).to_bytes(2, 'big')
+    return payload_type + payload_length + sequence_number.to_bytes(4, 'big') + payload
+
+def legacy_to_hex(value):
+    return hex(value & 0xffff)[2:].zfill(4)
+
+def legacy_pan_absolute_frame():
+    absP, absT = (legacy_to_hex(v) for v in visca.pan_to_position(45.0, 10.0))
+    convMsg = legacy_pan_absolute.replace('VV', '18').replace('WW', '17')
+    convMsg = convMsg.replace('Y1',absP[0]).replace('Y2',absP[1]).replace('Y3',absP[2]).replace('Y4',absP[3])
+    convMsg = convMsg.replace('Z1',absT[0]).replace('Z2',absT[1]).replace('Z3',absT[2]).replace('Z4',absT[3])
+    return legacy_frame(convMsg)
+
+def legacy_zoom_direct_frame():
+    absZ = legacy_to_hex(visca.zoom_to_position(42.0))
+    return legacy_frame(legacy_zoom_direct.replace('p', absZ[0]).replace('q', absZ[1]).replace('r', absZ[2]).replace('s', absZ[3]))
+
+# --------------------------------------------------------
+#  Cases: name -> (legacy, encoder)
+# --------------------------------------------------------
+cases = {
+    'pan_stop (fixed)': (
+        lambda: legacy_frame(legacy_pan_stop),
+        lambda: visca.build_command(1, visca.pan_stop)),
+    'tally (fixed)': (
+        lambda: legacy_frame(legacy_tally_on),
+        lambda: visca.build_command(1, visca.tally(1))),
+    'pan_left (jog)': (
+        lambda: legacy_frame(legacy_pan_left.replace('VV', '12').replace('WW', '12')),
+        lambda: visca.build_command(1, visca.pan_drive('pan_left', 12, 12))),
+    'memory_recall': (
+        lambda: legacy_frame(legacy_memory_recall.replace('p', hex(5)[2:])),
+        lambda: visca.build_command(1, visca.memory_recall(5))),
+    'zoom_direct': (
+        legacy_zoom_direct_frame,
+        lambda: visca.build_command(1, visca.zoom_direct(visca.zoom_to_position(42.0)))),
+    'pan_absolute_position': (
+        legacy_pan_absolute_frame,
+        lambda: visca.build_command(1, visca.pan_absolute_degrees(18, 17, 45.0, 10.0))),
+}
+
+
+def main(iterations=200000):
+    print('%-24s %12s %12s %8s' % ('command', 'legacy ns', 'encoder ns', 'speedup'))
+    for name, (legacy, encoder) in cases.items():
+        assert bytes(legacy()) == encoder(), name
+        legacyCost = min(timeit.repeat(legacy, number=iterations, repeat=3)) / iterations * 1e9
+        encoderCost = min(timeit.repeat(encoder, number=iterations, repeat=3)) / iterations * 1e9
+        print('%-24s %12.0f %12.0f %7.1fx' % (name, legacyCost, encoderCost, legacyCost / encoderCost))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
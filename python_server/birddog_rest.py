@@ -0,0 +1,239 @@
+'''
+Description:
+    asyncio client for the Birddog P200 REST API (birddogavsetup and the
+    other settings pages), for what VISCA doesn't reach.
+
+    Every camera gets one keep-alive HTTP/1.1 connection, used for one
+    request at a time and opened again when the camera has closed it.
+    Nothing blocks the OSC loop: requests are plain asyncio streams.
+
+    Settings posted to the same camera and page in quick succession are
+    merged: the first post waits merge_delay for more, and anything posted
+    while a POST is in flight goes out in the next one, so a burst of
+    changes costs one POST per camera (the newest value of a setting
+    wins). Different cameras are posted to in parallel.
+
+    post() returns a future for the POST that carries the settings,
+    resolving to a Response, or None if the camera couldn't be reached.
+    camera_emulator.py serves a stand-in REST API for testing.
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import asyncio
+import json
+from collections import namedtuple
+
+import server_log
+
+# --------------------------------------------------------
+#  Settings
+# --------------------------------------------------------
+log = server_log.logger('rest')
+rest_port = 80
+request_timeout = 2.0 # seconds for one request, connecting included
+merge_delay = 0.02    # seconds the first post waits for more settings
+
+Response = namedtuple('Response', 'status body')
+
+
+def decode_json(response):
+    # a Response's JSON body, None if there is none
+    if response is None or not response.body:
+        return None
+    try:
+        return json.loads(response.body)
+    except ValueError:
+        return None
+
+
+# ==============================================================
+#  Connection (one per camera)
+# ==============================================================
+class BirddogConnection:
+    '''One keep-alive HTTP/1.1 connection, one request at a time.'''
+
+    def __init__(self, host, port=rest_port, timeout=request_timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.lock = None
+        self.connects = 0
+        self.requests = 0
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.connects += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            return await asyncio.wait_for(self._request(method, path, body), self.timeout)
+
+    # --------------------------------------------------------
+    # A request that fails part way (the timeout cancelling it
+    # included) leaves the reply unread: the connection is
+    # closed, or the next request would get this one's reply
+    # --------------------------------------------------------
+    async def _request(self, method, path, body):
+        try:
+            reused = self.writer is not None
+            if not reused:
+                await self.connect()
+            try:
+                return await self.exchange(method, path, body)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                if not reused:
+                    raise
+                self.close()
+            # the camera closed the idle connection: once more on a new one
+            await self.connect()
+            return await self.exchange(method, path, body)
+        except BaseException:
+            self.close()
+            raise
+
+    async def exchange(self, method, path, body):
+        head = ['%s /%s HTTP/1.1' % (method, path), 'Host: %s' % self.host, 'Connection: keep-alive']
+        if body is not None:
+            head += ['Content-Type: application/json', 'Content-Length: %d' % len(body)]
+        self.writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + (body or b''))
+        self.requests += 1
+
+        reader = self.reader
+        statusLine = await reader.readline()
+        if not statusLine:
+            raise ConnectionResetError('connection closed by camera')
+        version, status = statusLine.split()[:2]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n'):
+                break
+            if not line:
+                raise ConnectionResetError('connection closed by camera')
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keepAlive = version == b'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if not size:
+                    break
+                chunks.append(chunk[:-2])
+            data = b''.join(chunks)
+        elif 'content-length' in headers:
+            data = await reader.readexactly(int(headers['content-length']))
+        else:
+            data = await reader.read() # body ends with the connection
+            keepAlive = False
+        if not keepAlive:
+            self.close()
+        return Response(int(status), data)
+
+
+# ==============================================================
+#  Client (every camera, merged posts)
+# ==============================================================
+class Batch:
+    __slots__ = ('settings', 'future')
+
+    def __init__(self, future):
+        self.settings = {}
+        self.future = future
+
+
+class BirddogClient:
+    def __init__(self, port=rest_port, mergeDelay=merge_delay, timeout=request_timeout):
+        self.port = port
+        self.mergeDelay = mergeDelay
+        self.timeout = timeout
+        self.connections = {} # ip -> BirddogConnection
+        self.pending = {}     # (ip, target) -> Batch not sent yet
+        self.flushing = {}    # (ip, target) -> task sending its batches
+        self.posts = 0        # POSTs sent
+        self.merged = 0       # post() calls that joined a batch already waiting
+        self.failures = 0
+
+    def connection(self, ip):
+        connection = self.connections.get(ip)
+        if connection is None:
+            connection = self.connections[ip] = BirddogConnection(ip, self.port, self.timeout)
+        return connection
+
+    # --------------------------------------------------------
+    # GET a settings page, decoded, None on failure
+    # --------------------------------------------------------
+    async def get(self, ip, target):
+        try:
+            return decode_json(await self.connection(ip).request('GET', target))
+        except (OSError, asyncio.TimeoutError, ValueError) as e:
+            self.failures += 1
+            log.warning('REST GET %s from %s failed: %s', target, ip, e)
+            return None
+
+    # --------------------------------------------------------
+    # POST settings, merged with any others for the same
+    # camera and page that haven't gone out yet
+    # --------------------------------------------------------
+    def post(self, ip, target, settings):
+        key = (ip, target)
+        batch = self.pending.get(key)
+        if batch is None:
+            batch = self.pending[key] = Batch(asyncio.get_running_loop().create_future())
+        else:
+            self.merged += 1
+        batch.settings.update(settings)
+        if key not in self.flushing:
+            self.flushing[key] = asyncio.ensure_future(self.flush(key))
+        return batch.future
+
+    async def flush(self, key):
+        ip, target = key
+        batch = None
+        try:
+            await asyncio.sleep(self.mergeDelay)
+            while key in self.pending:
+                batch = self.pending.pop(key)
+                response = None
+                try:
+                    response = await self.connection(ip).request('POST', target, json.dumps(batch.settings).encode())
+                    self.posts += 1
+                except (OSError, asyncio.TimeoutError, ValueError) as e:
+                    self.failures += 1
+                    log.warning('REST POST %s to %s failed: %s', target, ip, e)
+                if not batch.future.done():
+                    batch.future.set_result(response)
+        finally:
+            if batch is not None and not batch.future.done():
+                batch.future.set_result(None) # cancelled mid POST
+            if self.flushing.get(key) is asyncio.current_task():
+                del self.flushing[key]
+
+    # --------------------------------------------------------
+    # One camera's connection, or all of them: POSTs still
+    # waiting or going out are dropped, their callers get None
+    # --------------------------------------------------------
+    def close(self, ip=None):
+        for key in [key for key in self.flushing if ip is None or key[0] == ip]:
+            self.flushing.pop(key).cancel()
+        for key in [key for key in self.pending if ip is None or key[0] == ip]:
+            batch = self.pending.pop(key)
+            if not batch.future.done():
+                batch.future.set_result(None)
+        for thisIp in ([ip] if ip is not None else list(self.connections)):
+            connection = self.connections.pop(thisIp, None)
+            if connection is not None:
+                connection.close()
@@ -0,0 +1,518 @@
+'''
+Description:
+    Local VISCA-over-IP stand-in for the Birddog P200.
+
+    One EmulatedCamera per camera in osc_visca_config.json, each on its own
+    UDP endpoint. It answers the way the P200 does: an ACK (y0 4z FF) and a
+    completion (y0 5z FF) per command, errors for commands it can't take
+    (syntax, buffer full, not executable while powered off, canceled), and
+    replies to the inquiries the server sends (focus mode, power, pan/tilt,
+    zoom and focus position, and the lens / camera control block
+    inquiries).
+
+    Pan/tilt, zoom, focus and preset moves take time: positions move at a
+    rate set by the speed in the command, and the completion only goes out
+    once the move is done. A moving command holds one of the camera's two
+    command sockets (z) until then, a third one gets buffer full.
+
+    Latency, jitter and packet loss can be set to see how the server copes
+    with a slow or lossy network.
+
+    RestEmulator stands in for the camera's REST API (birddogavsetup and
+    the other settings pages) over keep-alive HTTP/1.1: GET returns a
+    page's settings as JSON, POST merges the JSON body into them.
+
+    Usage:
+        python camera_emulator.py [config] --loopback --write-config emulated_config.json
+        python osc_visca_server.py emulated_config.json
+
+    With --loopback, camera N listens on 127.0.0.N instead of its real IP,
+    and --write-config writes a copy of the config pointing at those
+    addresses (and at the REST port, --rest-port). bench_osc_visca.py runs the emulator in process.
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import visca_encoder as visca
+import visca_decoder
+
+# --------------------------------------------------------
+#  Settings
+# --------------------------------------------------------
+default_latency = 0.002     # seconds before a reply goes out
+default_jitter = 0.001      # +/- seconds added to every reply
+default_loss = 0.0          # fraction of datagrams lost, each way
+default_pan_rate = 100.0    # degrees per second at the top pan/tilt speed (0x18)
+default_zoom_time = 3.0     # seconds for a full wide to tele zoom (or focus travel)
+default_recall_time = 2.0   # seconds for a preset recall
+
+camera_port = 52381
+rest_port = 8080 # the real cameras use 80
+
+top_pan_speed = visca.top_pan_speed
+top_tilt_speed = visca.top_tilt_speed
+units_per_degree = visca.rangeP / visca.rangePD      # VISCA pan units per degree
+tilt_units_per_degree = visca.rangeT / visca.rangeTD # and tilt
+
+# reply layouts are shared with the decoder, see visca_decoder
+completion = b'\x90\x50'
+
+
+def spread_byte(value):
+    # 0xAB -> 0x0A0B
+    return ((value & 0xF0) << 4) | (value & 0x0F)
+
+def signed(position):
+    return position - 0x10000 if position & 0x8000 else position
+
+
+# ==============================================================
+#  Axis: one position that moves at a fixed rate
+# ==============================================================
+class Axis:
+    '''Position in VISCA units, moving linearly towards a target or at a
+    constant velocity, evaluated lazily from the loop time.'''
+
+    def __init__(self, low, high, position=0):
+        self.low = low
+        self.high = high
+        self.start = position
+        self.startedAt = 0.0
+        self.velocity = 0.0  # units per second, signed
+        self.target = None   # stop here, None for a continuous drive
+
+    def position(self, now):
+        position = self.start + self.velocity * (now - self.startedAt)
+        if self.target is not None:
+            if (self.velocity > 0 and position >= self.target) or (self.velocity < 0 and position <= self.target):
+                position = self.target
+        return int(round(min(self.high, max(self.low, position))))
+
+    def moving(self, now):
+        if self.velocity == 0:
+            return False
+        position = self.position(now)
+        if self.target is not None:
+            return position != self.target
+        return self.low < position < self.high
+
+    def move_to(self, now, target, rate):
+        # returns the seconds the move will take
+        self.start = self.position(now)
+        self.startedAt = now
+        self.target = min(self.high, max(self.low, target))
+        distance = self.target - self.start
+        if distance == 0 or rate <= 0:
+            self.start, self.velocity = self.target, 0.0
+            return 0.0
+        self.velocity = rate if distance > 0 else -rate
+        return abs(distance) / rate
+
+    def drive(self, now, velocity):
+        self.start = self.position(now)
+        self.startedAt = now
+        self.target = None
+        self.velocity = velocity
+
+    def stop(self, now):
+        self.drive(now, 0.0)
+
+
+# ==============================================================
+#  Camera model
+# ==============================================================
+class EmulatedCamera:
+    '''State and VISCA behaviour of one P200.'''
+
+    def __init__(self, camId, panRate=default_pan_rate, zoomTime=default_zoom_time,
+                 recallTime=default_recall_time):
+        self.camId = camId
+        self.panRate = panRate * units_per_degree # units per second at top speed
+        self.tiltRate = panRate * tilt_units_per_degree
+        self.zoomRate = visca.rangeZ / zoomTime   # units per second at full speed
+        self.recallTime = recallTime
+        self.power = True
+        self.focusMode = 'auto'
+        self.tally = 0
+        self.pan = Axis(signed(visca.minP), signed(visca.maxP))
+        self.tilt = Axis(signed(visca.minT), signed(visca.maxT))
+        self.zoom = Axis(visca.minZ, visca.maxZ)
+        self.focus = Axis(0x1000, 0xF000, 0x1000)
+        self.presets = {}
+        self.rest = {} # REST page -> {setting: value}
+        self.sockets = {} # socket number (1, 2) -> (kind, completion handle, sequence number)
+        self.commands = 0
+        self.inquiries = 0
+
+    # --------------------------------------------------------
+    # Command sockets: a command that takes time holds one of
+    # the two sockets until its completion
+    # --------------------------------------------------------
+    def take_socket(self, kind):
+        # a new command of the same kind cancels the one in progress
+        for socket, held in self.sockets.items():
+            if held[0] == kind:
+                return socket, held
+        for socket in (1, 2):
+            if socket not in self.sockets:
+                return socket, None
+        return None, None
+
+    # --------------------------------------------------------
+    # Command: returns [(delay, reply payload), ...] when it is
+    # answered straight away, or (kind, seconds) for a motion
+    # that completes later
+    # --------------------------------------------------------
+    def command(self, payload, now):
+        self.commands += 1
+        if len(payload) < 3 or payload[-1] != 0xFF or payload[0] not in (0x81, 0x88):
+            return [(0.0, b'\x90\x60\x02\xFF')] # syntax error
+
+        if payload == visca.IF_Clear:
+            for kind, handle, _ in self.sockets.values():
+                handle.cancel()
+            self.sockets.clear()
+            return [(0.0, bytes(visca.IF_Clear))]
+        if payload == visca.command_cancel:
+            return [(0.0, b'\x90\x41\xFF'), (0.0, b'\x90\x51\xFF')]
+
+        if not self.power and payload != visca.camera_on:
+            return [(0.0, b'\x90\x61\x41\xFF')] # not executable
+
+        motion = self.motion(payload, now)
+        if motion is None:
+            if not self.setting(payload, now):
+                return [(0.0, b'\x90\x60\x02\xFF')]
+            return [(0.0, b'\x90\x41\xFF'), (0.0, b'\x90\x51\xFF')]
+        return motion
+
+    def motion(self, payload, now):
+        # absolute moves and recalls, which complete once there
+        prefix = payload[:4]
+        if prefix == b'\x81\x01\x06\x02' and len(payload) == 15:
+            panSpeed, tiltSpeed = payload[4], payload[5]
+            duration = max(
+                self.pan.move_to(now, signed(visca.gather_nibbles(payload[6:10])), self.panRate * panSpeed / top_pan_speed),
+                self.tilt.move_to(now, signed(visca.gather_nibbles(payload[10:14])), self.tiltRate * tiltSpeed / top_tilt_speed))
+            return ('panTilt', duration)
+        if payload == visca.pan_home:
+            duration = max(self.pan.move_to(now, 0, self.panRate), self.tilt.move_to(now, 0, self.tiltRate))
+            return ('panTilt', duration)
+        if prefix == b'\x81\x01\x04\x47' and len(payload) == 9:
+            return ('zoom', self.zoom.move_to(now, visca.gather_nibbles(payload[4:8]), self.zoomRate))
+        if prefix == b'\x81\x01\x04\x47' and len(payload) == 13:
+            # zoom and focus direct together
+            return ('zoom', max(self.zoom.move_to(now, visca.gather_nibbles(payload[4:8]), self.zoomRate),
+                                self.focus.move_to(now, visca.gather_nibbles(payload[8:12]), self.zoomRate)))
+        if prefix == b'\x81\x01\x04\x48' and len(payload) == 9:
+            return ('focus', self.focus.move_to(now, visca.gather_nibbles(payload[4:8]), self.zoomRate))
+        if payload[:5] == b'\x81\x01\x04\x3F\x02' and len(payload) == 7:
+            preset = self.presets.get(payload[5])
+            if preset is not None:
+                for axis, target in zip((self.pan, self.tilt, self.zoom, self.focus), preset):
+                    axis.move_to(now, target, abs(target - axis.position(now)) / self.recallTime)
+            return ('recall', self.recallTime)
+        return None
+
+    def setting(self, payload, now):
+        # everything that takes effect straight away
+        prefix = payload[:4]
+        if payload in (visca.camera_on, visca.camera_off):
+            self.power = payload == visca.camera_on
+        elif prefix == b'\x81\x01\x06\x01' and len(payload) == 9:
+            panSpeed, tiltSpeed = payload[4], payload[5]
+            direction = {1: -1, 2: 1, 3: 0}
+            self.pan.drive(now, direction.get(payload[6], 0) * self.panRate * panSpeed / top_pan_speed)
+            self.tilt.drive(now, -direction.get(payload[7], 0) * self.tiltRate * tiltSpeed / top_tilt_speed)
+        elif prefix in (b'\x81\x01\x04\x07', b'\x81\x01\x04\x08') and len(payload) == 6:
+            # 00 stop, 02/03 standard speed, 2p/3p variable speed p (0-7)
+            axis = self.zoom if prefix[3] == 0x07 else self.focus
+            mode, speed = payload[4], 3
+            if mode >> 4 in (2, 3):
+                mode, speed = mode >> 4, mode & 0x07
+            rate = self.zoomRate * (speed + 1) / 8
+            axis.drive(now, {2: rate, 3: -rate}.get(mode, 0.0))
+        elif prefix == b'\x81\x01\x04\x38' and len(payload) == 6:
+            self.focusMode = 'auto' if payload[4] == 0x02 else 'manual'
+        elif payload[:5] == b'\x81\x01\x04\x3F\x01' and len(payload) == 7:
+            self.presets[payload[5]] = tuple(axis.position(now) for axis in (self.pan, self.tilt, self.zoom, self.focus))
+        elif payload[:5] == b'\x81\x01\x04\x3F\x00' and len(payload) == 7:
+            self.presets.pop(payload[5], None)
+        elif prefix == b'\x81\x0A\x02\x02' and len(payload) == 6:
+            self.tally = {0x01: 2, 0x02: 1}.get(payload[4], 0)
+        elif payload[:3] in (b'\x81\x01\x7E', b'\x81\x01\x04', b'\x81\x01\x06', b'\x81\x0A\x02'):
+            pass # other settings (display, picture, ...) are accepted and ignored
+        else:
+            return False
+        return True
+
+    # --------------------------------------------------------
+    # Inquiry: returns the reply payload
+    # --------------------------------------------------------
+    def inquiry(self, payload, now):
+        self.inquiries += 1
+        if payload == visca.CAM_FocusModeInq:
+            return bytes((0x90, 0x50, 0x02 if self.focusMode == 'auto' else 0x03, 0xFF))
+        if payload == visca.CAM_PowerInq:
+            return bytes((0x90, 0x50, 0x02 if self.power else 0x03, 0xFF))
+        if payload == visca_decoder.Pan_tiltPosInq:
+            return completion + visca_decoder.pan_tilt_position.pack(
+                visca.spread_nibbles(self.pan.position(now)), visca.spread_nibbles(self.tilt.position(now))) + b'\xFF'
+        if payload == visca_decoder.CAM_ZoomPosInq:
+            return completion + visca_decoder.lens_position.pack(visca.spread_nibbles(self.zoom.position(now))) + b'\xFF'
+        if payload == visca_decoder.CAM_FocusPosInq:
+            return completion + visca_decoder.lens_position.pack(visca.spread_nibbles(self.focus.position(now))) + b'\xFF'
+        if payload == visca.CAM_versionInq:
+            return bytes.fromhex('90 50 00 20 05 17 01 00 02 FF')
+        if payload == visca_decoder.CAM_LensBlockInq:
+            executing = (self.zoom.moving(now) << 2) | (self.focus.moving(now) << 1)
+            executing |= any(held[0] == 'recall' for held in self.sockets.values())
+            return completion + visca_decoder.lens_block.pack(
+                visca.spread_nibbles(self.zoom.position(now)), 0x01, 0x00, visca.spread_nibbles(self.focus.position(now)),
+                0x00, 0x01 if self.focusMode == 'auto' else 0x00, executing) + b'\xFF'
+        if payload == visca_decoder.CAM_CameraBlockInq:
+            # auto white balance, full auto exposure, F2.8, 0 dB, 1/60
+            return completion + visca_decoder.camera_block.pack(
+                spread_byte(0x80), spread_byte(0x80), 0x00, 0x05, 0x00, 0x00, 0x06, 0x11, 0x00, 0x01, 0x07) + b'\xFF'
+        return b'\x90\x60\x02\xFF'
+
+
+# ==============================================================
+#  Datagram protocol (one per emulated camera)
+# ==============================================================
+class EmulatorProtocol(asyncio.DatagramProtocol):
+    '''Unpacks VISCA-over-IP, asks the camera model, sends the replies
+    after the configured latency.
+
+    onReceive(camId, payload_type, payload, receivedAt) is called for
+    every datagram that isn't lost, receivedAt from time.perf_counter().
+    '''
+
+    def __init__(self, camera, latency=default_latency, jitter=default_jitter,
+                 loss=default_loss, onReceive=None):
+        super().__init__()
+        self.camera = camera
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.onReceive = onReceive
+        self.transport = None
+        self.loop = None
+        self.received = 0
+        self.lost = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.loop = asyncio.get_running_loop()
+
+    def delay(self):
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def reply(self, payload_type, sequence_number, payload, addr, delay):
+        if self.loss and random.random() < self.loss:
+            self.lost += 1
+            return
+        message = visca.build_message(payload_type, sequence_number, payload)
+        self.loop.call_later(self.delay() + delay, self.transport.sendto, message, addr)
+
+    def datagram_received(self, data, addr):
+        receivedAt = time.perf_counter()
+        if self.loss and random.random() < self.loss:
+            self.lost += 1
+            return
+        self.received += 1
+        if len(data) < 9:
+            return
+        payload_type, payload_length, sequence_number = visca.header.unpack_from(data)
+        payload = data[8:8 + payload_length]
+        if self.onReceive is not None:
+            self.onReceive(self.camera.camId, payload_type, payload, receivedAt)
+
+        now = self.loop.time()
+        if payload_type == visca.PAYLOAD_CONTROL:
+            # RESET of the sequence number, reply 01
+            self.reply(visca.PAYLOAD_CONTROL_REPLY, sequence_number, b'\x01', addr, 0.0)
+        elif payload_type == visca.PAYLOAD_INQUIRY:
+            self.reply(visca.PAYLOAD_REPLY, sequence_number, self.camera.inquiry(payload, now), addr, 0.0)
+        elif payload_type == visca.PAYLOAD_COMMAND:
+            self.command(sequence_number, payload, addr, now)
+
+    def command(self, sequence_number, payload, addr, now):
+        camera = self.camera
+        result = camera.command(payload, now)
+        if isinstance(result, list):
+            for delay, reply in result:
+                self.reply(visca.PAYLOAD_REPLY, sequence_number, reply, addr, delay)
+            return
+
+        kind, duration = result
+        socket, superseded = camera.take_socket(kind)
+        if socket is None:
+            self.reply(visca.PAYLOAD_REPLY, sequence_number, b'\x90\x60\x03\xFF', addr, 0.0) # buffer full
+            return
+        if superseded is not None:
+            # the move in progress on that socket ends with "canceled"
+            _, handle, previous = superseded
+            handle.cancel()
+            self.reply(visca.PAYLOAD_REPLY, previous, bytes((0x90, 0x60 | socket, 0x04, 0xFF)), addr, 0.0)
+        self.reply(visca.PAYLOAD_REPLY, sequence_number, bytes((0x90, 0x40 | socket, 0xFF)), addr, 0.0)
+        handle = self.loop.call_later(self.delay() + duration, self.complete, socket, sequence_number, addr)
+        camera.sockets[socket] = (kind, handle, sequence_number)
+
+    def complete(self, socket, sequence_number, addr):
+        self.camera.sockets.pop(socket, None)
+        if self.loss and random.random() < self.loss:
+            self.lost += 1
+            return
+        self.transport.sendto(visca.build_message(visca.PAYLOAD_REPLY, sequence_number, bytes((0x90, 0x50 | socket, 0xFF))), addr)
+
+
+# ==============================================================
+#  REST API stand-in
+# ==============================================================
+class RestEmulator:
+    '''HTTP/1.1 with keep-alive: GET /page, POST /page (JSON).'''
+
+    def __init__(self, camera):
+        self.camera = camera
+        self.connections = 0
+        self.requests = 0
+        self.posts = [] # (page, settings) as received
+
+    def respond(self, method, page, body):
+        if method == 'GET':
+            return 200, self.camera.rest.get(page, {})
+        if method == 'POST':
+            try:
+                settings = json.loads(body)
+            except ValueError:
+                return 400, {'error': 'bad json'}
+            self.posts.append((page, settings))
+            self.camera.rest.setdefault(page, {}).update(settings)
+            return 200, self.camera.rest[page]
+        return 405, {'error': 'method not allowed'}
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request = await reader.readline()
+                if not request:
+                    break
+                method, path, version = request.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                self.requests += 1
+                status, reply = self.respond(method, path.strip('/'), body)
+                data = json.dumps(reply).encode()
+                writer.write(('HTTP/1.1 %d OK\r\nContent-Type: application/json\r\n'
+                              'Content-Length: %d\r\n\r\n' % (status, len(data))).encode() + data)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+# --------------------------------------------------------
+#  Config helpers
+# --------------------------------------------------------
+def camera_addresses(configs, loopback=False):
+    # camId -> ip, the same numbering as the server ("0" is all cameras)
+    camInfo = configs["camInfo"]
+    addresses = {}
+    for this in range(camInfo["numCamera"]):
+        camId = str(this+1)
+        addresses[camId] = '127.0.0.%d' % (this+1) if loopback else camInfo["camera"+camId]["ip"]
+    return addresses
+
+def emulated_config(configs, addresses, restPort=None):
+    emulated = json.loads(json.dumps(configs))
+    for camId, ip in addresses.items():
+        emulated["camInfo"]["camera"+camId]["ip"] = ip
+    if restPort:
+        emulated["restPort"] = restPort
+    return emulated
+
+
+async def start_emulators(addresses, port=camera_port, onReceive=None, **settings):
+    '''Starts one emulated camera per address, returns camId -> protocol.'''
+    loop = asyncio.get_running_loop()
+    cameraSettings = {name: settings.pop(name) for name in ('panRate', 'zoomTime', 'recallTime') if name in settings}
+    protocols = {}
+    for camId, ip in addresses.items():
+        camera = EmulatedCamera(camId, **cameraSettings)
+        _, protocols[camId] = await loop.create_datagram_endpoint(
+            lambda camera=camera: EmulatorProtocol(camera, onReceive=onReceive, **settings), local_addr=(ip, port))
+    return protocols
+
+
+async def start_rest_emulators(protocols, addresses, port=rest_port):
+    '''REST API for the cameras start_emulators returned, camId -> RestEmulator.'''
+    emulators = {}
+    for camId, ip in addresses.items():
+        emulators[camId] = RestEmulator(protocols[camId].camera)
+        await asyncio.start_server(emulators[camId].handle, ip, port)
+    return emulators
+
+
+# --------------------------------------------------------
+#  Command line
+# --------------------------------------------------------
+def add_arguments(parser):
+    parser.add_argument('--latency', type=float, default=default_latency*1000, help='reply latency in ms')
+    parser.add_argument('--jitter', type=float, default=default_jitter*1000, help='+/- reply jitter in ms')
+    parser.add_argument('--loss', type=float, default=default_loss, help='fraction of datagrams lost each way')
+    parser.add_argument('--pan-rate', type=float, default=default_pan_rate, help='degrees per second at top speed')
+    parser.add_argument('--zoom-time', type=float, default=default_zoom_time, help='seconds for a full zoom')
+    parser.add_argument('--recall-time', type=float, default=default_recall_time, help='seconds for a preset recall')
+    parser.add_argument('--rest-port', type=int, default=rest_port, help='REST API port (0: no REST API)')
+
+def emulator_settings(args):
+    return {'latency': args.latency/1000, 'jitter': args.jitter/1000, 'loss': args.loss,
+            'panRate': args.pan_rate, 'zoomTime': args.zoom_time, 'recallTime': args.recall_time}
+
+def main():
+    parser = argparse.ArgumentParser(description='Emulate the P200 cameras in the config')
+    parser.add_argument('config', nargs='?', default='osc_visca_config.json')
+    parser.add_argument('--loopback', action='store_true', help='listen on 127.0.0.N instead of the camera IPs')
+    parser.add_argument('--write-config', help='write a copy of the config pointing at the emulators')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    with open(args.config) as json_file:
+        configs = json.load(json_file)
+    addresses = camera_addresses(configs, args.loopback)
+    if args.write_config:
+        with open(args.write_config, 'w') as json_file:
+            json.dump(emulated_config(configs, addresses, args.rest_port), json_file, indent=4)
+
+    loop = asyncio.get_event_loop()
+    protocols = loop.run_until_complete(start_emulators(addresses, **emulator_settings(args)))
+    if args.rest_port:
+        loop.run_until_complete(start_rest_emulators(protocols, addresses, args.rest_port))
+    for camId, ip in addresses.items():
+        print('Camera', camId, 'emulated on', ip)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        for camId, protocol in protocols.items():
+            print('Camera', camId, protocol.camera.commands, 'commands,', protocol.camera.inquiries,
+                  'inquiries,', protocol.lost, 'lost')
+
+if __name__ == '__main__':
+    main()
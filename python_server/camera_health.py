@@ -0,0 +1,130 @@
+'''
+Description:
+    Per camera round trip time estimate and circuit breaker.
+
+    RttEstimator keeps a smoothed RTT and its variation from the ACKs and
+    inquiry replies of first tries (a retried command's reply can't be
+    told apart from the earlier try's, so it isn't sampled). The
+    transport derives its timeouts from it: srtt + 4 * rttvar, doubled
+    for every retry, between min_timeout and the transport's fixed
+    timeout, so a camera on the LAN that answers in 5 ms is retried
+    after ~50 ms instead of a full second.
+
+    CircuitBreaker counts consecutive failures (commands that ran out of
+    retries, inquiries that timed out). After failure_threshold of them
+    the camera is offline: commands and inquiries fail straight away
+    instead of costing their timeouts, and a probe task asks the camera
+    a cheap inquiry (power) every probe_interval seconds, backing off to
+    max_probe_interval. The first answer brings the camera back online.
+
+    onChange(camId, online) is called on every switch.
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import asyncio
+
+import visca_encoder as visca
+import server_log
+
+# --------------------------------------------------------
+#  Settings
+# --------------------------------------------------------
+log = server_log.logger('health')
+min_timeout = 0.05        # seconds, lower bound for any derived timeout
+failure_threshold = 3     # consecutive failures before a camera is offline
+probe_interval = 1.0      # seconds between probes of an offline camera, doubling
+max_probe_interval = 10.0
+probe_timeout = 0.5       # seconds to wait for a probe reply
+
+probe_payload = visca.CAM_PowerInq # answered even in standby
+
+
+# ==============================================================
+#  RTT estimate (Jacobson / Karels, as in TCP)
+# ==============================================================
+class RttEstimator:
+    __slots__ = ('srtt', 'rttvar', 'samples')
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+
+    def observe(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.samples += 1
+
+    def timeout(self, maximum, tries=0):
+        # seconds to wait for a reply to the (tries+1)th try
+        if self.srtt is None:
+            return maximum
+        return min(maximum, max(min_timeout, self.srtt + 4 * self.rttvar) * (2 ** tries))
+
+
+# ==============================================================
+#  Circuit breaker
+# ==============================================================
+class CircuitBreaker:
+    '''probe is a coroutine function returning True if the camera answered.'''
+
+    def __init__(self, camId, probe, onChange=None, threshold=failure_threshold):
+        self.camId = camId
+        self.probe = probe
+        self.onChange = onChange
+        self.threshold = threshold
+        self.failures = 0
+        self.online = True
+        self.probeTask = None
+        self.trips = 0
+
+    @property
+    def open(self):
+        return not self.online
+
+    def success(self):
+        self.failures = 0
+        if not self.online:
+            self.set_online(True)
+
+    def failure(self):
+        self.failures += 1
+        if self.online and self.failures >= self.threshold:
+            self.trips += 1
+            self.set_online(False)
+
+    def set_online(self, online):
+        self.online = online
+        if online:
+            self.failures = 0
+            if self.probeTask is not None:
+                self.probeTask.cancel()
+                self.probeTask = None
+        elif self.probeTask is None:
+            self.probeTask = asyncio.ensure_future(self.probe_loop())
+        log.info('Camera %s is %s', self.camId, 'online' if online else 'offline')
+        if self.onChange is not None:
+            self.onChange(self.camId, online)
+
+    async def probe_loop(self):
+        interval = probe_interval
+        try:
+            while not self.online:
+                await asyncio.sleep(interval)
+                if await self.probe():
+                    self.probeTask = None
+                    self.success()
+                    return
+                interval = min(max_probe_interval, interval * 2)
+        except asyncio.CancelledError:
+            pass
+
+    def stop(self):
+        if self.probeTask is not None:
+            self.probeTask.cancel()
+            self.probeTask = None
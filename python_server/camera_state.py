@@ -0,0 +1,111 @@
+'''
+Description:
+    Server-side model of what each camera is doing.
+
+    Every outgoing command records what it asked the camera to do
+    (command()), and inquiry replies record what the camera reports
+    (observe()). parse_osc_message asks command() before sending: if the
+    camera was already told the same thing within holdTime seconds the
+    command is a no-op and is skipped, e.g. the second pan_stop of a
+    button release or an unchanged tally.
+
+    Fields:
+        online      True / False, from the circuit breaker (visca_transport);
+                    forget() without names leaves it alone
+        power       'on' / 'off'
+        tally       0 off, 1 on, 2 blink
+        focusMode   'auto' / 'manual'
+        preset      last recalled memory number
+        panTilt     ('stop',), ('home',), (direction, panSpeed, tiltSpeed)
+                    or ('absolute', panSpeed, tiltSpeed, panPosition, tiltPosition)
+        zoom        ('stop',), ('tele', speed), ('wide', speed) or ('direct', position)
+        focus       ('stop',), ('far', speed), ('near', speed) or ('direct', position)
+
+    Reported by the poller only (see status_poller / visca_decoder):
+        zoomPosition, focusPosition, panPosition, tiltPosition (16 bit),
+        whiteBalance, exposureMode, shutter, iris, gain
+
+    onChange(camId, name, value) fires whenever a field's value changes,
+    from either side, which makes the state the one place control surface
+    feedback is driven from. A command the camera didn't take is
+    reverted, so the state never keeps a value the camera was only
+    asked for.
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import time
+
+# --------------------------------------------------------
+#  Settings
+# --------------------------------------------------------
+default_hold_time = 2.0 # seconds a commanded value is trusted for suppression
+kept_fields = ('online',) # about the camera, not what it is doing
+
+
+# ==============================================================
+#  Camera state
+# ==============================================================
+class CameraState:
+    '''Last commanded / observed values for one camera.'''
+
+    def __init__(self, camId, onChange=None, holdTime=default_hold_time):
+        self.camId = camId
+        self.onChange = onChange
+        self.holdTime = holdTime
+        self.values = {}  # name -> value
+        self.updated = {} # name -> time.monotonic() of the last command/reply
+        self.suppressed = 0
+
+    def get(self, name, default=None):
+        return self.values.get(name, default)
+
+    # --------------------------------------------------------
+    # Outgoing command: returns False if the camera is already
+    # known to be in this state (skip the send), True otherwise
+    # --------------------------------------------------------
+    def command(self, name, value):
+        now = time.monotonic()
+        if name in self.values and self.values[name] == value and now - self.updated[name] < self.holdTime:
+            self.suppressed += 1
+            return False
+        self.set(name, value, now)
+        return True
+
+    # --------------------------------------------------------
+    # Inquiry reply: what the camera says is always taken,
+    # None means the camera didn't answer (state unknown)
+    # --------------------------------------------------------
+    def observe(self, name, value):
+        if value is None:
+            self.forget(name)
+        else:
+            self.set(name, value, time.monotonic())
+
+    def set(self, name, value, now=None):
+        old = self.values.get(name)
+        self.values[name] = value
+        self.updated[name] = time.monotonic() if now is None else now
+        if old != value and self.onChange is not None:
+            self.onChange(self.camId, name, value)
+
+    # --------------------------------------------------------
+    # A command the camera didn't take (refused, superseded,
+    # offline): forget its value, unless a newer command has
+    # replaced it since
+    # --------------------------------------------------------
+    def revert(self, name, value):
+        if name in self.values and self.values[name] == value:
+            self.forget(name)
+
+    # --------------------------------------------------------
+    # The camera may have moved on its own (preset recall,
+    # another controller, no reply): next command always goes
+    # --------------------------------------------------------
+    def forget(self, *names):
+        for name in names or [name for name in self.values if name not in kept_fields]:
+            if name in self.values:
+                del self.values[name]
+                del self.updated[name]
+                if self.onChange is not None:
+                    self.onChange(self.camId, name, None)
@@ -0,0 +1,89 @@
+'''
+Description:
+    Watches the server's JSON config for edits.
+
+    The file's modification time and size are checked every interval
+    seconds (no extra dependencies, and a stat is cheap next to the
+    cameras' traffic). When they change the file is read again and, if it
+    parses and differs from the last good config, onChange(configs) is
+    called. A half-saved or broken file is reported once and skipped: the
+    server keeps running on the last good config until the file is fixed.
+
+    check() does the same on demand (the reload_config OSC command).
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import asyncio
+import json
+import os
+
+import server_log
+
+# --------------------------------------------------------
+#  Settings
+# --------------------------------------------------------
+log = server_log.logger('config')
+default_interval = 2.0 # seconds between checks of the file
+
+
+# ==============================================================
+#  Watcher
+# ==============================================================
+class ConfigWatcher:
+    def __init__(self, path, onChange, configs=None, interval=default_interval):
+        self.path = path
+        self.onChange = onChange
+        self.configs = configs # last good config
+        self.interval = interval
+        self.signature = self.stat()
+        self.task = None
+        self.reloads = 0
+        self.errors = 0
+
+    def stat(self):
+        try:
+            info = os.stat(self.path)
+        except OSError:
+            return None
+        return info.st_mtime_ns, info.st_size
+
+    def start(self):
+        if self.task is None and self.interval:
+            self.task = asyncio.ensure_future(self.watch_loop())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def watch_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            signature = self.stat()
+            if signature is not None and signature != self.signature:
+                self.signature = signature
+                self.check()
+
+    # --------------------------------------------------------
+    # Read the file: True if a new config was applied
+    # --------------------------------------------------------
+    def check(self):
+        try:
+            with open(self.path) as json_file:
+                configs = json.load(json_file)
+        except (OSError, ValueError) as e:
+            self.errors += 1
+            log.warning('Config %s not reloaded: %s', self.path, e)
+            return False
+        if configs == self.configs:
+            return False
+        try:
+            self.onChange(configs)
+        except Exception as e:
+            self.errors += 1
+            log.warning('Config %s not applied: %s', self.path, e)
+            return False
+        self.configs = configs
+        self.reloads += 1
+        return True
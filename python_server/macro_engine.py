@@ -0,0 +1,388 @@
+'''
+Description:
+    Timed OSC macros, run on the server's asyncio loop.
+
+    A macro is a list of OSC commands, each at a time in milliseconds
+    from the start of the macro, kept in a JSON file next to the config
+    ("macroFile", reread when it changes):
+
+        {
+            "pan_and_cut": [
+                {"at": 0,    "path": "/2/pan_left", "args": [3, 3]},
+                {"at": 0,    "path": "/1/zoom_tele_variable", "args": [2]},
+                {"at": 4000, "path": "/2/pan_stop"},
+                {"at": 4000, "path": "/1/zoom_stop"},
+                {"at": 4000, "path": "/0/memory_recall", "args": [3]}
+            ],
+            "slow_push": {"steps": [...], "onAbort": [{"path": "/1/zoom_stop"}]}
+        }
+
+    /0/macro_run NAME starts a macro (from the top again if it is
+    running), /0/macro_abort NAME stops it, /0/macro_abort every macro;
+    its "onAbort" steps run straight away. Every step is decoded when the
+    macro starts (a macro with a bad step doesn't start) and then runs
+    through the route table like an operator's command. Steps at the same
+    time run in one go, as a bundle does. Nothing waits in between, so
+    live commands keep going and can take over a camera the macro moves.
+
+    Steps are timed by a timer wheel (TimerWheel): one slot per
+    millisecond tick, so adding or cancelling a step costs the same
+    however many are pending, and the loop is only woken for ticks that
+    have something to run. How late every step ran (the loop being busy,
+    timer resolution) is kept: logged when a macro ends, sent to the
+    control surface as /macro_jitter and, with metrics enabled, exported
+    as macro_step_late_seconds.
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import asyncio
+import json
+import math
+import time
+from collections import deque, namedtuple
+
+import server_log
+
+# --------------------------------------------------------
+#  Settings
+# --------------------------------------------------------
+log = server_log.logger('macro')
+default_macro_file = 'osc_visca_macros.json'
+default_tick = 0.001       # seconds per timer wheel slot
+default_slots = 1024       # slots in the wheel (ticks per turn)
+max_jitter_samples = 1000  # latest step delays kept for the percentiles
+
+# a macro as defined: steps and onAbort are [(at ms, path, args), ...]
+Macro = namedtuple('Macro', 'steps onAbort')
+
+
+# ==============================================================
+#  Timer wheel
+# ==============================================================
+class Timer:
+    '''A callback at a time on the loop clock, see TimerWheel.call_at.'''
+
+    __slots__ = ('wheel', 'when', 'tick', 'callback', 'args', 'cancelled')
+
+    def __init__(self, wheel, when, tick, callback, args):
+        self.wheel = wheel
+        self.when = when
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self.wheel.remove(self)
+
+
+class Jitter:
+    '''How late timers ran (seconds), the latest max_samples of them.'''
+
+    def __init__(self, maxSamples=max_jitter_samples):
+        self.samples = deque(maxlen=maxSamples)
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def quantile(self, fraction):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self):
+        return 'p50 %.2f ms / p99 %.2f ms, max %.2f ms of %d' % (
+            self.quantile(0.5) * 1000, self.quantile(0.99) * 1000, self.max * 1000, self.count)
+
+
+class TimerWheel:
+    '''Millisecond timers on the asyncio loop.
+
+    A timer goes in the slot of its tick (tick number modulo the number
+    of slots), timers a turn or more ahead share the slot with nearer
+    ones and wait for their tick. One loop call_at is pending at a time,
+    for the earliest tick with a timer; a timer never runs before its
+    time.'''
+
+    def __init__(self, tick=default_tick, slots=default_slots):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)] # timer -> None, in the order added
+        self.current = 0     # last tick run
+        self.pending = 0
+        self.handle = None   # loop TimerHandle of the next wake up
+        self.wakeTick = None
+        self.jitter = Jitter()
+
+    def tick_time(self, tick):
+        return tick * self.tick
+
+    def next_tick_time(self):
+        # the first tick still to come: a time timers can be lined up on
+        return self.tick_time(math.floor(asyncio.get_running_loop().time() / self.tick) + 1)
+
+    def call_at(self, when, callback, *args):
+        # when: loop.time() seconds
+        if not self.pending:
+            self.current = math.floor(asyncio.get_running_loop().time() / self.tick)
+        tick = max(self.current + 1, math.ceil(round(when / self.tick, 6)))
+        timer = Timer(self, when, tick, callback, args)
+        self.slots[tick % len(self.slots)][timer] = None
+        self.pending += 1
+        if self.wakeTick is None or tick < self.wakeTick:
+            self.wake_at(tick)
+        return timer
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(asyncio.get_running_loop().time() + delay, callback, *args)
+
+    def remove(self, timer):
+        slot = self.slots[timer.tick % len(self.slots)]
+        if timer in slot:
+            del slot[timer]
+            self.pending -= 1
+            if not self.pending:
+                self.wake_at(None)
+
+    def close(self):
+        for slot in self.slots:
+            for timer in slot:
+                timer.cancelled = True
+            slot.clear()
+        self.pending = 0
+        self.wake_at(None)
+
+    def wake_at(self, tick):
+        if self.handle is not None:
+            self.handle.cancel()
+        self.handle = None
+        self.wakeTick = tick
+        if tick is not None:
+            self.handle = asyncio.get_running_loop().call_at(self.tick_time(tick), self.run)
+
+    # --------------------------------------------------------
+    # Run every timer whose tick has come, in tick order (in
+    # the order they were added within a tick), then sleep
+    # until the next tick with a timer
+    # --------------------------------------------------------
+    def run(self):
+        self.handle = None
+        self.wakeTick = None
+        loop = asyncio.get_running_loop()
+        last = math.floor(round(loop.time() / self.tick, 6))
+        slots = len(self.slots)
+        due = []
+        for tick in range(self.current + 1, self.current + 1 + min(last - self.current, slots)):
+            slot = self.slots[tick % slots]
+            if slot:
+                ready = [timer for timer in slot if timer.tick <= last]
+                for timer in ready:
+                    del slot[timer]
+                due.extend(ready)
+        self.current = max(self.current, last)
+        self.pending -= len(due)
+        due.sort(key=lambda timer: timer.tick)
+        for timer in due:
+            if timer.cancelled: # by one run before it
+                continue
+            timer.cancelled = True
+            self.jitter.add(max(0.0, loop.time() - timer.when))
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                log.warning('Timer %s failed: %s', timer.callback, e)
+        # a callback may have added timers later than ones already waiting
+        self.wake_at(self.next_tick() if self.pending else None)
+
+    def next_tick(self):
+        # the first tick of the coming turn with a timer in it, or the
+        # end of the turn if every timer is further ahead
+        slots = len(self.slots)
+        for tick in range(self.current + 1, self.current + 1 + slots):
+            for timer in self.slots[tick % slots]:
+                if timer.tick == tick:
+                    return tick
+        return self.current + slots
+
+
+# ==============================================================
+#  Macro definitions
+# ==============================================================
+def parse_steps(name, steps):
+    # [{"at": ms, "path": "/N/command", "args": [...]}, ...] ->
+    # [(at, path, args), ...] sorted by time, raises ValueError
+    parsed = []
+    if not isinstance(steps, list):
+        raise ValueError('macro %s: steps must be a list' % name)
+    for step in steps:
+        if not isinstance(step, dict) or not isinstance(step.get("path"), str) or not step["path"].startswith('/'):
+            raise ValueError('macro %s: bad step %r' % (name, step))
+        at = step.get("at", 0)
+        args = step.get("args", [])
+        if isinstance(at, bool) or not isinstance(at, (int, float)) or at < 0:
+            raise ValueError('macro %s: bad time in %r' % (name, step))
+        if not isinstance(args, list):
+            args = [args]
+        parsed.append((at, step["path"], args))
+    parsed.sort(key=lambda step: step[0])
+    return parsed
+
+def parse_macros(definitions):
+    # the macro file -> {name: Macro}, raises ValueError
+    if not isinstance(definitions, dict):
+        raise ValueError('macros must be an object of name: steps')
+    macros = {}
+    for name, macro in definitions.items():
+        if isinstance(macro, dict):
+            macros[name] = Macro(parse_steps(name, macro.get("steps", [])), parse_steps(name, macro.get("onAbort", [])))
+        else:
+            macros[name] = Macro(parse_steps(name, macro), [])
+    return macros
+
+def load_macros(path):
+    with open(path) as json_file:
+        return json.load(json_file)
+
+
+# ==============================================================
+#  Engine
+# ==============================================================
+class MacroRun:
+    '''One macro running: its timers and what to do if it's aborted.'''
+
+    __slots__ = ('name', 'sender', 'timers', 'onAbort', 'started', 'late')
+
+    def __init__(self, name, sender, onAbort):
+        self.name = name
+        self.sender = sender
+        self.timers = []
+        self.onAbort = onAbort # [(path, calls), ...]
+        self.started = None    # loop time of "at": 0
+        self.late = 0.0        # latest any of its steps ran
+
+
+class MacroEngine:
+    '''Runs the macros: resolve(path, args) is the route table's
+    (Route, camId, values) lookup and run(sender, calls, received) runs
+    what it found, as for OSC from sender that arrived (perf_counter())
+    when the step was due. onEvent(command, argument) is feedback for
+    the control surface. In sharded mode the supervisor runs them, its
+    resolve and run passing every step on to the camera's worker.'''
+
+    def __init__(self, resolve, run, onEvent, observe=None):
+        self.resolve = resolve
+        self.run = run
+        self.onEvent = onEvent
+        self.observe = observe # observe(macro name, camId, seconds late) per step
+        self.macros = {}  # name -> Macro
+        self.running = {} # name -> MacroRun
+        self.wheel = TimerWheel()
+        self.started = 0
+        self.aborted = 0
+        self.failed = 0
+
+    def define(self, definitions):
+        # the macro file's contents; raises ValueError (and keeps the
+        # macros it had) if they can't be used
+        self.macros = parse_macros(definitions)
+        log.info('%d macro(s) defined: %s', len(self.macros), ', '.join(sorted(self.macros)))
+
+    def prepare(self, name, steps):
+        # [(at, path, args)] -> [(at, [(path, call), ...])], steps at
+        # the same time together; None if a step doesn't resolve
+        timed = []
+        for at, path, args in steps:
+            call = self.resolve(path, args)
+            if call is None:
+                log.warning('Macro %s not started: %s %s is not a command', name, path, args)
+                return None
+            if timed and timed[-1][0] == at:
+                timed[-1][1].append((path, call))
+            else:
+                timed.append((at, [(path, call)]))
+        return timed
+
+    # --------------------------------------------------------
+    # Start / abort
+    # --------------------------------------------------------
+    def start(self, name, sender=None):
+        macro = self.macros.get(name)
+        if macro is None:
+            log.warning('No macro %s', name)
+            return False
+        timed = self.prepare(name, macro.steps)
+        onAbort = self.prepare(name, macro.onAbort)
+        if timed is None or onAbort is None:
+            self.failed += 1
+            self.onEvent('macro_failed', name)
+            return False
+        if name in self.running:
+            self.cancel(name)
+            log.info('Macro %s restarted', name)
+        run = MacroRun(name, sender, [call for at, calls in onAbort for call in calls])
+        run.started = self.wheel.next_tick_time()
+        run.timers = [self.wheel.call_at(run.started + at / 1000.0, self.run_step, run, run.started + at / 1000.0,
+                                         calls, i == len(timed) - 1)
+                      for i, (at, calls) in enumerate(timed)]
+        self.running[name] = run
+        self.started += 1
+        log.info('Macro %s started: %d step(s) over %.3f s', name, sum(len(calls) for at, calls in timed),
+                 timed[-1][0] / 1000.0 if timed else 0.0)
+        self.onEvent('macro_running', name)
+        if not timed:
+            self.finish(run)
+        return True
+
+    def cancel(self, name):
+        run = self.running.pop(name, None)
+        if run is not None:
+            for timer in run.timers:
+                timer.cancel()
+        return run
+
+    def abort(self, name=None):
+        # name None: every running macro
+        names = list(self.running) if name is None else [name]
+        for thisName in names:
+            run = self.cancel(thisName)
+            if run is None:
+                continue
+            self.aborted += 1
+            if run.onAbort:
+                self.run(run.sender, [call for path, call in run.onAbort])
+            log.info('Macro %s aborted after %.3f s', thisName, asyncio.get_running_loop().time() - run.started)
+            self.onEvent('macro_aborted', thisName)
+
+    def close(self):
+        self.running = {}
+        self.wheel.close()
+
+    # --------------------------------------------------------
+    # A tick with steps: run them (one go, like a bundle)
+    # --------------------------------------------------------
+    def run_step(self, run, when, calls, last):
+        late = max(0.0, asyncio.get_running_loop().time() - when)
+        run.late = max(run.late, late)
+        if self.observe is not None:
+            for path, (route, camId, values) in calls:
+                self.observe(run.name, camId, late)
+        try:
+            self.run(run.sender, [call for path, call in calls], time.perf_counter() - late)
+        finally:
+            if last:
+                self.finish(run)
+
+    def finish(self, run):
+        if self.running.get(run.name) is run:
+            del self.running[run.name]
+        log.info('Macro %s done, steps up to %.2f ms late (all macros: %s)',
+                 run.name, run.late * 1000, self.wheel.jitter.summary())
+        self.onEvent('macro_done', run.name)
+        self.onEvent('macro_jitter', self.wheel.jitter.summary())
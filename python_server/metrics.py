@@ -0,0 +1,220 @@
+'''
+Description:
+    Command latency instrumentation.
+
+    parse_osc_message starts a Trace for every OSC message it handles
+    (OSC receive time, command name, camera). The receive time is taken
+    when the datagram arrives; a timed bundle or macro step counts from
+    the time it was due. The trace rides along in a
+    context variable, which asyncio copies into every Task created while
+    handling the message, so the VISCA transport can stamp the send, ACK
+    and completion times without any extra arguments being passed down.
+
+    The stamps feed per camera, per command latency histograms, next to
+    counters for retries, timeouts and drops. They can be read as
+    Prometheus text on http://127.0.0.1:<port>/metrics and are summed up
+    per camera for the control surface.
+
+    Nothing is recorded unless registry.enabled is set: with it off, the
+    cost on the hot path is one attribute check in parse_osc_message and
+    one ContextVar lookup per VISCA send.
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import asyncio
+import contextvars
+import time
+
+# --------------------------------------------------------
+#  Settings
+# --------------------------------------------------------
+default_port = 9100
+default_summary_interval = 5.0 # seconds between OSC summaries
+
+# histogram bucket upper bounds, in seconds
+buckets = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+# the trace of the OSC message being handled, if any
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+# ==============================================================
+#  Histogram
+# ==============================================================
+class Histogram:
+    '''Cumulative-bucket latency histogram (seconds).'''
+
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(buckets) + 1) # last one is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        i = 0
+        for bound in buckets:
+            if seconds <= bound:
+                break
+            i += 1
+        self.counts[i] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        # linear interpolation inside the bucket the quantile falls in
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, n in enumerate(self.counts):
+            upper = buckets[i] if i < len(buckets) else buckets[-1]
+            if n and seen + n >= rank:
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+            lower = upper
+        return buckets[-1]
+
+
+# ==============================================================
+#  Trace (one per OSC message)
+# ==============================================================
+class Trace:
+    __slots__ = ('command', 'camId', 'received', 'dispatched')
+
+    def __init__(self, command, camId, received):
+        self.command = command
+        self.camId = camId
+        self.received = received
+        self.dispatched = None # first send_visca / fader post
+
+
+# ==============================================================
+#  Registry
+# ==============================================================
+class Metrics:
+    '''Latency histograms and counters, keyed by camera and command.'''
+
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {} # (name, camId, command) -> Histogram
+        self.counters = {}   # (name, camId) -> int
+        self.collectors = [] # (kind, callable yielding (name, {label: value}, value))
+
+    # --------------------------------------------------------
+    # Hot path
+    # --------------------------------------------------------
+    def begin(self, command, camId, received=None):
+        # called on OSC receive, only when enabled; received is the
+        # perf_counter() time the datagram arrived (or was due)
+        trace = Trace(command, camId, time.perf_counter() if received is None else received)
+        current_trace.set(trace)
+        return trace
+
+    def dispatched(self):
+        trace = current_trace.get()
+        if trace is not None and trace.dispatched is None:
+            trace.dispatched = time.perf_counter()
+            self.observe('osc_dispatch_seconds', trace.camId, trace.command, trace.dispatched - trace.received)
+
+    def observe(self, name, camId, command, seconds):
+        key = (name, camId, command)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    def count(self, name, camId, n=1):
+        if self.enabled:
+            key = (name, camId)
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    # --------------------------------------------------------
+    # Stamps from the VISCA transport. trace is the value of
+    # current_trace, None when disabled or not from OSC
+    # --------------------------------------------------------
+    def sent(self, trace, camId, sentAt):
+        self.observe('visca_queue_seconds', camId, trace.command, sentAt - (trace.dispatched or trace.received))
+
+    def acked(self, trace, camId, sentAt):
+        now = time.perf_counter()
+        self.observe('visca_ack_seconds', camId, trace.command, now - sentAt)
+        self.observe('osc_to_ack_seconds', camId, trace.command, now - trace.received)
+
+    def completed(self, trace, camId, sentAt):
+        self.observe('visca_completion_seconds', camId, trace.command, time.perf_counter() - sentAt)
+
+    def add_collector(self, collector, kind='counter'):
+        # kind is the Prometheus type: 'counter' or 'gauge'
+        self.collectors.append((kind, collector))
+
+    # --------------------------------------------------------
+    # Prometheus text exposition
+    # --------------------------------------------------------
+    def render_prometheus(self):
+        lines = []
+        for name in sorted({key[0] for key in self.histograms}):
+            lines.append('# TYPE %s histogram' % name)
+            for (hname, camId, command), histogram in sorted(self.histograms.items()):
+                if hname != name:
+                    continue
+                labels = 'camera="%s",command="%s"' % (camId, command)
+                cumulative = 0
+                for bound, n in zip(buckets + ('+Inf',), histogram.counts):
+                    cumulative += n
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cumulative))
+                lines.append('%s_sum{%s} %f' % (name, labels, histogram.total))
+                lines.append('%s_count{%s} %d' % (name, labels, histogram.count))
+
+        counters = {} # (name, kind) -> [(labels, value), ...]
+        for (name, camId), value in self.counters.items():
+            counters.setdefault((name, 'counter'), []).append(({'camera': camId}, value))
+        for kind, collector in self.collectors:
+            for name, labels, value in collector():
+                counters.setdefault((name, kind), []).append((labels, value))
+        for name, kind in sorted(counters):
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, value in counters[(name, kind)]:
+                text = ','.join('%s="%s"' % item for item in sorted(labels.items()))
+                lines.append('%s{%s} %s' % (name, text, value) if text else '%s %s' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+    # --------------------------------------------------------
+    # Short per camera text for the control surface
+    # --------------------------------------------------------
+    def summary(self, camId):
+        ack = Histogram()
+        for (name, thisCam, command), histogram in self.histograms.items():
+            if name == 'osc_to_ack_seconds' and thisCam == camId:
+                ack.counts = [a + b for a, b in zip(ack.counts, histogram.counts)]
+                ack.count += histogram.count
+        timeouts = self.counters.get(('visca_timeouts_total', camId), 0)
+        if ack.count == 0:
+            return 'no data, %d timeouts' % timeouts
+        return 'p50 %.0f ms / p95 %.0f ms, %d timeouts' % (ack.quantile(0.5) * 1000, ack.quantile(0.95) * 1000, timeouts)
+
+    # --------------------------------------------------------
+    # Local HTTP endpoint: GET /metrics
+    # --------------------------------------------------------
+    async def serve(self, port=default_port, host='127.0.0.1'):
+        return await asyncio.start_server(self.handle_http, host, port)
+
+    async def handle_http(self, reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass # skip the headers
+            if request.split(b' ')[1:2] == [b'/metrics']:
+                status, body = '200 OK', self.render_prometheus().encode()
+            else:
+                status, body = '404 Not Found', b'try /metrics\n'
+            writer.write(('HTTP/1.0 %s\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                          'Content-Length: %d\r\n\r\n' % (status, len(body))).encode() + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+registry = Metrics()
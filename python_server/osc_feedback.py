@@ -0,0 +1,260 @@
+'''
+Description:
+    Long-lived OSC feedback channel to Open Stage Control.
+
+    One UDP socket is opened for the life of the server. Updates (LEDs,
+    labels, ...) are queued and flushed together on a short tick: a single
+    update goes out as a plain OSC message, several are packed into OSC
+    bundles. If the same address is updated more than once within a tick
+    only the newest value is sent (per camera, for published updates:
+    the same address about two cameras sends both).
+
+    Updates are published to every subscriber in a SubscriberRegistry:
+    control surfaces are learnt from the OSC they send (and listed in the
+    config), and forgotten after subscriber_timeout seconds of silence
+    unless they are configured. A subscriber may only want some cameras;
+    an update about a camera (camId) skips the others. Every update is
+    packed once per flush, and every bundle once per distinct camera
+    filter, however many subscribers share it.
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import asyncio
+import socket
+import struct
+import time
+
+import aiosc # for packing OSC messages and bundles
+
+import server_log
+
+# --------------------------------------------------------
+#  Settings
+# --------------------------------------------------------
+log = server_log.logger('feedback')
+flush_interval = 0.02 # seconds between flushes while updates are pending
+max_datagram = 1400   # keep bundles inside one ethernet frame
+subscriber_timeout = 60.0 # seconds a learnt subscriber stays without sending anything
+
+
+# ==============================================================
+#  Subscribers
+# ==============================================================
+class Subscriber:
+    __slots__ = ('addr', 'cameras', 'lastSeen', 'configured')
+
+    def __init__(self, addr, cameras=None, configured=False):
+        self.addr = addr           # (ip, port) feedback goes to
+        self.cameras = cameras     # frozenset of camIds, None for all
+        self.lastSeen = time.monotonic()
+        self.configured = configured # configured ones never expire
+
+
+class SubscriberRegistry:
+    '''Control surfaces getting feedback, by IP.'''
+
+    def __init__(self, port, timeout=subscriber_timeout):
+        self.port = port # feedback port of learnt subscribers
+        self.timeout = timeout
+        self.subscribers = {} # ip -> Subscriber
+        self.joined = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self.subscribers)
+
+    # --------------------------------------------------------
+    # From the config: [{"ip": .., "port": .., "cameras": [..]}]
+    # Replaces the configured subscribers, learnt ones stay
+    # --------------------------------------------------------
+    def configure(self, clients, timeout=None):
+        configured = self.configured_subscribers(clients, timeout)
+        if timeout is not None:
+            self.timeout = timeout
+        for ip, subscriber in list(self.subscribers.items()):
+            if subscriber.configured and ip not in configured:
+                del self.subscribers[ip]
+        self.subscribers.update(configured)
+
+    # ip -> Subscriber for the config's clients, ValueError if
+    # they can't be used (checked before a config is applied)
+    def configured_subscribers(self, clients, timeout=None):
+        if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float))):
+            raise ValueError('oscClientTimeout must be a number of seconds, not %r' % (timeout,))
+        if not isinstance(clients, list):
+            raise ValueError('oscClients must be a list')
+        configured = {}
+        for client in clients:
+            if not isinstance(client, dict) or not isinstance(client.get("ip"), str):
+                raise ValueError('oscClients: %r has no "ip"' % (client,))
+            port = client.get("port", self.port)
+            cameras = client.get("cameras")
+            if isinstance(port, bool) or not isinstance(port, int) or not 0 < port < 65536:
+                raise ValueError('oscClients: bad port in %r' % (client,))
+            if cameras is not None and not isinstance(cameras, list):
+                raise ValueError('oscClients: "cameras" must be a list in %r' % (client,))
+            configured[client["ip"]] = Subscriber((client["ip"], port),
+                                                  None if cameras is None else frozenset(str(camId) for camId in cameras),
+                                                  configured=True)
+        return configured
+
+    # A message came from ip: learn it, or keep it alive
+    def seen(self, ip, now=None):
+        subscriber = self.subscribers.get(ip)
+        if subscriber is None:
+            subscriber = self.subscribers[ip] = Subscriber((ip, self.port))
+            self.joined += 1
+            log.info('OSC client %s subscribed', ip)
+        subscriber.lastSeen = time.monotonic() if now is None else now
+        return subscriber
+
+    def set_cameras(self, ip, cameras):
+        # None for every camera
+        self.seen(ip).cameras = None if cameras is None else frozenset(cameras)
+
+    # --------------------------------------------------------
+    # /N/subscribe adds camera N to the sender's feedback
+    # (after which it only gets the cameras it subscribed to),
+    # /0/subscribe is every camera again. /N/unsubscribe drops
+    # camera N, /0/unsubscribe all of them (updates not about
+    # a camera still come). camIds: every camera there is
+    # --------------------------------------------------------
+    def subscribe(self, ip, camId):
+        cameras = self.seen(ip).cameras
+        self.set_cameras(ip, None if camId == "0" else (cameras or frozenset()) | {camId})
+
+    def unsubscribe(self, ip, camId, camIds):
+        cameras = self.seen(ip).cameras
+        if camId == "0":
+            self.set_cameras(ip, ())
+        else:
+            self.set_cameras(ip, [thisKey for thisKey in (cameras if cameras is not None else camIds) if thisKey != camId])
+
+    def expire(self, now=None):
+        now = time.monotonic() if now is None else now
+        for ip, subscriber in list(self.subscribers.items()):
+            if not subscriber.configured and now - subscriber.lastSeen > self.timeout:
+                del self.subscribers[ip]
+                self.expired += 1
+                log.info('OSC client %s expired', ip)
+
+    def groups(self):
+        # camera filter -> addresses with that filter
+        groups = {}
+        for subscriber in self.subscribers.values():
+            groups.setdefault(subscriber.cameras, []).append(subscriber.addr)
+        return groups
+
+
+# ==============================================================
+#  Feedback channel
+# ==============================================================
+class FeedbackChannel:
+    '''Batches OSC feedback and sends it over one persistent socket.'''
+
+    def __init__(self, subscribers=None, flushInterval=flush_interval):
+        self.subscribers = subscribers
+        self.flushInterval = flushInterval
+        self.sock = None
+        self.pending = {}   # (ip, port) -> {osc path: args}, for one destination
+        self.published = {} # (osc path, camId) -> args, for every subscriber
+        self.flushHandle = None
+        self.sentMessages = 0
+        self.sentDatagrams = 0
+
+    def open(self):
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # IPv4, UDP
+            self.sock.setblocking(False)
+        return self
+
+    def close(self):
+        if self.flushHandle is not None:
+            self.flushHandle.cancel()
+            self.flushHandle = None
+        self.flush()
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    # --------------------------------------------------------
+    # Queue an update, it goes out on the next flush: send()
+    # to one destination, publish() to every subscriber (that
+    # wants camId's updates, if it is about one camera)
+    # --------------------------------------------------------
+    def send(self, addr, osc_path, *args):
+        self.pending.setdefault(addr, {})[osc_path] = args
+        self.schedule()
+
+    def publish(self, osc_path, *args, camId=None):
+        self.published[(osc_path, camId)] = args
+        self.schedule()
+
+    def schedule(self):
+        if self.flushHandle is None:
+            self.flushHandle = asyncio.get_event_loop().call_later(self.flushInterval, self.flush)
+
+    # --------------------------------------------------------
+    # Pack everything that is pending into as few datagrams
+    # as possible and send it
+    # --------------------------------------------------------
+    def flush(self):
+        self.flushHandle = None
+        pending, self.pending = self.pending, {}
+        published, self.published = self.published, {}
+        self.open()
+        for addr, updates in pending.items():
+            self.sendto(pack_datagrams(updates), addr)
+            self.sentMessages += len(updates)
+        if published and self.subscribers is not None:
+            self.subscribers.expire()
+            messages = [(aiosc.pack_message(osc_path, *args), camId)
+                        for (osc_path, camId), args in published.items()]
+            for cameras, addrs in self.subscribers.groups().items():
+                selected = [message for message, camId in messages
+                            if cameras is None or camId is None or camId in cameras]
+                if not selected:
+                    continue
+                datagrams = bundle_messages(selected)
+                for addr in addrs:
+                    self.sendto(datagrams, addr)
+                    self.sentMessages += len(selected)
+
+    def sendto(self, datagrams, addr):
+        for datagram in datagrams:
+            try:
+                self.sock.sendto(datagram, addr)
+                self.sentDatagrams += 1
+            except OSError as e:
+                # feedback is best effort, never hold up the loop for it
+                log.warning('OSC feedback to %s failed: %s', addr, e)
+
+
+def pack_datagrams(updates):
+    return bundle_messages([aiosc.pack_message(osc_path, *args) for osc_path, args in updates.items()])
+
+def bundle_messages(messages, timetag=1):
+    # packed messages -> datagrams of at most max_datagram bytes,
+    # bundles carry timetag (1: immediately)
+    if len(messages) == 1 and timetag == 1:
+        return messages
+
+    datagrams = []
+    bundle = []
+    size = 16 # '#bundle\0' + timetag
+    for message in messages:
+        if bundle and size + 4 + len(message) > max_datagram:
+            datagrams.append(join_bundle(bundle, timetag))
+            bundle = []
+            size = 16
+        bundle.append(message)
+        size += 4 + len(message)
+    if bundle:
+        datagrams.append(join_bundle(bundle, timetag))
+    return datagrams
+
+def join_bundle(messages, timetag=1):
+    if len(messages) == 1 and timetag == 1:
+        return messages[0]
+    return b'#bundle\x00' + struct.pack('>Q', timetag) + b''.join(struct.pack('>I', len(m)) + m for m in messages)
@@ -0,0 +1,230 @@
+'''
+Description:
+    Table driven OSC routing.
+
+    Commands are registered once, each with its handler and one decoder
+    per OSC argument it uses. compile() expands them into a dict keyed by
+    the full OSC path ('/{camId}/{command}' for every camera and "0" for
+    all), so dispatching a message is one dict lookup, decoding its
+    arguments, and one call handler(camId, *values).
+
+    Paths that aren't in the table cost that one lookup and a counter;
+    they're printed only the first time they're seen. Messages whose
+    arguments don't decode (missing, wrong type) are counted and dropped
+    before the handler runs.
+
+    A command only some cameras understand (another camera model) is
+    registered with camIds, and only gets paths for those cameras.
+
+    OSC bundles are parsed as a unit, with their time tags: the protocol
+    hands the whole bundle to onBundle(addr, messages, received), each
+    message carrying the time (time.time() seconds) it should run at, or
+    None for "immediately". resolve() decodes a message without running
+    it, so a bundle can be decoded completely before any of it runs.
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import struct
+import time
+
+import aiosc
+
+import traffic_recorder
+import server_log
+
+# --------------------------------------------------------
+#  Settings
+# --------------------------------------------------------
+log = server_log.logger('osc')
+max_unknown_paths = 100 # distinct unknown paths remembered (and printed once)
+
+
+# --------------------------------------------------------
+#  Argument decoders: OSC argument -> value, raise
+#  ValueError or TypeError if it can't be used
+# --------------------------------------------------------
+def number(arg):
+    return float(arg)
+
+def text(arg):
+    # a name: /0/macro_run 3 (a number) finds "3"
+    if isinstance(arg, float) and arg.is_integer():
+        arg = int(arg)
+    return str(arg)
+
+def clamped(decode, low, high):
+    def clamp(arg):
+        return min(high, max(low, decode(arg)))
+    return clamp
+
+def optional(decode, default=None):
+    # a trailing argument the sender may leave out
+    def decode_optional(arg):
+        return decode(arg)
+    decode_optional.default = default
+    return decode_optional
+
+
+# ==============================================================
+#  Route
+# ==============================================================
+class Route:
+    '''One OSC command: handler(camId, *decoded arguments).'''
+
+    __slots__ = ('command', 'handler', 'decoders', 'required', 'camIds')
+
+    def __init__(self, command, handler, decoders, camIds=None):
+        self.command = command
+        self.handler = handler
+        self.decoders = decoders
+        self.required = len(decoders)
+        while self.required and hasattr(decoders[self.required-1], 'default'):
+            self.required -= 1
+        self.camIds = camIds # None for every camera
+
+    def decode(self, args):
+        # extra arguments are ignored, missing optional ones get their default
+        if len(args) >= len(self.decoders):
+            return [decode(arg) for decode, arg in zip(self.decoders, args)]
+        if len(args) < self.required:
+            raise ValueError('%s takes %d arguments' % (self.command, self.required))
+        return [decode(arg) for decode, arg in zip(self.decoders, args)] + \
+               [decode.default for decode in self.decoders[len(args):]]
+
+
+# ==============================================================
+#  Route table
+# ==============================================================
+class RouteTable:
+    def __init__(self):
+        self.commands = {} # command -> Route
+        self.paths = {}    # '/camId/command' -> (Route, camId), built by compile()
+        self.unknown = {}  # path -> times seen
+        self.rejected = 0  # messages with an unknown path
+        self.invalid = 0   # messages whose arguments didn't decode
+
+    # --------------------------------------------------------
+    # Registration
+    # --------------------------------------------------------
+    def add(self, command, handler, *decoders, camIds=None):
+        self.commands[command] = Route(command, handler, decoders, camIds)
+
+    def route(self, *commands, decoders=(), camIds=None):
+        # decorator: @routes.route('zoom_tele', 'zoom_wide', decoders=(number,))
+        def register(handler):
+            for command in commands:
+                self.add(command, handler, *decoders, camIds=camIds)
+            return handler
+        return register
+
+    def compile(self, camIds):
+        # camIds: the configured cameras, "0" (all cameras) is added here
+        paths = {}
+        for command, route in self.commands.items():
+            for camId in ["0"] + [camId for camId in camIds if camId != "0"]:
+                if route.camIds is None or camId in route.camIds:
+                    paths['/%s/%s' % (camId, command)] = (route, camId)
+        self.paths = paths
+
+    # --------------------------------------------------------
+    # Dispatch: returns the Route that handled the message,
+    # or None
+    # --------------------------------------------------------
+    def lookup(self, path):
+        entry = self.paths.get(path)
+        if entry is None:
+            self.rejected += 1
+            if path in self.unknown:
+                self.unknown[path] += 1
+            elif len(self.unknown) < max_unknown_paths:
+                self.unknown[path] = 1
+                log.warning("I don't know what to do with %s", path)
+        return entry
+
+    def resolve(self, path, args):
+        # (Route, camId, decoded arguments), None if the path is
+        # unknown or the arguments don't decode
+        entry = self.lookup(path)
+        if entry is None:
+            return None
+        route, camId = entry
+        try:
+            values = route.decode(args)
+        except (ValueError, TypeError) as e:
+            self.invalid += 1
+            log.warning('Bad arguments for %s %s: %s', path, args, e)
+            return None
+        return route, camId, values
+
+
+# --------------------------------------------------------
+#  Bundles and time tags
+# --------------------------------------------------------
+def timetag_to_time(timetag):
+    # 64 bit NTP time tag -> time.time() seconds, None for "immediately"
+    if timetag == 1:
+        return None
+    return (timetag >> 32) - aiosc.NTP_EPOCH_OFFSET + (timetag & 0xFFFFFFFF) / 2**32
+
+def time_to_timetag(seconds):
+    seconds += aiosc.NTP_EPOCH_OFFSET
+    return (int(seconds) << 32) | int((seconds % 1) * 2**32)
+
+def parse_bundle(packet):
+    # [(time or None, path, args)] in bundle order, messages of a
+    # nested bundle get its time tag. Raises on a malformed bundle
+    if len(packet) < 16 or not packet.startswith(b'#bundle\x00'):
+        raise ValueError('not an OSC bundle')
+    when = timetag_to_time(struct.unpack_from('>Q', packet, 8)[0])
+    messages = []
+    offset = 16
+    while offset < len(packet):
+        size, = struct.unpack_from('>I', packet, offset)
+        element = packet[offset+4:offset+4+size]
+        offset += 4 + size
+        if len(element) != size:
+            raise ValueError('truncated OSC bundle')
+        if element.startswith(b'#bundle'):
+            messages.extend(parse_bundle(element))
+        else:
+            path, args = aiosc.parse_message(element)
+            messages.append((when, path, args))
+    return messages
+
+
+# ==============================================================
+#  OSC protocol dispatching straight to a route table
+# ==============================================================
+class OSCRouteProtocol(aiosc.OSCProtocol):
+    '''aiosc protocol without the per-handler pattern matching: every
+    message goes to onMessage(addr, path, args, received), every bundle
+    to onBundle(addr, [(time, path, args)], received) (to onMessage, one
+    message at a time and ignoring time tags, without onBundle).
+    received is the datagram's time.perf_counter() arrival.'''
+
+    def __init__(self, onMessage, onBundle=None):
+        super().__init__()
+        self.onMessage = onMessage
+        self.onBundle = onBundle
+        self.malformed = 0
+
+    def datagram_received(self, data, addr):
+        received = time.perf_counter()
+        if traffic_recorder.recorder.enabled:
+            traffic_recorder.recorder.record(traffic_recorder.OSC_IN, addr[0], data)
+        try:
+            if data.startswith(b'#bundle'):
+                messages = parse_bundle(data)
+            else:
+                path, args = aiosc.parse_message(data)
+        except Exception:
+            self.malformed += 1
+            return
+        if not data.startswith(b'#bundle'):
+            self.onMessage(addr, path, args, received)
+        elif self.onBundle is not None:
+            self.onBundle(addr, messages, received)
+        else:
+            for _, path, args in messages:
+                self.onMessage(addr, path, args, received)
@@ -2,643 +2,1163 @@
 Author: Daniel McLean,
 Date: September 2020
 
-Description: 
+Description:
     Python Script to intercept OSC commands from programs like open source control
     and translate them into VISCA commands for a Birddog P200 cammera.
-    
+
     Usage:
         This is a server that needs to run in the background to translate
         OSC commands to birddog Cameras
         Run in dedicated terminal (not in some IDE like spyder)
-        Make sure IP addresses are correct in this file
-        
-        TODO: 
+        Make sure IP addresses are correct in osc_visca_config.json
+
+            python osc_visca_server.py [config.json]
+
+        Importing this file doesn't read the config or open any socket:
+        Server(configs) holds everything one server needs, and
+        await server.start() opens the camera sockets, resets and probes
+        every camera in parallel, starts polling and binds the OSC port.
+        main() is the command line entry point.
+
+        OSC bundles are run as a unit, at their time tag (see
+        parse_osc_bundle).
+
+        Macros (timed lists of OSC commands, "macroFile" next to the
+        config) run on the loop next to the operator's commands:
+        /0/macro_run NAME, /0/macro_abort [NAME], see macro_engine.
+
+        Log output (levels per subsystem, rotating file) is set by
+        "logging" in the config, see server_log.
+
+        --record FILE logs every OSC message in, VISCA frame out and
+        camera reply (traffic_recorder), replay_traffic.py plays the
+        OSC back.
+
+        Feedback goes to every control surface that has sent us OSC
+        recently (and to the "oscClients" in the config), optionally
+        only for some cameras: /N/subscribe, /N/unsubscribe.
+
+        The config file is watched while the server runs (and reread on
+        /0/reload_config): added cameras are started, removed ones
+        drained and closed, moved ones re-addressed, and per camera
+        settings applied, without touching the other cameras' traffic.
+
+        TODO:
           -Focus control
           -P200 Color settings (RESTful API)
-          -Config JSON file to house IP configurations
           -Recieve Info from VISCA
-          -Send Info to OSC        
-          
-    
+          -Send Info to OSC
+
+
     OSC Commands:
         /{camera ID}/{command}/ args[]
-        
+
         commands:
             pan_{X} | args: pan_speed tilt_speed
                 X = up,down,left,right,up_left,up_right,down_left,down_right
             pan_absolute_position | args: pan_speed tilt_speed abs_pan abs_tilt
             zoom_tele_variable |args: zoom_speed
             zoom_wide_variable |args: zoom_speed
-        
+            memory_set | args: preset (also measures the camera's position)
+            memory_recall | args: preset (every camera arrives together, then scene_ready)
+            scene_recall | args: preset seconds
+            macro_run | args: name
+            macro_abort | args: [name]
+
 '''
 # --------------------------------------------------------
-#  Libraries 
+#  Libraries
 # --------------------------------------------------------
-# --- External ---
-# pip3 install aiosc
-import asyncio # for receiving OSC
-import aiosc # for receiving OSC
-# pip3 install python-osc
-from pythonosc import udp_client # for sending OSC
-#import requests # For restful API
-
 # --- Standard ---
-
-from math import floor  # for fader
-import socket
-import binascii  # for printing the visca messages
+import asyncio # for receiving OSC (aiosc is used through osc_routes)
+import argparse
 import json
+import os
 import time
 
-import threading
+# --- Local ---
+import config_watch # reload the config when the file changes
+import birddog_rest # asyncio client for the cameras' REST API
+import visca_transport # asyncio VISCA-over-IP sockets (one pair per camera)
+import visca_coalesce # latest-value-wins mailbox for fader commands
+import visca_encoder as visca # binary VISCA payloads and frames
+import visca_decoder # binary VISCA replies -> typed fields
+import osc_feedback # persistent, batched OSC sender
+import status_poller # concurrent, change-only camera polling
+import camera_state # what each camera was last told / reported
+import metrics # latency histograms, counters, /metrics endpoint
+import osc_routes # OSC path -> handler table
+import traffic_recorder # OSC and VISCA traffic log, for replay_traffic.py
+import server_log # levelled logging through a background thread
+import preset_store # measured presets, synchronised scene recall
+import macro_engine # timed OSC macros on a timer wheel
+
+log = server_log.logger('osc')
+config_log = server_log.logger('config')
+visca_log = server_log.logger('visca')
+preset_log = server_log.logger('preset')
 
 
 # --------------------------------------------------------
-# Load config from JSON file
+# Config file (osc_visca_config.json, or the file given on
+# the command line, see camera_emulator.py)
 # --------------------------------------------------------
-with open('osc_visca_config.json') as json_file:
-    configs = json.load(json_file)
-    
+default_config_file = 'osc_visca_config.json'
+
+def load_config(config_file=default_config_file):
+    with open(config_file) as json_file:
+        return json.load(json_file)
+
 # --------------------------------------------------------
 # OSC server and client Settings (Open Stage Control)
 # --------------------------------------------------------
 osc_receive_port = 8002
-serverOSC_ip = '127.0.0.1' # there must be a way to listen for this... maybe osc_address[0]
 #osc_send_port = 9000
 osc_send_port = 8000
 
+# Feedback subscribers before any control surface has spoken:
+# Open Stage Control on this machine (see run/server.bat)
+default_osc_clients = [{"ip": "127.0.0.1"}]
 
 # --------------------------------------------------------
-#  Camera Settings
+#  VISCA Commands (Payloads)
+#  Prebuilt bytes and binary encoders, see visca_encoder
 # --------------------------------------------------------
-camInfo =configs["camInfo"]
-camipDic = {};
-
-# Visca Port:
-camera_port = 52381
-buffer_size = 1024
-
-#rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-#rx.bind(('127.0.0.1', camera_port))
-#rx.settimeout(5.0) # only wait for a response for 1 second
-# Sequence number container
-seqNum = {}
-lock = {}
-# Get IP, configure sequence number and sockets form JSON
-for this in range(camInfo["numCamera"]):
-    ix = this+1;#"0" is the ALL signal, so we need to skip it
-    thisCam = camInfo["camera"+str(ix)]
-    camipDic[str(ix)] = thisCam["ip"] 
-    seqNum[str(ix)] = 1;
-    lock[str(ix)] = threading.Lock()
-    
-    
+reset_seq = visca.IF_Clear#'02 00 00 01 00 00 00 01 01'
+
 # --------------------------------------------------------
-# Visca Receiver Socket setup
-# TODO: Not working
+# Camera IPs from the config: {camId: ip}
 # --------------------------------------------------------
-s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # IPv4, UDP
-s.bind(('', camera_port+1)) # for testing use the port one higher than the camera's port
-s.settimeout(1.0) # only wait for a response for 1 second
+def camera_ips(configs, camIds=None):
+    # camIds: only these cameras (a sharded mode worker's)
+    camInfo = configs["camInfo"]
+    camipDic = {}
+    for this in range(camInfo["numCamera"]):
+        ix = this+1;#"0" is the ALL signal, so we need to skip it
+        if camIds is not None and str(ix) not in camIds:
+            continue
+        thisCam = camInfo["camera"+str(ix)]
+        camipDic[str(ix)] = thisCam["ip"]
+    return camipDic
 
-# Status socket
-sStatus = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # IPv4, UDP
-sStatus.bind(('', camera_port-1)) # for testing use the port one higher than the camera's port
-sStatus.settimeout(5.0) # only wait for a response for 1 second
+def camera_config(configs, camId):
+    return configs["camInfo"]["camera"+camId]
 
 # --------------------------------------------------------
-#  VISCA Commands (Payloads)
+# Settings a camera's own entry in camInfo may override
+# (the top level value applies to every other camera)
 # --------------------------------------------------------
-# --- Misc ---
-camera_on = '81 01 04 00 02 FF'
-camera_off = '81 01 04 00 03 FF'
-information_display_off = '81 01 7E 01 18 03 FF'
-IF_Clear = '88 01 00 01 FF' #	I/F Clear
-reset_seq = IF_Clear#'02 00 00 01 00 00 00 01 01'
-command_cancel	= '81 21 FF'
-
-networkSet = '88 30 01 ff'
-
-# --- Position Memory Commands ---
-memory_recall = '81 01 04 3F 02 0p FF' # p: Memory number (=0 to F)
-memory_set = '81 01 04 3F 01 0p FF' # p: Memory number (=0 to F)
-
-# --- Focus Commands ---
-focus_stop = '81 01 04 08 00 FF'
-focus_far = '81 01 04 08 02 FF'
-focus_near = '81 01 04 08 03 FF'
-focus_far_variable = '81 01 04 08 2p FF' # 0 low to 7 high
-focus_near_variable = '81 01 04 08 3p FF' # 0 low to 7 high
-focus_direct = '81 01 04 48 0p 0q 0r 0s FF' #.replace('p', ) q, r, s
-focus_auto = '81 01 04 38 02 FF'
-focus_manual = '81 01 04 38 03 FF'
-focus_infinity = '81 01 04 18 02 FF'
-focus_one_push = '81 01 04 18 01 FF'
-
-# --- Zoom Commands ---
-zoom_stop = '81 01 04 07 00 FF'
-zoom_tele = '81 01 04 07 02 FF'
-zoom_wide = '81 01 04 07 03 FF'
-zoom_tele_variable = '81 01 04 07 2p FF' # p=0 (Low) to 7 (High)
-zoom_wide_variable = '81 01 04 07 3p FF' # p=0 (Low) to 7 (High)
-
-zoom_direct = '81 01 04 47 0p 0q 0r 0s FF' # pqrs: Zoom Position
-
-zoom_focus_direct = '81 01 04 47 0p 0q 0r 0s 0t 0u 0v 0w FF' # pqrs: Zoom Position  tuvw: Focus Position
-
-inquiry_lens_control = '81 09 7E 7E 00 FF'
-# response: 81 50 0p 0q 0r 0s 0H 0L 0t 0u 0v 0w 00 xx xx FF
-inquiry_camera_control = '81 09 7E 7E 01 FF'
-
-# --- Pan/Tilt Commands ---
-pan_stop = '81 01 06 01 15 15 03 03 FF' # replaced VV and WW with 15
-pan_home = '81 01 06 04 FF'
-pan_reset = '81 01 06 05 FF'
-# for high speed VV = 18 and WW = 17
-panDic = {
-'pan_up' : '81 01 06 01 VV WW 03 01 FF'        ,
-'pan_down' : '81 01 06 01 VV WW 03 02 FF'      ,
-'pan_left' : '81 01 06 01 VV WW 01 03 FF'      ,
-'pan_right' : '81 01 06 01 VV WW 02 03 FF'     ,
-'pan_up_left' : '81 01 06 01 VV WW 01 01 FF'   ,
-'pan_up_right' : '81 01 06 01 VV WW 02 01 FF'  ,
-'pan_down_left' : '81 01 06 01 VV WW 01 02 FF' ,
-'pan_down_right' : '81 01 06 01 VV WW 02 02 FF',
-'pan_stop' : '81 01 06 01 VV WW 03 03 FF'
+camera_settings = {
+    "commandWindow": visca_transport.command_window, # commands waiting for their ACK at once
+    "faderMaxSendRate": visca_coalesce.default_max_rate,
+    "stateHoldTime": camera_state.default_hold_time,
+    "pollInterval": status_poller.default_interval,
+    "pollJitter": status_poller.default_jitter,
+    "panRate": preset_store.default_pan_rate,   # degrees per second at top speed, for scene timing
+    "tiltRate": preset_store.default_tilt_rate,
+    "zoomTime": preset_store.default_zoom_time, # seconds for a zoom across the whole range
 }
-# YYYY: Pan Position 0xF92A to 0x06d6  (CENTER 0000)
-# ZZZZ: Tilt Position 0xfe80 to 0x0480 (CENTER 0000)
-#           pan_direct = '8x 01 06 02 18 17 0Y 0Y 0Y 0Y 0Z 0Z 0Z 0Z FF' # absolute position  
-pan_absolute_position = '81 01 06 02 VV WW 0Y1 0Y2 0Y3 0Y4 0Z1 0Z2 0Z3 0Z4 FF' #Y is pan position, Z is tilt, VV is pan speed, WW is tilt speed
 
-# --------------------------------------------------------
-# Function convert absolute angle 
-# to VISCA command for BIRDDOG P200
-# --------------------------------------------------------
-def panToHex(numP,numT):
-    
-    minPD = -175
-    maxPD = 175
-    rangePD = maxPD - minPD
-    minTD = -30
-    maxTD = 90
-    rangeTD = maxTD - minTD
-    
-    minP = 0xF92A# -175
-    maxP = 0x06d6# +175
-    rangeP = 0x10000 + maxP - minP
-    
-    minT = 0xfe80 # -90
-    maxT = 0x0480 # +90
-    rangeT = 0x10000 + maxT - minT
-    
-    # Convert neg to positive
-    convP = numP - minPD
-    convT = numT - minTD
-    
-    # Scale and cast
-    scaleP = int(round(convP/rangePD*rangeP))
-    scaleT = int(round(convT/rangeTD*rangeT))
-    
-    absP = (minP + scaleP) & 0xffff
-    absT = (minT + scaleT) & 0xffff
-    
-    return(hex(absP)[2:].zfill(4),hex(absT)[2:].zfill(4))
-    
-# --------------------------------------------------------
-# Function convert absolute zoom 
-# to VISCA command for BIRDDOG P200
-# --------------------------------------------------------
-def zoomToHex(numZ):
-    
-    minZD = 0
-    maxZD = 100
-    rangeZD = maxZD - minZD
-    
-    
-    minZ = 0x0000
-    maxZ = 0x4000
-    rangeZ = maxZ - minZ
-    
-    
-    # Convert neg to positive
-    convZ = numZ - minZD
-    
-    # Scale and cast
-    scaleZ = int(round(convZ/rangeZD*rangeZ))
-    
-    absZ = (minZ + scaleZ) & 0xffff
-    
-    return(hex(absZ)[2:].zfill(4))
-    
-    
-# --------------------------------------------------------
-# Function convert absolute zoom 
-# to VISCA command for BIRDDOG P200
-# --------------------------------------------------------
-def focusToHex(numZ):
-    
-    minZD = 0
-    maxZD = 100
-    rangeZD = maxZD - minZD
-    
-    
-    minZ = 0x0000
-    maxZ = 0x4000
-    rangeZ = maxZ - minZ
-    
-    
-    # Convert neg to positive
-    convZ = numZ - minZD
-    
-    # Scale and cast
-    scaleZ = int(round(convZ/rangeZD*rangeZ))
-    
-    absZ = (minZ + scaleZ) & 0xffff
-    
-    return(hex(absZ)[2:].zfill(4))
-    
-    
+def camera_setting(configs, camId, name):
+    return camera_config(configs, camId).get(name, configs.get(name, camera_settings[name]))
+
+def check_camera_setting(configs, camId, name):
+    # every camera setting is a number (faderMaxSendRate may be 0 or null: no limit)
+    value = camera_setting(configs, camId, name)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) and not (name == "faderMaxSendRate" and value is None):
+        raise ValueError('camera %s: %s must be a number, not %r' % (camId, name, value))
+
+# Position ranges: "model" picks visca_encoder.camera_models,
+# "ranges" overrides single limits (e.g. {"minPD": -170})
+def camera_ranges(configs, camId):
+    thisCam = camera_config(configs, camId)
+    model = thisCam.get("model", configs.get("model", "P200"))
+    if model not in visca.camera_models:
+        raise ValueError('camera %s: unknown model %r' % (camId, model))
+    return visca.camera_models[model].replace(**dict(configs.get("ranges", {}), **thisCam.get("ranges", {})))
+
+# Seconds a removed camera gets to finish the commands it was sent
+drain_timeout = 2.0
+
+# Measured presets ("presetFile", see preset_store): next to the
+# config file, one per sharded worker
+def preset_file(configs, configFile=None, camIds=None):
+    path = configs.get("presetFile", preset_store.default_preset_file)
+    if camIds:
+        base, extension = os.path.splitext(path)
+        path = base + '-cameras-' + '_'.join(camIds) + extension
+    if configFile is not None:
+        path = os.path.join(os.path.dirname(os.path.abspath(configFile)), path)
+    return path
+
+# Macros ("macroFile", see macro_engine): next to the config file,
+# the same file for every sharded worker
+def macro_file(configs, configFile=None):
+    path = configs.get("macroFile", macro_engine.default_macro_file)
+    if configFile is not None:
+        path = os.path.join(os.path.dirname(os.path.abspath(configFile)), path)
+    return path
+
+# OSC bundle time tags: closer than bundle_tolerance seconds runs
+# straight away, further ahead than max_bundle_delay is dropped
+bundle_tolerance = 0.001
+max_bundle_delay = 60.0
+
+# A broadcast result that counts as failed (see Server.broadcast)
+def broadcast_failed(result):
+    return result is None or isinstance(result, Exception) or result in (visca_transport.no_response, visca_transport.camera_offline)
+
+
 # ==============================================================
-#  VISCA (TO Birddog P200s) 
+#  Server
 # ==============================================================
-# --------------------------------------------------------
-# Send Visca Command 
-# --------------------------------------------------------
-def clearUdpBuffer(old_s, camId):
-    old_s.shutdown(1)
-    old_s.close()
-    global s
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # IPv4, UDP
-    s.bind(('', camera_port+1)) # for testing use the port one higher than the camera's port
-    s.settimeout(1.0) # only wait for a response for 1 second
-    
-    #Send one
-    for thisKey in camipDic.keys():
-        camera_ip = camipDic[thisKey]
-        sequence_number = seqNum[camId]
-        payload_type = bytearray.fromhex('01 00') # command
-        payload = bytearray.fromhex(reset_seq)
-        payload_length = len(payload).to_bytes(2, 'big')
-        visca_message = payload_type + payload_length + sequence_number.to_bytes(4, 'big') + payload
-        s.sendto(visca_message, (camera_ip, camera_port))
-    
-    time.sleep(0.2)
-    #send_visca(networkSet,camId)
-
-def send_visca_status(message_string,camId="1", skipCheck = False):
-    skipCheck = False # This isnt working fully yet
-    # 0 is for all, do a forloop
-    if camId =="0":
-        for thisKey in camipDic.keys():
-            received_message = send_visca_status(message_string, camId=thisKey, skipCheck=skipCheck)  
-        return received_message
-    
-    # If we dont get an acknoledge try again
-    camera_ip = camipDic[camId]
-    sequence_number = 1#seqNum[camId]
-    #payload_type = bytearray.fromhex('01 00') # command
-    payload_type = bytearray.fromhex('01 10') # Inquiry
-    payload = bytearray.fromhex(message_string)
-    payload_length = len(payload).to_bytes(2, 'big')
-    visca_message = payload_type + payload_length + sequence_number.to_bytes(4, 'big') + payload
-    
-    # Lock
-    lock[camId].acquire();
-    sStatus.sendto(visca_message, (camera_ip, camera_port))
-    #print(binascii.hexlify(visca_message), 'sent to', camera_ip, camera_port, sequence_number)
-    lock[camId].release();
-    
-    try:
-        data = sStatus.recvfrom(buffer_size)
-        received_message = binascii.hexlify(data[0])
-        #print('Received', received_message[-8:])
-        #data = s.recvfrom(buffer_size)
-        #received_message = binascii.hexlify(data[0])
-        
-    except socket.timeout: # s.settimeout(2.0) #from above
-        received_message = 'No response from camera'
-        
-    filteredMessage = received_message[19:-2]
-    #print('Received', filteredMessage)
-    return filteredMessage
-    
-def post_birddog_rest(target,jsonObj,camId="1"):
-    # 0 is for all, do a forloop
-    if camId =="0":
+class Server:
+    '''One OSC to VISCA server for the cameras in configs.'''
+
+    def __init__(self, configs, oscReceivePort=osc_receive_port, oscSendPort=osc_send_port, configFile=None,
+                 camIds=None, feedbackRelay=None, metricsPort=None, recordFile=None):
+        self.configs = configs
+        self.oscReceivePort = oscReceivePort
+        self.oscSendPort = oscSendPort
+        # Sharded mode worker (see shard_supervisor): only camIds, and
+        # feedback goes to the supervisor at feedbackRelay (ip, port)
+        # as /camId/command for it to pass on
+        self.camIds = camIds
+        self.feedbackRelay = feedbackRelay
+        self.recordFile = recordFile
+        self.metricsPort = metricsPort
+        self.sender = None # ip of the OSC message being handled
+        self.bundles = 0
+        self.bundlesScheduled = 0 # bundles with a time tag in the future
+        self.bundlesDropped = 0
+        self.started = False
+
+        # ----- Camera Settings -----
+        self.camInfo = configs["camInfo"]
+        self.camipDic = {}
+        self.cameraPort = visca_transport.camera_port
+
+        # Visca sockets: each camera gets its own command and inquiry
+        # endpoint (visca_transport.ViscaCamera). Nothing is opened
+        # here, see start()
+        self.cameras = {}
+
+        # Per camera state (see camera_state). A command that would
+        # not change it within stateHoldTime seconds is not sent
+        self.states = {}
+
+        # Per camera position ranges (visca_encoder.CameraRanges)
+        self.ranges = {}
+
+        # Presets as measured on memory_set, in "presetFile" next to
+        # the config (one file per sharded worker), and the scene each
+        # camera is moving to (see recall_scene)
+        self.presets = preset_store.PresetStore(preset_file(configs, configFile, camIds))
+        self.scenes = {}
+
+        # Fader driven absolute commands (pan_absolute_position, zoom_direct,
+        # focus_direct) keep only their newest target, sent at most this many
+        # times a second per camera
+        self.fader_mailbox = visca_coalesce.LatestValueMailbox(self.send_fader_visca)
+
+        # Birddog REST API (settings VISCA doesn't reach): one keep-alive
+        # connection per camera, rapid changes merged into one POST
+        self.birddog = birddog_rest.BirddogClient(configs.get("restPort", birddog_rest.rest_port))
+
+        # Feedback goes through one long-lived socket, opened by start(),
+        # to every subscribed control surface
+        self.subscribers = osc_feedback.SubscriberRegistry(oscSendPort)
+        self.feedback = osc_feedback.FeedbackChannel(self.subscribers)
+
+        # Every camera is polled on its own interval (pollInterval /
+        # pollJitter in the config, per camera or for all); what it
+        # reads corrects the camera state
+        self.poller = status_poller.StatusPoller(self.cameras, self.status_changed, current=self.status_current)
+
+        self.metricsInfo = configs.get("metrics", {})
+        self.routes = osc_routes.RouteTable()
+        self.register_routes()
+        self.transport = None # OSC receive endpoint
+        self.tasks = []
+        self.watcher = None
+
+        # Macros: timed OSC commands from "macroFile", run through the
+        # routes above (reread when the file changes)
+        self.macros = macro_engine.MacroEngine(self.routes.resolve, self.run_osc_calls, self.send_osc,
+                                               self.observe_macro_step)
+        self.macroWatcher = config_watch.ConfigWatcher(macro_file(configs, configFile), self.macros.define, None,
+                                                       configs.get("configWatchInterval", config_watch.default_interval))
+        if os.path.exists(self.macroWatcher.path):
+            self.macroWatcher.check()
+
+        self.apply_config(configs)
+
+        # Reload the config when the file changes
+        if configFile is not None:
+            self.watcher = config_watch.ConfigWatcher(configFile, self.apply_config, configs,
+                                                      configs.get("configWatchInterval", config_watch.default_interval))
+
+    # ==============================================================
+    #  Config (at startup and on every reload)
+    # ==============================================================
+    # --------------------------------------------------------
+    # Apply a config: only cameras that were added, removed or
+    # moved are touched, everything else keeps running. Every
+    # camera's settings are reapplied, which costs nothing for
+    # the ones that didn't change. Raises (and changes
+    # nothing) if the config can't be used
+    # --------------------------------------------------------
+    def apply_config(self, configs):
+        camipDic = camera_ips(configs, self.camIds)
+        ranges = {thisKey: camera_ranges(configs, thisKey) for thisKey in camipDic.keys()}
         for thisKey in camipDic.keys():
-            received_message = post_birddog_rest(message_string, camId=thisKey)  
-        return received_message
-        
-    camera_ip = camipDic[camId]
-    url = "http://"+camera_ip + "/" + target
-    x = requests.post(url,json = jsonObj)
-        
-def send_visca(message_string,camId="1", skipCheck = False):
-    skipCheck = True # This isnt working fully yet
-    # 0 is for all, do a forloop
-    if camId =="0":
+            for name in camera_settings:
+                check_camera_setting(configs, thisKey, name)
+        self.subscribers.configured_subscribers(configs.get("oscClients", default_osc_clients),
+                                                configs.get("oscClientTimeout", osc_feedback.subscriber_timeout))
+        server_log.set_levels(configs.get("logging"))
+
+        added = [thisKey for thisKey in camipDic.keys() if thisKey not in self.camipDic]
+        removed = [thisKey for thisKey in self.camipDic.keys() if thisKey not in camipDic]
+        moved = [thisKey for thisKey in camipDic.keys() if thisKey in self.camipDic and camipDic[thisKey] != self.camipDic[thisKey]]
+
+        self.configs = configs
+        self.camInfo = configs["camInfo"]
+        self.camipDic = camipDic
+        for thisKey in removed:
+            self.remove_camera(thisKey)
+        for thisKey in added:
+            self.add_camera(thisKey, camipDic[thisKey])
+        for thisKey in moved:
+            self.readdress_camera(thisKey, camipDic[thisKey])
+
+        self.subscribers.configure(configs.get("oscClients", default_osc_clients),
+                                   configs.get("oscClientTimeout", osc_feedback.subscriber_timeout))
+        self.fader_mailbox.set_max_rate(configs.get("faderMaxSendRate", visca_coalesce.default_max_rate))
+        self.poller.interval = configs.get("pollInterval", status_poller.default_interval)
+        self.poller.jitter = configs.get("pollJitter", status_poller.default_jitter)
         for thisKey in camipDic.keys():
-            received_message = send_visca(message_string, camId=thisKey, skipCheck=skipCheck)  
+            self.configure_camera(thisKey, ranges[thisKey])
+        if self.started:
+            self.routes.compile(self.camipDic.keys())
+            if self.watcher is not None:
+                self.watcher.interval = configs.get("configWatchInterval", config_watch.default_interval)
+            self.macroWatcher.interval = configs.get("configWatchInterval", config_watch.default_interval)
+            config_log.info('Config applied: %d camera(s), added %s, removed %s, moved %s', len(camipDic), added, removed, moved)
+
+    def configure_camera(self, camId, ranges):
+        configs = self.configs
+        thisCam = camera_config(configs, camId)
+        self.cameras[camId].scheduler.set_capacity(camera_setting(configs, camId, "commandWindow"))
+        self.states[camId].holdTime = camera_setting(configs, camId, "stateHoldTime")
+        if "faderMaxSendRate" in thisCam:
+            self.fader_mailbox.set_max_rate(thisCam["faderMaxSendRate"], camId)
+        else:
+            self.fader_mailbox.clear_max_rate(camId)
+        self.poller.configure(camId, thisCam.get("pollInterval"), thisCam.get("pollJitter"))
+        self.ranges[camId] = ranges
+
+    def add_camera(self, camId, ip):
+        self.cameras[camId] = visca_transport.ViscaCamera(camId, ip, self.cameraPort,
+                                                          onHealthChange=self.camera_health_changed)
+        self.states[camId] = camera_state.CameraState(camId, self.state_changed)
+        if self.started:
+            config_log.info('Camera %s added at %s', camId, ip)
+            asyncio.ensure_future(self.start_added_camera(camId))
+
+    async def start_added_camera(self, camId):
+        await self.start_camera(camId)
+        if camId in self.cameras:
+            self.poller.start_camera(camId)
+
+    # --------------------------------------------------------
+    # A removed camera gets no new commands (its paths are
+    # gone from the route table, broadcasts skip it), and
+    # drain_timeout seconds to finish the ones it was sent
+    # --------------------------------------------------------
+    def remove_camera(self, camId):
+        camera = self.cameras.pop(camId)
+        self.birddog.close(camera.ip)
+        self.ranges.pop(camId, None)
+        self.poller.stop_camera(camId)
+        self.fader_mailbox.discard_camera(camId)
+        asyncio.ensure_future(self.drain_camera(camId, camera))
+
+    async def drain_camera(self, camId, camera):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + drain_timeout
+        while not camera.scheduler.idle() and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        camera.close()
+        if camId not in self.cameras: # unless it was added back meanwhile
+            self.states.pop(camId, None)
+        config_log.info('Camera %s removed', camId)
+
+    # A moved camera starts over at its new address
+    def readdress_camera(self, camId, ip):
+        config_log.info('Camera %s moved to %s', camId, ip)
+        self.fader_mailbox.discard_camera(camId)
+        self.birddog.close(self.cameras[camId].ip)
+        self.cameras[camId].readdress(ip)
+        self.states[camId].forget()
+        if self.started:
+            asyncio.ensure_future(self.start_camera(camId))
+
+    def reload_config(self, camId="0"):
+        self.macroWatcher.check()
+        if self.watcher is None:
+            config_log.warning('No config file to reload')
+            return False
+        return self.watcher.check()
+
+    # ==============================================================
+    #  Startup / shutdown
+    # ==============================================================
+    # --------------------------------------------------------
+    # Open every camera, reset its sequence number and probe
+    # it, all cameras in parallel: startup takes as long as
+    # the slowest camera instead of the sum of them. A camera
+    # that doesn't answer the probe starts offline (circuit
+    # breaker open, see camera_health) and is picked up by the
+    # breaker's probes once it shows up
+    # --------------------------------------------------------
+    async def start_camera(self, camId):
+        camera = self.cameras[camId]
+        await camera.open()
+        await camera.reset_sequence_number(skipCheck = True)
+        if await camera.probe():
+            self.states[camId].observe('online', True)
+        else:
+            camera.breaker.set_online(False)
+        return camera.breaker.online
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.started = True
+        if self.recordFile:
+            traffic_recorder.recorder.start(self.recordFile)
+        self.feedback.open()
+        online = await asyncio.gather(*[self.start_camera(thisKey) for thisKey in self.camipDic.keys()])
+        visca_log.info('Reset sequence number to 1, %d of %d cameras online', sum(online), len(online))
+
+        ## Launch Status Polling (one task per camera):
+        self.poller.start()
+
+        ## Metrics endpoint (http://127.0.0.1:9100/metrics) and OSC summary
+        metrics.registry.enabled = self.metricsInfo.get("enabled", False)
+        if metrics.registry.enabled:
+            metrics.registry.add_collector(self.collect_counters)
+            metrics.registry.add_collector(self.collect_camera_gauges, 'gauge')
+            await metrics.registry.serve(self.metricsPort or self.metricsInfo.get("port", metrics.default_port))
+            self.tasks.append(loop.create_task(self.metrics_summary_task()))
+
+        # Then start the OSC server to receive messages
+        self.routes.compile(self.camipDic.keys())
+        self.transport, _ = await loop.create_datagram_endpoint(
+            self.protocol_factory, local_addr=('0.0.0.0', self.oscReceivePort))
+        if self.watcher is not None:
+            self.watcher.start()
+        self.macroWatcher.start()
+        return self
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        if self.watcher is not None:
+            self.watcher.stop()
+        self.macroWatcher.stop()
+        self.macros.close()
+        self.poller.stop()
+        for camera in self.cameras.values():
+            camera.close()
+        self.birddog.close()
+        self.feedback.close()
+        if self.recordFile:
+            traffic_recorder.recorder.stop()
+
+    # ==============================================================
+    #  VISCA (TO Birddog P200s)
+    # ==============================================================
+    # --------------------------------------------------------
+    # Broadcast (camId "0")
+    # Starts send on every camera in the same loop iteration,
+    # so an "all cameras" command lands everywhere together
+    # instead of one camera after the other. Returns a Task
+    # resolving to {camId: result}; a camera that raised has
+    # the exception as its result. onComplete is an optional
+    # completion barrier, called once with the results when
+    # every camera has answered or failed.
+    # --------------------------------------------------------
+    def broadcast(self, send, *args, onComplete=None, **kwargs):
+        camIds = list(self.camipDic.keys())
+        futures = [asyncio.ensure_future(send(*args, camId=thisKey, **kwargs)) for thisKey in camIds]
+
+        async def collect():
+            results = dict(zip(camIds, await asyncio.gather(*futures, return_exceptions=True)))
+            failed = [thisKey for thisKey, result in results.items() if broadcast_failed(result)]
+            if failed:
+                visca_log.warning('Broadcast failed on camera(s) %s', failed)
+            if onComplete is not None:
+                onComplete(results)
+            return results
+
+        return asyncio.ensure_future(collect())
+
+    # --------------------------------------------------------
+    # Send Visca Inquiry
+    # Coroutine, await it from the receive loop
+    # --------------------------------------------------------
+    # Returns the decoded reply (see visca_decoder: a named
+    # tuple for block and position inquiries, the raw field
+    # bytes for others), None when the camera doesn't answer,
+    # for camId "0" a dict of every camera's reply
+    # --------------------------------------------------------
+    async def send_visca_status(self, message,camId="1"):
+        # 0 is for all cameras at once
+        if camId =="0":
+            return await self.broadcast(self.send_visca_status, message)
+
+        payload = visca.as_payload(message)
+        return visca_decoder.decode(payload, await self.cameras[camId].send_inquiry(payload))
+
+    # --------------------------------------------------------
+    # Birddog RESTful API (see birddog_rest)
+    # Settings posted to a camera's page in quick succession
+    # go out merged in one POST; all cameras are posted to in
+    # parallel. Returns the birddog_rest.Response, None if
+    # the camera couldn't be reached
+    # --------------------------------------------------------
+    async def post_birddog_rest(self, target,jsonObj,camId="1"):
+        # 0 is for all cameras at once
+        if camId =="0":
+            return await self.broadcast(self.post_birddog_rest, target, jsonObj)
+
+        return await self.birddog.post(self.camipDic[camId], target, jsonObj)
+
+    async def get_birddog_rest(self, target, camId="1"):
+        # the page's settings (decoded JSON), None on failure
+        if camId =="0":
+            return await self.broadcast(self.get_birddog_rest, target)
+
+        return await self.birddog.get(self.camipDic[camId], target)
+
+    # --------------------------------------------------------
+    # Send Visca Command
+    # Never blocks the receive loop: the command is queued on
+    # the camera's socket and a Task is returned, which can be
+    # awaited for the camera's reply (for camId "0" the Task
+    # resolves to {camId: reply}, see broadcast).
+    # message is a visca_encoder payload (bytes), hex strings
+    # are still accepted
+    # --------------------------------------------------------
+    # state: the (name, value) the command recorded in the camera
+    # state, reverted if the camera doesn't take it
+    async def send_visca_async(self, message,camId="1", skipCheck = False, state = None, **sendOptions):
+        received_message = await self.cameras[camId].send(visca.as_payload(message), skipCheck=skipCheck, **sendOptions)
+        if received_message == visca_transport.no_response:
+            self.states[camId].forget() # we no longer know what it is doing
+            self.send_osc('reset_sequence_number', 0.0, camId)
+        elif state is not None and not visca_transport.acknowledged(received_message) and camId in self.states:
+            self.states[camId].revert(*state)
         return received_message
-    
-    # If we dont get an acknoledge try again
-    for tries in range(5):
-        camera_ip = camipDic[camId]
-        sequence_number = seqNum[camId]
-        payload_type = bytearray.fromhex('01 00')
-        payload = bytearray.fromhex(message_string)
-        payload_length = len(payload).to_bytes(2, 'big')
-        
-        lock[camId].acquire();
-        visca_message = payload_type + payload_length + sequence_number.to_bytes(4, 'big') + payload
-        s.sendto(visca_message, (camera_ip, camera_port))
-        print(binascii.hexlify(visca_message), 'sent to', camera_ip, camera_port, sequence_number)
-        
-        if skipCheck:
-            received_message = "skipped check"
-            break
+
+    def send_visca(self, message,camId="1", skipCheck = False, onComplete = None, state = None):
+        if metrics.registry.enabled:
+            metrics.registry.dispatched()
+        # 0 is for all cameras at once
+        if camId =="0":
+            return self.broadcast(self.send_visca_async, message, skipCheck=skipCheck, onComplete=onComplete, state=state)
+
+        return asyncio.ensure_future(self.send_visca_async(message, camId, skipCheck, state))
+
+    # --------------------------------------------------------
+    # Send only to the camera(s) this command would change:
+    # state name/value are recorded in the camera state, and
+    # cameras already in that state are skipped
+    # --------------------------------------------------------
+    def cam_ids(self, camId):
+        return list(self.camipDic.keys()) if camId == "0" else [camId]
+
+    def state_cameras(self, camId, name, value):
+        camIds = self.cam_ids(camId)
+        return camIds, [thisKey for thisKey in camIds if self.states[thisKey].command(name, value)]
+
+    def send_visca_if_changed(self, message, name, value, camId="1", skipCheck = False):
+        camIds, changed = self.state_cameras(camId, name, value)
+        if len(changed) == len(camIds):
+            return self.send_visca(message, camId, skipCheck, state=(name, value))
+        for thisKey in changed:
+            self.send_visca(message, thisKey, skipCheck, state=(name, value))
+
+    # --------------------------------------------------------
+    # Fader commands: post the newest absolute target to the
+    # camera's mailbox instead of queueing every fader step
+    # --------------------------------------------------------
+    # A fader target that isn't acknowledged is not worth retrying,
+    # the next one is already waiting in the mailbox
+    async def send_fader_visca(self, posted, camId):
+        message, state = posted
+        return await self.send_visca_async(message, camId, state=state, retries = 1)
+
+    def post_fader_visca(self, message, commandClass, value, camId="1"):
+        # commandClass doubles as the camera state name
+        if metrics.registry.enabled:
+            metrics.registry.dispatched()
+        camIds, changed = self.state_cameras(camId, commandClass, value)
+        for thisKey in changed:
+            self.fader_mailbox.post(thisKey, commandClass, (message, (commandClass, value)))
+
+    # Any other command in the same class (stop, home, jog) must
+    # not be overtaken by a fader target that hasn't gone out yet
+    def discard_fader_visca(self, commandClass, camId="1"):
+        if camId =="0":
+            for thisKey in self.camipDic.keys():
+                self.fader_mailbox.discard(thisKey, commandClass)
         else:
-            # wait for acknowledge and completion messages
-            try:
-                data = s.recvfrom(buffer_size)
-                received_message = binascii.hexlify(data[0])
-                #print('Received', received_message[-8:])
-                #data = s.recvfrom(buffer_size)
-                #received_message = binascii.hexlify(data[0])
-                if received_message[-8:] == binascii.hexlify(bytes([seqNum[camId]]))+b'9051ff':
-#                    pass#print('Received okay')
-                    break
-                else:
-                    print('Error')
-                    print(received_message)
-                    clearUdpBuffer(s,camId)
-                
-                    #print('Received', received_message)
-            except socket.timeout: # s.settimeout(2.0) #from above
-                received_message = 'No response from camera'
-                print(received_message)
-                send_osc('reset_sequence_number', 0.0)
-            #
-            #return visca_message
-            
-    lock[camId].release();
-    seqNum[camId] += 1
-    return received_message
+            self.fader_mailbox.discard(camId, commandClass)
 
-# --------------------------------------------------------
-# Reset Visca Sequence Number:
-# TODO: Check if this does anything or is necessary for
-#       Birddog P200
-# --------------------------------------------------------
-def reset_sequence_number_function(camId = "0"):  # this should probably be rolled into the send_visca function
-    send_visca(reset_seq,camId) # so that it doesn't display on-screen
-    sequence_number = 1
-    if (camId == "0"):
-        for thisKey in camipDic.keys():
-            seqNum[thisKey] = sequence_number
-    else:
-        seqNum[camId] = sequence_number
-        
-    #send_visca(networkSet,camId)
-    print('Reset sequence number to', sequence_number)
-    '''
-    try:
-        data = s.recvfrom(buffer_size)
-        received_message = binascii.hexlify(data[0])
-        #print('Received', received_message)
-        data = s.recvfrom(buffer_size)
-        received_message = binascii.hexlify(data[0])
-        #print('Received', received_message)
-        send_osc('reset_sequence_number', 1.0)
-    except socket.timeout: # s.settimeout(2.0) #above
-        received_message = 'No response from camera'
-        print(received_message)
-        send_osc('reset_sequence_number', 0.0)
-    '''
-    return sequence_number
+    # --------------------------------------------------------
+    # Presets and scenes (see preset_store)
+    # memory_set keeps where the camera actually is; a scene
+    # recall moves every camera to its preset at speeds that
+    # get them there together, and reports scene_ready once
+    # every camera has completed (the completion barrier).
+    # Cameras without a measured preset get the camera's own
+    # memory recall, and are waited for the same way
+    # --------------------------------------------------------
+    async def current_preset(self, camId):
+        camera = self.cameras[camId]
+        positionReply, lensReply = await asyncio.gather(
+            camera.send_inquiry(visca_decoder.Pan_tiltPosInq, 'position'),
+            camera.send_inquiry(visca_decoder.CAM_LensBlockInq, 'lens'))
+        return preset_store.preset_from_replies(positionReply, lensReply)
 
+    async def store_preset(self, memory, camId):
+        preset = await self.current_preset(camId)
+        if preset is None:
+            preset_log.warning('Preset %d: camera %s did not report its position', memory, camId)
+            return None
+        self.presets.set(camId, memory, preset)
+        preset_log.info('Preset %d stored for camera %s: %s', memory, camId, preset)
+        return preset
 
-# ==============================================================
-#  OSC (From Open Stage Control)
-# ==============================================================
-# --------------------------------------------------------
-#  OSC Send 
-#  TODO: Untested/Unused... we should figure out
-#        feed back from P200 to Open Stage Control
-# --------------------------------------------------------
-def send_osc(osc_command, osc_send_argument):
-    osc_message_to_send = "/"+osc_command
-    osc_client = udp_client.SimpleUDPClient(serverOSC_ip, osc_send_port)
-    osc_client.send_message(osc_message_to_send, osc_send_argument)
+    def camera_motion(self, camId):
+        return {name: camera_setting(self.configs, camId, name) for name in ('panRate', 'tiltRate', 'zoomTime')}
 
+    # report(ready) instead of scene_ready / scene_failed: a scene
+    # synchronised across sharded workers (see shard_supervisor)
+    def recall_scene(self, memory, camId="0", seconds=0.0, report=None):
+        camIds = self.cam_ids(camId)
+        scene = object() # a newer scene on any of these cameras supersedes this one
+        for thisKey in camIds:
+            self.scenes[thisKey] = scene
+            self.states[thisKey].forget('panTilt', 'zoom', 'focus', 'focusMode')
+            self.states[thisKey].set('preset', memory)
+            for commandClass in ('panTilt', 'zoom', 'focus'):
+                self.fader_mailbox.discard(thisKey, commandClass)
+        return asyncio.ensure_future(self.run_scene(scene, memory, camId, camIds, seconds, report))
 
-# --------------------------------------------------------
-#  OSC Protocal Lambda Function 
-# --------------------------------------------------------
-def protocol_factory():
-    osc = aiosc.OSCProtocol({'//*': lambda osc_address, osc_path, *args: parse_osc_message(osc_address, osc_path, args)})
-    return osc
+    async def plan_recall(self, memory, camIds, seconds=0.0):
+        # cameras (see preset_store.plan_scene), seconds and moves of
+        # the cameras with a measured preset that reported where they are
+        measured = [thisKey for thisKey in camIds if self.presets.get(thisKey, memory) is not None]
+        currents = dict(zip(measured, await asyncio.gather(*[self.current_preset(thisKey) for thisKey in measured])))
+        cameras = {thisKey: (self.ranges[thisKey], self.camera_motion(thisKey), current, self.presets.get(thisKey, memory))
+                   for thisKey, current in currents.items() if current is not None}
+        seconds, moves = preset_store.plan_scene(cameras, seconds)
+        return cameras, seconds, moves
 
-# --------------------------------------------------------
-#  OSC Parse
-#  This is the main function to handle P200 Functions
-#  It translates OSC inpuit to VISCA output
-# --------------------------------------------------------
-def parse_osc_message(osc_address, osc_path, args):
-    global serverOSC_ip
-    serverOSC_ip = osc_address[0]
-    osc_path_list = osc_path.split('/')
-    print (osc_path_list)
-    camId = osc_path_list[1]
-    osc_command = osc_path_list[2]
-#    print("ARGS:")
-#    print(args)
-    osc_argument = args[0]
-#    print (osc_command)
-#    print (osc_argument)
-
-    # ----- Camera On/off Commands -----
-    if osc_command == 'camera_on':
-        send_visca(camera_on,camId)
-    elif osc_command == 'camera_off':
-        send_visca(camera_off,camId)
-        
-    # ----- Reset Sequence -----
-    elif osc_command == 'reset_sequence_number':
-        reset_sequence_number_function(camId)
-        
-    # ----- Memory Commands -----
-    elif 'memory_' in osc_command:
-        memory_preset_number = hex(int(osc_argument))[2:]
-        if osc_argument > 0:
-            if 'recall' in osc_command:
-                print('Memory recall', memory_preset_number)
-                send_visca(information_display_off,camId) # so that it doesn't display on-screen
-                send_visca(memory_recall.replace('p', memory_preset_number),camId, skipCheck = True)
-            elif 'set' in osc_command:
-                print('Memory set', memory_preset_number)
-                send_visca(memory_set.replace('p', memory_preset_number),camId)
-                
-    # ----- Zoom Commands -----
-    elif 'zoom' in osc_command:
-        if 'zoom_direct' in osc_command:
-            absZ = zoomToHex(float(args[0]))
-#            print (absZ)
-            zoomCommand = zoom_direct.replace('p', absZ[0])
-            zoomCommand = zoomCommand.replace('q', absZ[1])
-            zoomCommand = zoomCommand.replace('r', absZ[2])
-            zoomCommand = zoomCommand.replace('s', absZ[3])
-#            print(zoomCommand)
-            send_visca(zoomCommand,camId, skipCheck = True)
-        elif osc_argument > 0:
-            zoomSpeed = str(int(min(7,args[0])))           
-            
-            if osc_command == 'zoom_tele':
-                send_visca(zoom_tele,camId)
-            elif osc_command == 'zoom_wide':
-                send_visca(zoom_wide,camId)
-            elif osc_command == 'zoom_tele_variable':
-                send_visca(zoom_tele_variable.replace('p', zoomSpeed),camId)
-            elif osc_command == 'zoom_wide_variable':
-                send_visca(zoom_wide_variable.replace('p', zoomSpeed),camId)
-        else: # when the button is released the osc_argument should be 0
-            send_visca(zoom_stop,camId)
-            
-    # ----- Focus Commands -----
-    elif 'focus' in osc_command:
-        if osc_command == 'focus_auto':
-            send_visca(focus_auto,camId)
-        elif osc_command == 'focus_manual':
-            send_visca(focus_manual,camId)
-        elif osc_command == 'focus_stop':
-            send_visca(focus_stop,camId)
-        elif osc_command == 'focus_one_push':
-            send_visca(focus_one_push,camId)
-                        
-        elif osc_command == 'focus_direct':
-            absF = zoomToHex(float(args[0])) #zoom and focus are same range
-#            print(absF)
-            focusCommand = focus_direct.replace('p', absF[0])
-            focusCommand = focusCommand.replace('q', absF[1])
-            focusCommand = focusCommand.replace('r', absF[2])
-            focusCommand = focusCommand.replace('s', absF[3])
-            send_visca(focusCommand,camId, skipCheck = True)
-            
-        elif osc_argument > 0:
-            focusSpeed = str(int(min(7,args[0])))     
-            if osc_command == 'focus_far':
-                send_visca(focus_far_variable.replace('p', focusSpeed),camId)
-            elif osc_command == 'focus_near':
-                send_visca(focus_near_variable.replace('p', focusSpeed),camId)
-        else: # when the button is released the osc_argument should be 0
-            send_visca(focus_stop,camId)
-            
-    # ----- Pan / Tilt Commands -----
-    elif 'pan' in osc_command:
-        
-        # Absolute Position
-        if "pan_absolute_position" in osc_command:
-            if args[0] > 0 and args[1] >0:
-                panSpeed = str(int(args[0])).zfill(2)
-                tiltSpeed = str(int(args[1])).zfill(2)
-                absP, absT = panToHex(float(args[2]),float(args[3]))
-                #print ("ABSOLUTE")
-                #print (absP)
-                #print (absT)
-                    
-                convMsg = pan_absolute_position.replace('VV', panSpeed).replace('WW', str(tiltSpeed))
-                convMsg = convMsg.replace('Y1',absP[0]).replace('Y2',absP[1]).replace('Y3',absP[2]).replace('Y4',absP[3])
-                convMsg = convMsg.replace('Z1',absT[0]).replace('Z2',absT[1]).replace('Z3',absT[2]).replace('Z4',absT[3])
-                send_visca(convMsg,camId, skipCheck = True)
-                
-                
+    async def run_scene(self, scene, memory, camId, camIds, seconds, report=None):
+        loop = asyncio.get_running_loop()
+        startedAt = loop.time()
+        cameras, seconds, moves = await self.plan_recall(memory, camIds, seconds)
+
+        sends = []
+        for thisKey, move in moves.items():
+            # the focus mode goes out with the move (a camera's own
+            # memory recall leaves it unknown)
+            focusMode = cameras[thisKey][3].focusMode
+            self.states[thisKey].set('focusMode', focusMode)
+            focusMessage, *messages = preset_store.scene_messages(cameras[thisKey][3], move)
+            sends.append(self.send_visca_async(focusMessage, thisKey, state=('focusMode', focusMode), waitForCompletion=True))
+            for message in messages:
+                sends.append(self.send_visca_async(message, thisKey, waitForCompletion=True))
+        for thisKey in camIds:
+            if thisKey not in moves:
+                sends.append(self.send_visca_async(visca.memory_recall(memory), thisKey, waitForCompletion=True))
+        results = await asyncio.gather(*sends, return_exceptions=True)
+
+        if any(self.scenes.get(thisKey) is not scene for thisKey in camIds):
+            preset_log.debug('Scene %d on camera(s) %s superseded', memory, camIds)
+            return False
+        for thisKey in camIds:
+            del self.scenes[thisKey]
+        ready = all(visca_transport.completed(result) for result in results)
+        elapsed = loop.time() - startedAt
+        if ready:
+            preset_log.info('Scene %d ready on camera(s) %s after %.2f s (planned %.2f s)', memory, camIds, elapsed, seconds)
+        else:
+            preset_log.warning('Scene %d not reached on camera(s) %s after %.2f s', memory, camIds, elapsed)
+        if report is not None:
+            report(ready)
+        else:
+            self.send_osc("scene_ready" if ready else "scene_failed", memory, None if camId == "0" else camId)
+        return ready
+
+    # --------------------------------------------------------
+    # Scenes across sharded workers: the supervisor asks every
+    # worker how long its cameras need (scene_plan), then has
+    # them all start together with the longest (scene_sync),
+    # and sends one scene_ready once they all report back.
+    # Replies go to the supervisor with this worker's cameras
+    # --------------------------------------------------------
+    async def report_scene_plan(self, memory, camId):
+        cameras, seconds, moves = await self.plan_recall(memory, self.cam_ids(camId))
+        self.report_to_supervisor('scene_plan', memory, seconds)
+
+    def sync_scene(self, memory, camId, seconds):
+        self.recall_scene(memory, camId, seconds,
+                          report=lambda ready: self.report_to_supervisor('scene_sync', memory, int(ready)))
+
+    def report_to_supervisor(self, osc_command, *args):
+        cameras = ','.join(self.camipDic.keys())
+        if self.feedbackRelay is not None:
+            self.feedback.send(self.feedbackRelay, "/0/"+osc_command, *args, cameras)
+        else:
+            self.feedback.publish("/"+osc_command, *args, cameras)
+
+    # --------------------------------------------------------
+    # Reset Visca Sequence Number:
+    # TODO: Check if this does anything or is necessary for
+    #       Birddog P200
+    # --------------------------------------------------------
+    def reset_sequence_number_function(self, camId = "0"):  # this should probably be rolled into the send_visca function
+        sequence_number = 1
+        if (camId == "0"):
+            for thisKey in self.camipDic.keys():
+                asyncio.ensure_future(self.cameras[thisKey].reset_sequence_number(skipCheck = True))
+        else:
+            asyncio.ensure_future(self.cameras[camId].reset_sequence_number(skipCheck = True))
+
+        visca_log.info('Reset sequence number to %s', sequence_number)
+        return sequence_number
+
+    # ==============================================================
+    #  OSC (From Open Stage Control)
+    # ==============================================================
+    # --------------------------------------------------------
+    #  OSC Send
+    #  Published to every subscriber, flushed in bundles every
+    #  osc_feedback.flush_interval. camId: the camera the
+    #  update is about, None if it isn't about one
+    # --------------------------------------------------------
+    def send_osc(self, osc_command, osc_send_argument, camId=None):
+        if self.feedbackRelay is not None:
+            self.feedback.send(self.feedbackRelay, "/%s/%s" % (camId or "0", osc_command), osc_send_argument)
+            return
+        osc_message_to_send = "/"+osc_command
+        self.feedback.publish(osc_message_to_send, osc_send_argument, camId=camId)
+
+    # --------------------------------------------------------
+    #  Subscriptions: camera filters of the sender's feedback
+    #  (see osc_feedback.SubscriberRegistry.subscribe)
+    # --------------------------------------------------------
+    def subscribe(self, camId):
+        self.subscribers.subscribe(self.sender, camId)
+
+    def unsubscribe(self, camId):
+        self.subscribers.unsubscribe(self.sender, camId, self.camipDic.keys())
+
+    # --------------------------------------------------------
+    #  OSC Routes
+    #  Every command the panel sends is registered here with
+    #  its argument decoders; routes.compile() (start) turns
+    #  them into one dict of '/camId/command' paths.
+    #  Handlers are called as handler(camId, *decoded args)
+    # --------------------------------------------------------
+    def register_routes(self):
+        routes = self.routes
+        number = osc_routes.number
+        optional = osc_routes.optional
+        driveSpeed = osc_routes.clamped(number, 0, 7) # zoom / focus drive speed
+        send_visca = self.send_visca
+        send_visca_if_changed = self.send_visca_if_changed
+        post_fader_visca = self.post_fader_visca
+        discard_fader_visca = self.discard_fader_visca
+
+        # ----- Camera On/off Commands -----
+        @routes.route('camera_on')
+        def camera_on(camId):
+            send_visca_if_changed(visca.camera_on, 'power', 'on', camId)
+
+        @routes.route('camera_off')
+        def camera_off(camId):
+            send_visca_if_changed(visca.camera_off, 'power', 'off', camId)
+
+        # ----- Reset Sequence -----
+        routes.add('reset_sequence_number', self.reset_sequence_number_function)
+
+        # ----- Config / feedback -----
+        routes.add('reload_config', self.reload_config)
+        routes.add('subscribe', self.subscribe)
+        routes.add('unsubscribe', self.unsubscribe)
+
+        # ----- Macros -----
+        @routes.route('macro_run', decoders=(osc_routes.text,))
+        def macro_run(camId, name):
+            self.macros.start(name, self.sender)
+
+        @routes.route('macro_abort', decoders=(optional(osc_routes.text),))
+        def macro_abort(camId, name):
+            self.macros.abort(name)
+
+        # ----- Memory Commands -----
+        # A recall is a scene: every camera moves to its measured
+        # preset (or its own memory), arriving together, and
+        # scene_ready N follows. scene_recall N seconds takes at
+        # least that long
+        @routes.route('memory_recall', decoders=(number,))
+        def memory_recall(camId, memory):
+            if memory > 0:
+                memory_preset_number = int(memory)
+                log.info('Memory recall %s', memory_preset_number)
+                send_visca(visca.information_display_off,camId) # so that it doesn't display on-screen
+                self.recall_scene(memory_preset_number, camId)
+
+        @routes.route('scene_recall', decoders=(number, optional(number, 0.0)))
+        def scene_recall(camId, memory, seconds):
+            if memory > 0:
+                log.info('Scene recall %s', int(memory))
+                send_visca(visca.information_display_off,camId)
+                self.recall_scene(int(memory), camId, max(0.0, seconds))
+
+        # Sent by the shard supervisor, see report_scene_plan
+        @routes.route('scene_plan', decoders=(number,))
+        def scene_plan(camId, memory):
+            if memory > 0:
+                asyncio.ensure_future(self.report_scene_plan(int(memory), camId))
+
+        @routes.route('scene_sync', decoders=(number, number))
+        def scene_sync(camId, memory, seconds):
+            if memory > 0:
+                log.info('Scene recall %s (synchronised)', int(memory))
+                send_visca(visca.information_display_off,camId)
+                self.sync_scene(int(memory), camId, max(0.0, seconds))
+
+        # The camera keeps the preset too, and we ask it where it is
+        @routes.route('memory_set', decoders=(number,))
+        def memory_set(camId, memory):
+            if memory > 0:
+                memory_preset_number = int(memory)
+                log.info('Memory set %s', memory_preset_number)
+                send_visca(visca.memory_set(memory_preset_number),camId)
+                for thisKey in self.cam_ids(camId):
+                    asyncio.ensure_future(self.store_preset(memory_preset_number, thisKey))
+
+        # ----- Zoom Commands -----
+        # Positions depend on each camera's ranges
+        @routes.route('zoom_direct', decoders=(number,))
+        def zoom_direct(camId, value):
+            for thisKey in self.cam_ids(camId):
+                zoomPosition = self.ranges[thisKey].zoom_to_position(value)
+                post_fader_visca(visca.zoom_direct(zoomPosition), 'zoom', ('direct', zoomPosition), thisKey)
+
+        zoomCommands = {
+            'zoom_tele': lambda zoomSpeed: (visca.zoom_tele, ('tele', None)),
+            'zoom_wide': lambda zoomSpeed: (visca.zoom_wide, ('wide', None)),
+            'zoom_tele_variable': lambda zoomSpeed: (visca.zoom_tele_variable(zoomSpeed), ('tele', zoomSpeed)),
+            'zoom_wide_variable': lambda zoomSpeed: (visca.zoom_wide_variable(zoomSpeed), ('wide', zoomSpeed)),
+        }
+
+        def zoom_move(osc_command):
+            def handler(camId, speed):
+                discard_fader_visca('zoom', camId)
+                if speed > 0 and osc_command in zoomCommands:
+                    message, value = zoomCommands[osc_command](int(speed))
+                    send_visca_if_changed(message, 'zoom', value, camId)
+                else: # when the button is released the osc_argument should be 0
+                    send_visca_if_changed(visca.zoom_stop, 'zoom', ('stop',), camId)
+            return handler
+
+        for osc_command in zoomCommands:
+            routes.add(osc_command, zoom_move(osc_command), optional(driveSpeed, 0))
+        routes.add('zoom_stop', zoom_move('zoom_stop'), optional(driveSpeed, 0))
+
+        # ----- Focus Commands -----
+        @routes.route('focus_auto')
+        def focus_auto(camId):
+            discard_fader_visca('focus', camId)
+            send_visca_if_changed(visca.focus_auto, 'focusMode', 'auto', camId)
+
+        @routes.route('focus_manual')
+        def focus_manual(camId):
+            discard_fader_visca('focus', camId)
+            send_visca_if_changed(visca.focus_manual, 'focusMode', 'manual', camId)
+
+        @routes.route('focus_stop')
+        def focus_stop(camId):
+            discard_fader_visca('focus', camId)
+            send_visca_if_changed(visca.focus_stop, 'focus', ('stop',), camId)
+
+        @routes.route('focus_one_push')
+        def focus_one_push(camId):
+            discard_fader_visca('focus', camId)
+            send_visca(visca.focus_one_push,camId)
+
+        @routes.route('focus_direct', decoders=(number,))
+        def focus_direct(camId, value):
+            for thisKey in self.cam_ids(camId):
+                focusPosition = self.ranges[thisKey].focus_to_position(value)
+                post_fader_visca(visca.focus_direct(focusPosition), 'focus', ('direct', focusPosition), thisKey)
+
+        focusCommands = {
+            'focus_far': lambda focusSpeed: (visca.focus_far_variable(focusSpeed), ('far', focusSpeed)),
+            'focus_near': lambda focusSpeed: (visca.focus_near_variable(focusSpeed), ('near', focusSpeed)),
+        }
+
+        def focus_move(osc_command):
+            def handler(camId, speed):
+                discard_fader_visca('focus', camId)
+                if speed > 0:
+                    message, value = focusCommands[osc_command](int(speed))
+                    send_visca_if_changed(message, 'focus', value, camId)
+                else: # when the button is released the osc_argument should be 0
+                    send_visca_if_changed(visca.focus_stop, 'focus', ('stop',), camId)
+            return handler
+
+        for osc_command in focusCommands:
+            routes.add(osc_command, focus_move(osc_command), optional(driveSpeed, 0))
+
+        # ----- Pan / Tilt Commands -----
+        # Absolute Position: pan speed, tilt speed, pan degrees, tilt degrees
+        @routes.route('pan_absolute_position', decoders=(number, number, optional(number, 0.0), optional(number, 0.0)))
+        def pan_absolute_position(camId, panSpeed, tiltSpeed, numP, numT):
+            if panSpeed > 0 and tiltSpeed > 0:
+                panSpeed, tiltSpeed = int(panSpeed), int(tiltSpeed)
+                for thisKey in self.cam_ids(camId):
+                    panPosition, tiltPosition = self.ranges[thisKey].pan_to_position(numP, numT)
+                    convMsg = visca.pan_absolute(panSpeed, tiltSpeed, panPosition, tiltPosition)
+                    post_fader_visca(convMsg, 'panTilt', ('absolute', panSpeed, tiltSpeed, panPosition, tiltPosition), thisKey)
             else: # when the button is released the osc_argument should be 0
-                send_visca(pan_stop,camId)
-            
+                discard_fader_visca('panTilt', camId)
+                send_visca_if_changed(visca.pan_stop, 'panTilt', ('stop',), camId)
+
         # Pan home.... this one seems to break for some reason.
-        elif 'pan_home' in osc_command:
-            send_visca(pan_home,camId)
-#            send_osc("EDIT",["led_1","value",1])
-            send_osc("led_1",1)
-            
-        else:  
-            if args[0] > 0 or args[1] >0:
-                panSpeed = str(int(args[0])).zfill(2)
-                tiltSpeed = str(int(args[1])).zfill(2)
-                send_visca(panDic[osc_command].replace('VV', panSpeed).replace('WW', str(tiltSpeed)),camId)
-            else: # when the button is released the osc_argument should be 0
-                send_visca(pan_stop,camId)
-                
-    # ---- TALLY LIGHTS ----
-    elif ("tally" in osc_command):
-        tallyOn = "81 0A 02 02 02 FF"
-        tallyOff = "81 0A 02 02 03 FF" 
-        tallyBlink = "81 0A 02 02 01 FF"
-        if args[0] ==2:
-            setTally =  tallyBlink
-        elif args[0] ==1:
-            setTally =  tallyOn
-        else:
-            setTally = tallyOff
-            
-        send_visca(setTally,camId)
+        @routes.route('pan_home')
+        def pan_home(camId):
+            discard_fader_visca('panTilt', camId)
+            send_visca_if_changed(visca.pan_home, 'panTilt', ('home',), camId)
 
-#        target = "birddogavsetup"
-#        setting='av_nditally'
-#        jsonObj = {setting:setTally}
-#        post_birddog_rest(target,jsonObj,camId="1")
+        # Joystick: pan_up, pan_down_left, ... and pan_stop, with pan and tilt speed
+        def pan_drive(osc_command):
+            def handler(camId, panSpeed, tiltSpeed):
+                discard_fader_visca('panTilt', camId)
+                if panSpeed > 0 or tiltSpeed > 0:
+                    panSpeed, tiltSpeed = int(panSpeed), int(tiltSpeed)
+                    send_visca_if_changed(visca.pan_drive(osc_command, panSpeed, tiltSpeed), 'panTilt', (osc_command, panSpeed, tiltSpeed), camId)
+                else: # when the button is released the osc_argument should be 0
+                    send_visca_if_changed(visca.pan_stop, 'panTilt', ('stop',), camId)
+            return handler
 
-    else:
-        print("I don't know what to do with", osc_command, osc_argument)
-    send_osc('SentMessageLabel', osc_command)
-
-CAM_FocusModeInq = '81 09 04 38 FF' #	y0 50 02 FF	Auto Focus
-                                    #   y0 50 03 FF	Manual Focus
-CAM_versionInq = '81 09 00 02 FF'
-                     
-network_set = "88 30 01 ff"
-
-def get_updates(toggler):
-    
-    for thisKey in camipDic.keys():
-        # Focus mode
-        focusMode = send_visca_status(CAM_FocusModeInq,camId=thisKey)
-        if focusMode == b'002':
-            send_osc("led_af_"+thisKey,1) #Auto Focus on
+        for osc_command in visca.panDirections:
+            routes.add(osc_command, pan_drive(osc_command), optional(number, 0), optional(number, 0))
+
+        # ---- TALLY LIGHTS ----
+        @routes.route('tally', decoders=(number,))
+        def tally(camId, state):
+            tallyState = int(state) if state in (1, 2) else 0 # 2: blink, 1: on, else off
+            send_visca_if_changed(visca.tally(tallyState), 'tally', tallyState, camId)
+
+        #        target = "birddogavsetup"
+        #        setting='av_nditally'
+        #        jsonObj = {setting:setTally}
+        #        post_birddog_rest(target,jsonObj,camId="1")
+
+    # --------------------------------------------------------
+    #  OSC Parse
+    #  This is the main function to handle P200 Functions
+    #  It translates OSC inpuit to VISCA output, through the
+    #  route table above
+    # --------------------------------------------------------
+    def parse_osc_message(self, osc_address, osc_path, args, received=None):
+        if self.feedbackRelay is None:
+            self.subscribers.seen(osc_address[0])
+        call = self.routes.resolve(osc_path, args)
+        if call is not None:
+            self.run_osc_calls(osc_address[0], [call], received)
+
+    def run_osc_calls(self, sender, calls, received=None):
+        # calls: (route, camId, decoded args) from routes.resolve(),
+        # received: perf_counter() time they arrived or were due
+        self.sender = sender
+        for route, camId, values in calls:
+            if metrics.registry.enabled:
+                metrics.registry.begin(route.command, camId, received)
+            route.handler(camId, *values)
+            self.send_osc('SentMessageLabel', route.command, None if camId == "0" else camId)
+
+    # --------------------------------------------------------
+    #  OSC Bundles
+    #  A bundle is taken as a unit: every message is decoded
+    #  first, then they all run in one go (one loop iteration,
+    #  nothing else in between), so a bundle moving three
+    #  cameras starts all three sends together. A bundle with
+    #  a time tag in the future runs at that time; one too far
+    #  ahead (max_bundle_delay) is dropped
+    # --------------------------------------------------------
+    def parse_osc_bundle(self, osc_address, messages, received=None):
+        sender = osc_address[0]
+        if self.feedbackRelay is None:
+            self.subscribers.seen(sender)
+        self.bundles += 1
+        timed = {} # time tag -> calls, in bundle order
+        for when, osc_path, args in messages:
+            call = self.routes.resolve(osc_path, args)
+            if call is not None:
+                timed.setdefault(when, []).append(call)
+        for when, calls in timed.items():
+            delay = 0.0 if when is None else when - time.time()
+            if delay > max_bundle_delay:
+                self.bundlesDropped += 1
+                log.warning('OSC bundle from %s is %.1f s ahead, dropped', sender, delay)
+            elif delay > bundle_tolerance:
+                self.bundlesScheduled += 1
+                asyncio.get_running_loop().call_later(delay, self.run_osc_calls, sender, calls,
+                                                      None if received is None else received + delay)
+            else:
+                self.run_osc_calls(sender, calls, received)
+
+    # --------------------------------------------------------
+    #  OSC Protocol
+    # --------------------------------------------------------
+    def protocol_factory(self):
+        return osc_routes.OSCRouteProtocol(self.parse_osc_message, self.parse_osc_bundle)
+
+    # ==============================================================
+    #  Status (From Birddog P200s to Open Stage Control)
+    # ==============================================================
+    # --------------------------------------------------------
+    # Control surface feedback is driven from the camera state
+    # only, whether the change came from a command we sent or
+    # from the camera's reply to the poller
+    # --------------------------------------------------------
+    def state_changed(self, camId, name, value):
+        if name == 'focusMode':
+            if value == 'auto':
+                self.send_osc("led_af_"+camId,1,camId) #Auto Focus on
+            else:
+                self.send_osc("led_af_"+camId,0,camId) # Auto focus off (or unknown)
+        elif name == 'online':
+            self.send_osc("led_online_"+camId, 1 if value else 0, camId)
+        elif name == 'panTilt' and value == ('home',):
+        #    send_osc("EDIT",["led_1","value",1])
+            self.send_osc("led_1",1)
+
+    # --------------------------------------------------------
+    # Camera online / offline (visca_transport circuit breaker):
+    # led_online_N on the control surface. A camera that comes
+    # back gets its sequence number reset, and what we thought
+    # it was doing is forgotten while it's away
+    # --------------------------------------------------------
+    def camera_health_changed(self, camId, online):
+        self.states[camId].observe('online', online)
+        if online:
+            self.reset_sequence_number_function(camId)
         else:
-            send_osc("led_af_"+thisKey,0) # Auto focus off
-    # Send update to OSC
-        
-    #send_osc("led_1",toggler)
-    
-
-    return
-
-def osc_update_thread():
-    updateInterval = 3 #seconds
-    toggler = 1;
-    while(True):
-        time.sleep(updateInterval)
-        get_updates(toggler)
-        toggler = toggler ^ 1;
+            self.states[camId].forget()
+
+    # Called by the poller only when a polled value changes
+    def status_changed(self, camId, name, value):
+        self.states[camId].observe(name, value)
+
+    def status_current(self, camId, name):
+        return self.states[camId].get(name) if camId in self.states else None
+
+    # ==============================================================
+    #  Metrics (latency histograms / counters)
+    # ==============================================================
+    # Counters kept by other parts of the server
+    def collect_counters(self):
+        yield 'visca_stale_replies_total', {}, visca_transport.router.stale
+        yield 'visca_malformed_replies_total', {}, visca_transport.router.malformed
+        yield 'fader_coalesced_total', {}, self.fader_mailbox.coalesced
+        yield 'osc_bundles_total', {}, self.bundles
+        yield 'osc_bundles_scheduled_total', {}, self.bundlesScheduled
+        yield 'osc_bundles_dropped_total', {}, self.bundlesDropped
+        yield 'macros_started_total', {}, self.macros.started
+        yield 'macros_aborted_total', {}, self.macros.aborted
+        yield 'macros_failed_total', {}, self.macros.failed
+        for thisKey in self.camipDic.keys():
+            yield 'commands_suppressed_total', {'camera': thisKey}, self.states[thisKey].suppressed
+
+    # Commands waiting for their slot (see visca_scheduler), smoothed
+    # RTT and online state (see camera_health), per camera, and the
+    # number of control surfaces getting feedback
+    def collect_camera_gauges(self):
+        for thisKey, camera in self.cameras.items():
+            yield 'visca_queue_depth', {'camera': thisKey}, camera.scheduler.depth()
+            yield 'visca_rtt_seconds', {'camera': thisKey}, camera.rtt.srtt or 0.0
+            yield 'camera_online', {'camera': thisKey}, int(camera.breaker.online)
+        yield 'osc_subscribers', {}, len(self.subscribers)
+
+    # How late each macro step ran (see macro_engine)
+    def observe_macro_step(self, name, camId, seconds):
+        if metrics.registry.enabled:
+            metrics.registry.observe('macro_step_late_seconds', camId, name, seconds)
+
+    # Per camera latency summary for the control surface
+    async def metrics_summary_task(self):
+        summaryInterval = self.metricsInfo.get("summaryInterval", metrics.default_summary_interval)
+        while(True):
+            await asyncio.sleep(summaryInterval)
+            for thisKey in self.camipDic.keys():
+                self.send_osc("latency_"+thisKey, metrics.registry.summary(thisKey), thisKey)
+
 
 # --------------------------------------------------------
 #  Main Routine
 # --------------------------------------------------------
-# Start off by resetting sequence number
-sequence_number = 1 # a global variable that we'll iterate each command, remember 0x0001
-reset_sequence_number_function()
-
-## Test: 
-#osc_update_thread()
-#
-## Launch Status Update Thread:
-x = threading.Thread(target=osc_update_thread)#,args=(schedUpdate,))
-x.start()
-    
-# Then start the OSC server to receive messages
-receive_loop = asyncio.get_event_loop()
-coro = receive_loop.create_datagram_endpoint(protocol_factory, local_addr=('0.0.0.0', osc_receive_port))
-transport, protocol = receive_loop.run_until_complete(coro)
-receive_loop.run_forever()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Translate OSC from the control surface to VISCA for the cameras')
+    parser.add_argument('config', nargs='?', default=default_config_file)
+    parser.add_argument('--osc-port', type=int, default=osc_receive_port, help='OSC receive port')
+    parser.add_argument('--sharded', action='store_true', help='one worker process per camera (see shard_supervisor)')
+    parser.add_argument('--record', metavar='FILE', help='record OSC and VISCA traffic to FILE (see replay_traffic.py)')
+    # set by shard_supervisor for its workers
+    parser.add_argument('--cameras', help=argparse.SUPPRESS)
+    parser.add_argument('--feedback-relay', help=argparse.SUPPRESS)
+    parser.add_argument('--metrics-port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    configs = load_config(args.config)
+    # sharded workers each write their own log file
+    server_log.start(configs.get("logging"), '-cameras-' + args.cameras.replace(',', '_') if args.cameras else '')
+    if args.sharded:
+        if args.record:
+            parser.error('--record is not supported with --sharded')
+        import shard_supervisor
+        server = shard_supervisor.Supervisor(configs, args.config, oscReceivePort=args.osc_port)
+    else:
+        feedbackRelay = None
+        if args.feedback_relay:
+            host, port = args.feedback_relay.rsplit(':', 1)
+            feedbackRelay = (host, int(port))
+        server = Server(configs, oscReceivePort=args.osc_port, configFile=args.config,
+                        camIds=args.cameras.split(',') if args.cameras else None,
+                        feedbackRelay=feedbackRelay, metricsPort=args.metrics_port, recordFile=args.record)
+    receive_loop = asyncio.get_event_loop()
+    receive_loop.run_until_complete(server.start())
+    try:
+        receive_loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        server_log.stop()
+
+if __name__ == '__main__':
+    main()
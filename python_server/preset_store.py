@@ -0,0 +1,197 @@
+'''
+Description:
+    Presets measured from the cameras, and scenes recalled from them.
+
+    memory_set asks the camera where it actually is (pan/tilt position
+    and lens block inquiries) and keeps that as the preset, next to the
+    camera's own memory. The store is a JSON file next to the config
+    ("presetFile"), written in the background (to a temporary file,
+    then renamed) whenever a preset changes.
+
+    A scene is one preset number recalled on several cameras at once.
+    Instead of the camera's memory recall (which moves at whatever speed
+    the camera likes), every camera gets an absolute pan/tilt move and a
+    zoom/focus direct, all sent together. plan_scene picks the pan and
+    tilt speeds from each camera's motion ("panRate", "tiltRate":
+    degrees per second at top speed, "zoomTime": seconds for the whole
+    zoom range), so the camera with the longest way to go moves at top
+    speed and the others slow down to arrive at the same time. Zoom
+    direct has no speed, so the longest zoom sets the shortest scene.
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import asyncio
+import json
+import math
+import os
+from collections import namedtuple
+
+import visca_decoder
+import visca_encoder as visca
+
+import server_log
+
+# --------------------------------------------------------
+#  Settings
+# --------------------------------------------------------
+log = server_log.logger('preset')
+default_preset_file = 'osc_visca_presets.json'
+default_pan_rate = 100.0 # degrees per second at top pan speed
+default_tilt_rate = 100.0 # degrees per second at top tilt speed
+default_zoom_time = 3.0  # seconds for a zoom direct across the whole range
+arrival_tolerance = 0.05 # fraction of the scene a camera may arrive late, rather than much too early
+
+# positions as the camera reports them (16 bit ints)
+Preset = namedtuple('Preset', 'pan tilt zoom focus focusMode')
+
+# what one camera's part of a scene takes
+Move = namedtuple('Move', 'panSpeed tiltSpeed seconds')
+
+
+def preset_from_replies(positionReply, lensReply):
+    # pan/tilt position and lens block inquiry replies -> Preset,
+    # None unless the camera answered both
+    position = visca_decoder.decode_pan_tilt_position(positionReply)
+    lens = visca_decoder.decode_lens_control(lensReply)
+    if position is None or lens is None:
+        return None
+    return Preset(position.panPosition, position.tiltPosition, lens.zoomPosition, lens.focusPosition, lens.focusMode)
+
+
+# ==============================================================
+#  Scene planning
+# ==============================================================
+def axis_seconds(degrees, rate, speed, topSpeed):
+    # seconds to travel degrees at a VISCA speed (1 - topSpeed), the
+    # speed scaling the top rate linearly
+    if degrees == 0:
+        return 0.0
+    return degrees / (rate * speed / topSpeed)
+
+def axis_speed(degrees, rate, seconds, topSpeed):
+    # the speed arriving closest to seconds (speeds are whole
+    # steps, so rarely exactly), at most arrival_tolerance late
+    if degrees == 0 or seconds <= 0:
+        return topSpeed
+    exact = degrees * topSpeed / (rate * seconds)
+    slower = min(topSpeed, max(1, int(math.floor(exact))))
+    faster = min(topSpeed, slower + 1)
+    slowerSeconds = axis_seconds(degrees, rate, slower, topSpeed)
+    if slowerSeconds > seconds * (1 + arrival_tolerance):
+        return faster
+    if seconds - axis_seconds(degrees, rate, faster, topSpeed) < slowerSeconds - seconds:
+        return faster
+    return slower
+
+def plan_scene(cameras, seconds=0.0):
+    '''cameras: camId -> (ranges, motion, current Preset, target Preset),
+    motion being {"panRate", "tiltRate", "zoomTime"}. Returns the
+    scene's duration (at least seconds) and camId -> Move.'''
+    distances = {}
+    for camId, (ranges, motion, current, target) in cameras.items():
+        fromP, fromT = ranges.position_to_pan(current.pan, current.tilt)
+        toP, toT = ranges.position_to_pan(target.pan, target.tilt)
+        zoomSeconds = abs(target.zoom - current.zoom) / ranges.rangeZ * motion["zoomTime"]
+        distances[camId] = (abs(toP - fromP), abs(toT - fromT), zoomSeconds)
+        seconds = max(seconds, zoomSeconds,
+                      axis_seconds(abs(toP - fromP), motion["panRate"], visca.top_pan_speed, visca.top_pan_speed),
+                      axis_seconds(abs(toT - fromT), motion["tiltRate"], visca.top_tilt_speed, visca.top_tilt_speed))
+
+    moves = {}
+    for camId, (panDegrees, tiltDegrees, zoomSeconds) in distances.items():
+        motion = cameras[camId][1]
+        panSpeed = axis_speed(panDegrees, motion["panRate"], seconds, visca.top_pan_speed)
+        tiltSpeed = axis_speed(tiltDegrees, motion["tiltRate"], seconds, visca.top_tilt_speed)
+        moves[camId] = Move(panSpeed, tiltSpeed, max(
+            zoomSeconds,
+            axis_seconds(panDegrees, motion["panRate"], panSpeed, visca.top_pan_speed),
+            axis_seconds(tiltDegrees, motion["tiltRate"], tiltSpeed, visca.top_tilt_speed)))
+    return seconds, moves
+
+def scene_messages(preset, move):
+    # VISCA payloads taking one camera to its preset: focus mode
+    # first, then pan/tilt and zoom (with focus, when manual)
+    messages = []
+    if preset.focusMode == 'auto':
+        messages.append(visca.focus_auto)
+        lens = visca.zoom_direct(preset.zoom)
+    else:
+        messages.append(visca.focus_manual)
+        lens = visca.zoom_focus_direct(preset.zoom, preset.focus)
+    messages.append(visca.pan_absolute_speeds(move.panSpeed, move.tiltSpeed, preset.pan, preset.tilt))
+    messages.append(lens)
+    return messages
+
+
+# ==============================================================
+#  Store
+# ==============================================================
+class PresetStore:
+    def __init__(self, path=default_preset_file):
+        self.path = path
+        self.presets = {} # camId -> {memory: Preset}
+        self.saving = None # Task writing the file
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as json_file:
+                stored = json.load(json_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            log.warning('Presets %s not loaded: %s', self.path, e)
+            return
+        if not isinstance(stored, dict):
+            log.warning('Presets %s not loaded: not an object of cameras', self.path)
+            return
+        presets = {}
+        for camId, memories in stored.items():
+            if not isinstance(memories, dict):
+                log.warning('Presets of camera %s in %s skipped: not an object of presets', camId, self.path)
+                continue
+            for memory, preset in memories.items():
+                try:
+                    presets.setdefault(camId, {})[int(memory)] = Preset(**preset)
+                except (TypeError, ValueError) as e:
+                    log.warning('Preset %s of camera %s in %s skipped: %s', memory, camId, self.path, e)
+        self.presets = presets
+        log.info('Loaded %d preset(s) from %s', sum(len(memories) for memories in self.presets.values()), self.path)
+
+    def get(self, camId, memory):
+        return self.presets.get(camId, {}).get(memory)
+
+    def set(self, camId, memory, preset):
+        self.presets.setdefault(camId, {})[memory] = preset
+        self.save()
+
+    # --------------------------------------------------------
+    # Saved off the loop; changes made while a save is running
+    # go out in one more save after it
+    # --------------------------------------------------------
+    def save(self):
+        self.dirty = True
+        if self.saving is None:
+            self.saving = asyncio.ensure_future(self.save_task())
+
+    async def save_task(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self.dirty:
+                self.dirty = False
+                stored = {camId: {str(memory): preset._asdict() for memory, preset in sorted(memories.items())}
+                          for camId, memories in self.presets.items()}
+                try:
+                    await loop.run_in_executor(None, self.write, stored)
+                except OSError as e:
+                    log.warning('Presets %s not saved: %s', self.path, e)
+        finally:
+            self.saving = None
+
+    def write(self, stored):
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as json_file:
+            json.dump(stored, json_file, indent=4)
+        os.replace(temporary, self.path)
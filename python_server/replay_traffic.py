@@ -0,0 +1,187 @@
+'''
+Description:
+    Plays a traffic recording (osc_visca_server.py --record) back through
+    the server: every recorded OSC datagram is sent again, as it was, at
+    its original time from the start of the recording divided by --speed
+    (--speed 0: as fast as they can be sent).
+
+    Against whatever the server is pointed at (the real cameras, or
+    camera_emulator.py):
+        python replay_traffic.py service.rec [--speed 4] [--host 127.0.0.1] [--port 8002]
+
+    Against emulated cameras, started here with a server on the emulated
+    config (as bench_osc_visca.py does). The VISCA commands the emulators
+    receive are counted per camera next to the ones in the recording:
+        python replay_traffic.py service.rec --emulate osc_visca_config.json [--latency 2] ...
+
+    What is in a recording:
+        python replay_traffic.py service.rec --dump
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import argparse
+import asyncio
+import binascii
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiosc
+
+import camera_emulator
+import traffic_recorder
+import visca_encoder as visca
+
+# --------------------------------------------------------
+#  Settings
+# --------------------------------------------------------
+server_timeout = 15.0 # seconds for the server to reach the emulated cameras
+settle_time = 1.0     # seconds to wait for the last commands after the replay
+
+
+# --------------------------------------------------------
+#  Dump
+# --------------------------------------------------------
+def describe(record):
+    if record.kind == traffic_recorder.OSC_IN:
+        try:
+            if record.data.startswith(b'#bundle'):
+                return 'bundle ' + ' '.join(path for path, _ in aiosc.parse_bundle(record.data))
+            path, args = aiosc.parse_message(record.data)
+            return '%s %s' % (path, ' '.join(str(arg) for arg in args))
+        except Exception:
+            pass
+    return binascii.hexlify(record.data).decode()
+
+def dump(path):
+    startedAt, records = traffic_recorder.read_recording(path)
+    print('Recorded', time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(startedAt)))
+    for record in records:
+        print('%10.4f  %-13s %-15s %s' % (record.time, traffic_recorder.kind_names.get(record.kind, record.kind),
+                                         record.ip, describe(record)))
+
+
+# ==============================================================
+#  Replay
+# ==============================================================
+class CommandCounter:
+    '''VISCA commands the emulated cameras receive, per camera.'''
+
+    def __init__(self):
+        self.commands = {}
+        self.started = set() # cameras the server has reached
+
+    def received(self, camId, payload_type, payload, receivedAt):
+        self.started.add(camId)
+        if payload_type == visca.PAYLOAD_COMMAND:
+            self.commands[camId] = self.commands.get(camId, 0) + 1
+
+async def replay(records, transport, speed, start=0.0):
+    '''Sends the OSC records at their time, returns (datagrams, worst lateness).'''
+    loop = asyncio.get_running_loop()
+    began = loop.time()
+    sent = 0
+    late = 0.0
+    for record in records:
+        if record.kind != traffic_recorder.OSC_IN or record.time < start:
+            continue
+        if speed:
+            due = began + (record.time - start) / speed
+            now = loop.time()
+            if due > now:
+                await asyncio.sleep(due - now)
+            else:
+                late = max(late, now - due)
+        transport.sendto(record.data)
+        sent += 1
+    return sent, late
+
+async def wait_for_server(counter, camIds, timeout):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        if counter.started.issuperset(camIds):
+            return True
+        await asyncio.sleep(0.1)
+    return False
+
+async def run(args):
+    loop = asyncio.get_running_loop()
+    _, records = traffic_recorder.read_recording(args.recording)
+    records = list(records)
+
+    server = None
+    counter = None
+    if args.emulate:
+        with open(args.emulate) as json_file:
+            configs = json.load(json_file)
+        addresses = camera_emulator.camera_addresses(configs, loopback=True)
+        counter = CommandCounter()
+        await camera_emulator.start_emulators(addresses, onReceive=counter.received,
+                                              **camera_emulator.emulator_settings(args))
+        configFile = os.path.join(tempfile.gettempdir(), 'replay_traffic_config.json')
+        with open(configFile, 'w') as json_file:
+            json.dump(camera_emulator.emulated_config(configs, addresses), json_file, indent=4)
+        log = open(args.server_log, 'w') if args.server_log else subprocess.DEVNULL
+        server = subprocess.Popen([sys.executable, 'osc_visca_server.py', configFile, '--osc-port', str(args.port)],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)), stdout=log, stderr=subprocess.STDOUT)
+        if not await wait_for_server(counter, addresses.keys(), server_timeout):
+            server.terminate()
+            raise SystemExit('osc_visca_server.py did not reach the emulated cameras')
+        counter.commands.clear()
+
+    transport, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol, remote_addr=(args.host, args.port))
+    try:
+        started = loop.time()
+        sent, late = await replay(records, transport, args.speed, args.start)
+        elapsed = loop.time() - started
+        print('Replayed %d OSC datagrams in %.2f s (x%s), worst %.1f ms late'
+              % (sent, elapsed, args.speed or 'max', late * 1000))
+        if counter is not None:
+            await asyncio.sleep(settle_time)
+            report(records, configs, counter, args.start)
+    finally:
+        transport.close()
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+def report(records, configs, counter, start):
+    # recorded commands are matched to cameras by the config's IPs,
+    # from the first OSC replayed (not the server's own startup)
+    camIds = {ip: camId for camId, ip in camera_emulator.camera_addresses(configs).items()}
+    start = min((record.time for record in records if record.kind == traffic_recorder.OSC_IN and record.time >= start),
+                default=start)
+    recorded = {}
+    for record in records:
+        if record.kind == traffic_recorder.VISCA_COMMAND and record.time >= start and record.ip in camIds:
+            camId = camIds[record.ip]
+            recorded[camId] = recorded.get(camId, 0) + 1
+    print('Camera   recorded commands   replayed commands')
+    for camId in sorted(set(recorded) | set(counter.commands), key=int):
+        print('%-8s %17d %19d' % (camId, recorded.get(camId, 0), counter.commands.get(camId, 0)))
+
+def main():
+    parser = argparse.ArgumentParser(description='Play a traffic recording back through osc_visca_server.py')
+    parser.add_argument('recording')
+    parser.add_argument('--speed', type=float, default=1.0, help='playback speed (0: as fast as possible)')
+    parser.add_argument('--start', type=float, default=0.0, help='skip the first seconds of the recording')
+    parser.add_argument('--host', default='127.0.0.1', help='OSC server address')
+    parser.add_argument('--port', type=int, default=8002, help='OSC server port')
+    parser.add_argument('--dump', action='store_true', help='list the recording instead of playing it')
+    parser.add_argument('--emulate', metavar='CONFIG', help='start emulated cameras for CONFIG and a server for them')
+    parser.add_argument('--server-log', help='write the server output to this file')
+    camera_emulator.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.dump:
+        dump(args.recording)
+        return
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+'''
+Description:
+    Logging for the server, off the hot path.
+
+    Every module logs to its subsystem's logger (logger('visca'),
+    logger('osc'), ...) with %-style arguments, so a record a disabled
+    level or subsystem would drop costs one level check and nothing is
+    formatted. Records that pass go on a queue; a background thread
+    (logging.handlers.QueueListener) formats them and writes them to the
+    console and, if configured, a rotating log file. Sending a VISCA
+    frame or dispatching an OSC message never waits on the console.
+
+    Configured by "logging" in the config (reapplied on reload):
+
+        "logging": {
+            "level": "INFO",                     every subsystem
+            "subsystems": {"visca": "DEBUG"},    per subsystem
+            "console": true,
+            "file": "osc_visca_server.log",      rotated at maxBytes,
+            "maxBytes": 1000000,                 backupCount old files kept
+            "backupCount": 5
+        }
+
+    Subsystems: visca, osc, feedback, rest, config, poller, health,
+    fader, shard, recorder, preset, macro. Every VISCA frame sent is
+    logged at DEBUG on visca.
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+# --------------------------------------------------------
+#  Settings
+# --------------------------------------------------------
+root_name = 'osc_visca'
+default_level = 'INFO'
+default_max_bytes = 1000000
+default_backup_count = 5
+log_format = '%(asctime)s %(levelname)-7s %(name)s: %(message)s'
+
+subsystems = ('visca', 'osc', 'feedback', 'rest', 'config', 'poller', 'health', 'fader', 'shard', 'recorder',
+              'preset', 'macro')
+
+listener = None
+
+
+def logger(subsystem):
+    return logging.getLogger(root_name + '.' + subsystem)
+
+
+class Hex:
+    '''Hex of a VISCA frame, made only if the record is written.'''
+
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return self.data.hex()
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    # QueueHandler formats the message in the caller's thread; leave
+    # it to the listener (our arguments are immutable values)
+    def prepare(self, record):
+        return record
+
+
+# --------------------------------------------------------
+# Start the background handler (once per process); suffix
+# keeps the log files of sharded workers apart
+# --------------------------------------------------------
+def start(settings=None, suffix=''):
+    global listener
+    settings = settings or {}
+    if listener is not None:
+        stop()
+    formatter = logging.Formatter(log_format)
+    handlers = []
+    if settings.get("console", True):
+        handlers.append(logging.StreamHandler(sys.stdout))
+    if settings.get("file"):
+        base, extension = os.path.splitext(settings["file"])
+        handlers.append(logging.handlers.RotatingFileHandler(
+            base + suffix + extension, maxBytes=settings.get("maxBytes", default_max_bytes),
+            backupCount=settings.get("backupCount", default_backup_count)))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger(root_name)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DeferredQueueHandler(records))
+    root.propagate = False
+    listener = logging.handlers.QueueListener(records, *handlers)
+    listener.start()
+    set_levels(settings)
+
+def level_number(name):
+    if isinstance(name, int):
+        return name
+    number = logging.getLevelName(str(name).upper())
+    if not isinstance(number, int):
+        raise ValueError('Unknown log level %s' % name)
+    return number
+
+def set_levels(settings=None):
+    # unknown level names raise ValueError (a reload keeps the old config)
+    settings = settings or {}
+    levels = {subsystem: level_number(level) for subsystem, level in settings.get("subsystems", {}).items()}
+    logging.getLogger(root_name).setLevel(level_number(settings.get("level", default_level)))
+    for subsystem in set(subsystems) | set(levels):
+        logger(subsystem).setLevel(levels.get(subsystem, logging.NOTSET))
+
+def stop():
+    # writes out whatever is still queued
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
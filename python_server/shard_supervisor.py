@@ -0,0 +1,471 @@
+'''
+Description:
+    Sharded mode: one worker process per camera (or group of cameras).
+
+        python osc_visca_server.py osc_visca_config.json --sharded
+
+    The supervisor owns the OSC port. Every message is passed on, as the
+    same datagram, to the worker owning the camera in its path (to every
+    worker for camera "0"), over UDP on the loopback interface. Bundles
+    are split per worker and packed again with their time tags, so a
+    timed bundle still runs at the same moment on every camera.
+
+    A worker is an ordinary osc_visca_server.Server limited to its cameras
+    (--cameras), on its own port: it owns their VISCA sockets, sequence
+    numbers, scheduler, state and polling, and watches the config for
+    changes to them. Its feedback goes back to the supervisor as
+    /camId/command, and the supervisor publishes it to the control
+    surfaces (osc_feedback), which subscribe, unsubscribe and reload
+    through the supervisor (/N/reload_config is passed on to camera N's
+    worker as well, /0/reload_config to every worker).
+
+    Macros (see macro_engine) run here, on one timeline for every
+    camera: /N/macro_run and /N/macro_abort aren't passed on, and every
+    step goes out at its time as if the control surface had sent it
+    (to the camera's worker, a scene on every camera synchronised as
+    below). Their feedback (macro_running, macro_done, ...) comes from
+    here too, once. A step's arguments are checked by the worker when
+    it runs; the macro only checks its cameras exist.
+
+    A worker that exits is restarted after restart_backoff seconds,
+    doubling while it keeps crashing; its cameras show offline
+    (led_online_N 0) until it is back.
+
+    "workerGroups" in the config ([["1", "2"], ["3"]]) groups cameras
+    into workers, each camera not in a group gets its own worker.
+
+    A scene on every camera (/0/memory_recall, /0/scene_recall) is
+    coordinated here, so cameras in different workers still arrive
+    together: every worker is asked how long its cameras need
+    (/0/scene_plan), then all of them get /0/scene_sync with the longest
+    in one bundle timed scene_start_delay ahead, and the control surfaces
+    get a single scene_ready (scene_failed if any worker failed) once
+    every worker has reported back.
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import asyncio
+import os
+import sys
+import time
+from collections import namedtuple
+
+import aiosc
+
+import config_watch
+import macro_engine
+import metrics
+import osc_feedback
+import osc_routes
+import osc_visca_server
+import server_log
+
+# --------------------------------------------------------
+#  Settings
+# --------------------------------------------------------
+log = server_log.logger('shard')
+worker_base_port = 18100    # first worker's OSC port, on 127.0.0.1
+restart_backoff = 1.0       # seconds before a crashed worker is restarted, doubling
+max_restart_backoff = 30.0
+stable_time = 60.0          # a worker up this long starts over at restart_backoff
+stop_timeout = 2.0          # seconds a worker gets to exit before it is killed
+
+local_commands = ('subscribe', 'unsubscribe', 'reload_config', 'macro_run', 'macro_abort')
+scene_commands = ('memory_recall', 'scene_recall') # coordinated for camera "0"
+scene_plan_timeout = 1.0 # seconds the workers get to plan a scene, then it starts without the late ones
+scene_start_delay = 0.05 # a synchronised scene starts this far ahead, on every worker at once
+
+server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'osc_visca_server.py')
+
+
+def worker_groups(configs):
+    # tuples of camIds, one per worker
+    camIds = list(osc_visca_server.camera_ips(configs).keys())
+    groups = []
+    for group in configs.get("workerGroups", []):
+        group = tuple(str(camId) for camId in group if str(camId) in camIds)
+        if group:
+            groups.append(group)
+    grouped = {camId for group in groups for camId in group}
+    return groups + [(camId,) for camId in camIds if camId not in grouped]
+
+
+# ==============================================================
+#  Worker process
+# ==============================================================
+class Worker:
+    def __init__(self, supervisor, camIds, port, metricsPort=None):
+        self.supervisor = supervisor
+        self.camIds = camIds
+        self.addr = ('127.0.0.1', port)
+        self.metricsPort = metricsPort
+        self.process = None
+        self.task = None
+        self.stopping = False
+        self.restarts = 0
+
+    def command(self):
+        command = [sys.executable, server_script, self.supervisor.configFile,
+                   '--osc-port', str(self.addr[1]), '--cameras', ','.join(self.camIds),
+                   '--feedback-relay', '%s:%d' % self.supervisor.feedbackAddr]
+        if self.metricsPort is not None:
+            command += ['--metrics-port', str(self.metricsPort)]
+        return command
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        backoff = restart_backoff
+        while not self.stopping:
+            startedAt = time.monotonic()
+            self.process = await asyncio.create_subprocess_exec(*self.command())
+            log.info('Worker for camera(s) %s started, pid %d', ','.join(self.camIds), self.process.pid)
+            code = await self.process.wait()
+            if self.stopping:
+                break
+            self.restarts += 1
+            self.supervisor.worker_lost(self)
+            if time.monotonic() - startedAt > stable_time:
+                backoff = restart_backoff
+            log.warning('Worker for camera(s) %s exited with %s - restarting in %.0f s', ','.join(self.camIds), code, backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(max_restart_backoff, backoff * 2)
+
+    async def stop(self):
+        self.stopping = True
+        process = self.process
+        if process is not None and process.returncode is None:
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), stop_timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+        if self.task is not None:
+            self.task.cancel()
+
+
+# a macro step as the supervisor resolves it: passed on as is
+MacroStep = namedtuple('MacroStep', 'command path')
+
+
+# ==============================================================
+#  Scene across workers
+# ==============================================================
+class SceneRound:
+    __slots__ = ('memory', 'seconds', 'workers', 'planned', 'results', 'timer', 'synced')
+
+    def __init__(self, memory, seconds, workers):
+        self.memory = memory
+        self.seconds = seconds # the least the scene takes, as asked for
+        self.workers = workers
+        self.planned = {}      # Worker -> seconds its cameras need
+        self.results = {}      # Worker -> ready
+        self.timer = None
+        self.synced = False
+
+
+# ==============================================================
+#  UDP endpoints (OSC from the control surfaces, feedback from
+#  the workers)
+# ==============================================================
+class DatagramHandler(asyncio.DatagramProtocol):
+    def __init__(self, onDatagram):
+        self.onDatagram = onDatagram
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.onDatagram(data, addr)
+
+
+# ==============================================================
+#  Supervisor
+# ==============================================================
+class Supervisor:
+    def __init__(self, configs, configFile, oscReceivePort=osc_visca_server.osc_receive_port,
+                 oscSendPort=osc_visca_server.osc_send_port):
+        self.configs = configs
+        self.configFile = configFile
+        self.oscReceivePort = oscReceivePort
+        self.subscribers = osc_feedback.SubscriberRegistry(oscSendPort)
+        self.feedback = osc_feedback.FeedbackChannel(self.subscribers)
+        self.workers = {} # tuple of camIds -> Worker
+        self.owner = {}   # camId -> Worker
+        self.ports = {}   # tuple of camIds -> worker OSC port, kept across restarts
+        self.osc = None
+        self.relay = None
+        self.feedbackAddr = None
+        self.watcher = config_watch.ConfigWatcher(configFile, self.apply_config, configs,
+                                                  configs.get("configWatchInterval", config_watch.default_interval))
+        self.scene = None # SceneRound of the latest scene on every camera
+        self.macros = macro_engine.MacroEngine(self.resolve_step, self.run_steps, self.macro_event)
+        self.macroWatcher = config_watch.ConfigWatcher(osc_visca_server.macro_file(configs, configFile),
+                                                       self.macros.define, None,
+                                                       configs.get("configWatchInterval", config_watch.default_interval))
+        if os.path.exists(self.macroWatcher.path):
+            self.macroWatcher.check()
+        self.forwarded = 0
+        self.unrouted = 0
+        self.malformed = 0
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.feedback.open()
+        self.relay, _ = await loop.create_datagram_endpoint(
+            lambda: DatagramHandler(self.feedback_received), local_addr=('127.0.0.1', 0))
+        self.feedbackAddr = self.relay.get_extra_info('sockname')[:2]
+        self.apply_config(self.configs)
+        self.osc, _ = await loop.create_datagram_endpoint(
+            lambda: DatagramHandler(self.osc_received), local_addr=('0.0.0.0', self.oscReceivePort))
+        self.watcher.start()
+        self.macroWatcher.start()
+        return self
+
+    def close(self):
+        self.watcher.stop()
+        self.macroWatcher.stop()
+        self.macros.close()
+        if self.osc is not None:
+            self.osc.close()
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(asyncio.gather(*[worker.stop() for worker in self.workers.values()]))
+        if self.relay is not None:
+            self.relay.close()
+        self.feedback.close()
+
+    # --------------------------------------------------------
+    # Workers for the config's cameras: groups that are still
+    # there keep running (they apply IP and setting changes
+    # themselves), new groups get a worker, gone ones stop
+    # --------------------------------------------------------
+    def apply_config(self, configs):
+        groups = worker_groups(configs)
+        clients = configs.get("oscClients", osc_visca_server.default_osc_clients)
+        timeout = configs.get("oscClientTimeout", osc_feedback.subscriber_timeout)
+        self.subscribers.configured_subscribers(clients, timeout)
+        server_log.set_levels(configs.get("logging"))
+        self.configs = configs
+        self.subscribers.configure(clients, timeout)
+        self.macroWatcher.interval = configs.get("configWatchInterval", config_watch.default_interval)
+        for group in [group for group in self.workers if group not in groups]:
+            asyncio.ensure_future(self.workers.pop(group).stop())
+        metricsInfo = configs.get("metrics", {})
+        for group in groups:
+            if group in self.workers:
+                continue
+            if group not in self.ports:
+                self.ports[group] = worker_base_port + len(self.ports)
+            metricsPort = None
+            if metricsInfo.get("enabled", False):
+                metricsPort = metricsInfo.get("port", metrics.default_port) + 1 + self.ports[group] - worker_base_port
+            self.workers[group] = Worker(self, group, self.ports[group], metricsPort)
+            self.workers[group].start()
+        self.owner = {camId: worker for group, worker in self.workers.items() for camId in group}
+
+    def worker_lost(self, worker):
+        for camId in worker.camIds:
+            self.feedback.publish("/led_online_"+camId, 0, camId=camId)
+        scene = self.scene
+        if scene is not None and worker in scene.workers and worker not in scene.results:
+            scene.results[worker] = False
+            if not scene.synced:
+                scene.planned.setdefault(worker, 0.0)
+                self.scene_planned(scene)
+            self.scene_finished(scene)
+
+    # --------------------------------------------------------
+    # OSC in: to the worker owning the camera, as is
+    # --------------------------------------------------------
+    def osc_received(self, data, addr):
+        self.subscribers.seen(addr[0])
+        try:
+            if data.startswith(b'#bundle'):
+                messages = osc_routes.parse_bundle(data)
+            else:
+                path, args = aiosc.parse_message(data)
+        except Exception:
+            self.malformed += 1
+            return
+        try:
+            if data.startswith(b'#bundle'):
+                self.forward_bundle(messages, addr)
+            else:
+                camId, command = self.split_path(path)
+                if command in local_commands:
+                    self.local_command(camId, command, addr, args)
+                elif command in scene_commands and camId == "0" and self.start_scene(args):
+                    pass
+                else:
+                    for worker in self.workers_for(camId):
+                        self.relay.sendto(data, worker.addr)
+                        self.forwarded += 1
+        except Exception:
+            log.exception('OSC from %s not forwarded', addr[0])
+
+    def split_path(self, path):
+        parts = path.split('/', 2)
+        if len(parts) < 3:
+            return None, None
+        return parts[1], parts[2]
+
+    def workers_for(self, camId):
+        if camId == "0":
+            return list(self.workers.values())
+        worker = self.owner.get(camId)
+        if worker is None:
+            self.unrouted += 1
+            return []
+        return [worker]
+
+    def forward_bundle(self, messages, addr):
+        # per worker: time tag -> packed messages, in bundle order
+        parts = {}
+        for when, path, args in messages:
+            camId, command = self.split_path(path)
+            if command in local_commands:
+                self.local_command(camId, command, addr, args)
+                continue
+            if command in scene_commands and camId == "0" and self.start_scene(args):
+                continue
+            message = aiosc.pack_message(path, *args)
+            for worker in self.workers_for(camId):
+                parts.setdefault(worker, {}).setdefault(when, []).append(message)
+        for worker, timed in parts.items():
+            for when, packed in timed.items():
+                timetag = 1 if when is None else osc_routes.time_to_timetag(when)
+                for datagram in osc_feedback.bundle_messages(packed, timetag):
+                    self.relay.sendto(datagram, worker.addr)
+                    self.forwarded += 1
+
+    def local_command(self, camId, command, addr, args=()):
+        if command == 'macro_run':
+            if args:
+                self.macros.start(osc_routes.text(args[0]), addr[0])
+            return
+        if command == 'macro_abort':
+            self.macros.abort(osc_routes.text(args[0]) if args else None)
+            return
+        if command == 'reload_config':
+            self.watcher.check()
+            self.macroWatcher.check()
+            # and the workers now, for their cameras' IPs and settings
+            message = aiosc.pack_message('/%s/reload_config' % camId)
+            for worker in self.workers_for(camId):
+                self.relay.sendto(message, worker.addr)
+                self.forwarded += 1
+            return
+        if command == 'subscribe':
+            self.subscribers.subscribe(addr[0], camId)
+        else:
+            self.subscribers.unsubscribe(addr[0], camId, self.owner.keys())
+
+    # --------------------------------------------------------
+    # Macros: a step is sent on when it is due, steps due
+    # together in one go (a bundle per worker)
+    # --------------------------------------------------------
+    def resolve_step(self, path, args):
+        camId, command = self.split_path(path)
+        if command is None or (camId != "0" and camId not in self.owner):
+            return None
+        return MacroStep(command, path), camId, list(args)
+
+    def run_steps(self, sender, calls, received=None):
+        self.forward_bundle([(None, step.path, values) for step, camId, values in calls], (sender, 0))
+
+    def macro_event(self, command, argument):
+        self.feedback.publish("/"+command, argument)
+
+    # --------------------------------------------------------
+    # Feedback from the workers: /camId/command -> /command,
+    # published to every subscriber that wants camId
+    # --------------------------------------------------------
+    def feedback_received(self, data, addr):
+        try:
+            if data.startswith(b'#bundle'):
+                messages = [(path, args) for _, path, args in osc_routes.parse_bundle(data)]
+            else:
+                messages = [aiosc.parse_message(data)]
+        except Exception:
+            self.malformed += 1
+            return
+        for path, args in messages:
+            camId, command = self.split_path(path)
+            if command in ('scene_plan', 'scene_sync'):
+                self.scene_reported(command, args)
+            elif command is not None:
+                self.feedback.publish("/"+command, *args, camId=None if camId == "0" else camId)
+
+    # --------------------------------------------------------
+    # Scenes on every camera (see the description above). A
+    # newer one replaces a round still running: the workers
+    # drop the older scene too. args: memory [seconds]
+    # --------------------------------------------------------
+    def start_scene(self, args):
+        # False: leave it to the worker(s) as usual
+        if len(self.workers) < 2:
+            return False
+        try:
+            memory = int(float(args[0]))
+            seconds = max(0.0, float(args[1])) if len(args) > 1 else 0.0
+        except (IndexError, TypeError, ValueError):
+            return False
+        if memory <= 0:
+            return False
+        if self.scene is not None and self.scene.timer is not None:
+            self.scene.timer.cancel()
+        scene = self.scene = SceneRound(memory, seconds, set(self.workers.values()))
+        plan = aiosc.pack_message('/0/scene_plan', memory)
+        for worker in scene.workers:
+            self.relay.sendto(plan, worker.addr)
+            self.forwarded += 1
+        scene.timer = asyncio.get_running_loop().call_later(scene_plan_timeout, self.sync_scene, scene)
+        log.info('Scene %d: planning on %d workers', memory, len(scene.workers))
+        return True
+
+    def scene_reported(self, command, args):
+        # /0/scene_plan memory seconds cameras, /0/scene_sync memory ready cameras
+        try:
+            memory, value, cameras = args[0], args[1], args[2]
+        except (IndexError, TypeError):
+            self.malformed += 1
+            return
+        scene = self.scene
+        worker = self.owner.get(str(cameras).split(',')[0])
+        if scene is None or memory != scene.memory or worker not in scene.workers:
+            return # a round that was replaced
+        if command == 'scene_plan':
+            scene.planned[worker] = value
+            self.scene_planned(scene)
+        else:
+            scene.results[worker] = bool(value)
+            self.scene_finished(scene)
+
+    def scene_planned(self, scene):
+        if len(scene.planned) >= len(scene.workers):
+            scene.timer.cancel()
+            self.sync_scene(scene)
+
+    def sync_scene(self, scene):
+        if scene.synced or self.scene is not scene:
+            return
+        scene.synced = True
+        seconds = max([scene.seconds] + list(scene.planned.values()))
+        timetag = osc_routes.time_to_timetag(time.time() + scene_start_delay)
+        datagrams = osc_feedback.bundle_messages([aiosc.pack_message('/0/scene_sync', scene.memory, float(seconds))], timetag)
+        for worker in scene.workers:
+            for datagram in datagrams:
+                self.relay.sendto(datagram, worker.addr)
+                self.forwarded += 1
+        log.info('Scene %d: %.2f s on every camera (%d of %d workers planned)',
+                 scene.memory, seconds, len(scene.planned), len(scene.workers))
+
+    def scene_finished(self, scene):
+        if self.scene is not scene or len(scene.results) < len(scene.workers):
+            return
+        self.scene = None
+        ready = all(scene.results.values())
+        self.feedback.publish("/scene_ready" if ready else "/scene_failed", scene.memory)
@@ -0,0 +1,153 @@
+'''
+Description:
+    Concurrent camera status polling.
+
+    Every camera is polled by its own task on the receive loop, so an
+    offline camera only ever delays its own status. Each camera has its
+    own interval and a random jitter (so the cameras don't all get asked
+    at the same instant), and replies come back on that camera's own
+    inquiry socket, which only accepts datagrams from the camera's IP.
+
+    A poll sends the lens control block, camera control block and
+    pan/tilt position inquiries at once and decodes the replies (see
+    visca_decoder) into named fields: one round trip refreshes zoom,
+    focus, focus mode, exposure, white balance and position.
+
+    onChange(camId, name, value) is only called when a polled field
+    differs from the last one seen, value is None while the camera
+    doesn't answer. With current(camId, name), the value the server
+    holds for a field, a polled value that differs from it is reported
+    too, so a value the camera never took gets corrected on the next
+    poll.
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import asyncio
+import random
+
+import visca_decoder
+import server_log
+
+# --------------------------------------------------------
+#  Settings
+# --------------------------------------------------------
+log = server_log.logger('poller')
+default_interval = 3.0 # seconds between polls of one camera
+default_jitter = 0.5   # +/- seconds added to every interval
+
+
+# --------------------------------------------------------
+#  Reply decoders: raw reply datagram -> {field: value},
+#  None if the camera didn't answer
+# --------------------------------------------------------
+def lens_fields(data):
+    lens = visca_decoder.decode_lens_control(data)
+    if lens is None:
+        return None
+    return {'focusMode': lens.focusMode, 'zoomPosition': lens.zoomPosition, 'focusPosition': lens.focusPosition}
+
+def camera_fields(data):
+    camera = visca_decoder.decode_camera_control(data)
+    if camera is None:
+        return None
+    return {'whiteBalance': camera.whiteBalance, 'exposureMode': camera.exposureMode,
+            'shutter': camera.shutter, 'iris': camera.iris, 'gain': camera.gain}
+
+def position_fields(data):
+    position = visca_decoder.decode_pan_tilt_position(data)
+    if position is None:
+        return None
+    return {'panPosition': position.panPosition, 'tiltPosition': position.tiltPosition}
+
+# name -> (inquiry payload, decoder)
+default_inquiries = {
+    'lens': (visca_decoder.CAM_LensBlockInq, lens_fields),
+    'camera': (visca_decoder.CAM_CameraBlockInq, camera_fields),
+    'position': (visca_decoder.Pan_tiltPosInq, position_fields),
+}
+
+
+# ==============================================================
+#  Poller
+# ==============================================================
+class StatusPoller:
+    '''One polling task per camera, reporting only changed values.'''
+
+    def __init__(self, cameras, onChange, inquiries=default_inquiries,
+                 interval=default_interval, jitter=default_jitter, current=None):
+        self.cameras = cameras # camId -> visca_transport.ViscaCamera
+        self.onChange = onChange
+        self.current = current
+        self.inquiries = inquiries
+        self.interval = interval
+        self.jitter = jitter
+        self.settings = {} # camId -> {'pollInterval': s, 'pollJitter': s}
+        self.values = {}   # camId -> {field: last value}
+        self.fields = {}   # inquiry name -> fields it has reported
+        self.tasks = {}
+
+    def configure(self, camId, interval=None, jitter=None):
+        # replaces the camera's earlier settings, None uses the poller's
+        settings = self.settings[camId] = {}
+        if interval is not None:
+            settings['pollInterval'] = interval
+        if jitter is not None:
+            settings['pollJitter'] = jitter
+
+    def start(self):
+        for camId in self.cameras:
+            self.start_camera(camId)
+
+    def start_camera(self, camId):
+        if camId not in self.tasks:
+            self.tasks[camId] = asyncio.ensure_future(self.poll_loop(camId))
+
+    def stop_camera(self, camId):
+        task = self.tasks.pop(camId, None)
+        if task is not None:
+            task.cancel()
+        self.values.pop(camId, None)
+        self.settings.pop(camId, None)
+
+    def stop(self):
+        for camId in list(self.tasks):
+            self.stop_camera(camId)
+
+    def next_delay(self, camId):
+        settings = self.settings.get(camId, {})
+        interval = settings.get('pollInterval', self.interval)
+        jitter = settings.get('pollJitter', self.jitter)
+        return max(0.0, interval + random.uniform(-jitter, jitter))
+
+    # --------------------------------------------------------
+    # Poll one camera forever
+    # --------------------------------------------------------
+    async def poll_loop(self, camId):
+        while True:
+            await asyncio.sleep(self.next_delay(camId))
+            try:
+                await self.poll(camId)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning('Status poll of camera %s failed: %s', camId, e)
+
+    async def poll(self, camId):
+        camera = self.cameras[camId]
+        names = list(self.inquiries)
+        replies = await asyncio.gather(*[camera.send_inquiry(self.inquiries[name][0], name) for name in names])
+        values = self.values.setdefault(camId, {})
+        for name, data in zip(names, replies):
+            fields = self.inquiries[name][1](data)
+            if fields is None:
+                # no (usable) reply: everything this inquiry reports is unknown
+                fields = dict.fromkeys(self.fields.get(name, ()))
+            else:
+                self.fields.setdefault(name, set()).update(fields)
+            for field, value in fields.items():
+                if field not in values or values[field] != value:
+                    values[field] = value
+                    self.onChange(camId, field, value)
+                elif self.current is not None and value is not None and self.current(camId, field) != value:
+                    self.onChange(camId, field, value)
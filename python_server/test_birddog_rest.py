@@ -0,0 +1,93 @@
+'''
+Description:
+    Tests for birddog_rest: keep-alive connection recovery, closing.
+'''
+import asyncio
+
+import pytest
+
+import birddog_rest
+
+
+# a keep-alive HTTP server answering every GET with its own path,
+# the ones in slow only after delay seconds
+async def start_responder(slow=(), delay=0.3):
+    async def handle(reader, writer):
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine:
+                    break
+                while (await reader.readline()) not in (b'\r\n', b''):
+                    pass
+                path = requestLine.split()[1].decode()
+                if path in slow:
+                    await asyncio.sleep(delay)
+                body = path.encode()
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n' % len(body) + body)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def test_request_after_timeout_gets_its_own_reply():
+    async def run():
+        server, port = await start_responder(slow=('/b',))
+        connection = birddog_rest.BirddogConnection('127.0.0.1', port, timeout=0.1)
+        try:
+            assert (await connection.request('GET', 'a')).body == b'/a'
+            with pytest.raises(asyncio.TimeoutError):
+                await connection.request('GET', 'b')
+            assert connection.writer is None
+            await asyncio.sleep(0.3) # /b's reply would be waiting by now
+            assert (await connection.request('GET', 'c')).body == b'/c'
+            assert (await connection.request('GET', 'd')).body == b'/d'
+        finally:
+            connection.close()
+            server.close()
+    asyncio.run(run())
+
+
+def test_reconnects_when_the_camera_closed_the_connection():
+    async def run():
+        server, port = await start_responder()
+        connection = birddog_rest.BirddogConnection('127.0.0.1', port, timeout=1.0)
+        try:
+            assert (await connection.request('GET', 'a')).body == b'/a'
+            server.close()
+            await server.wait_closed()
+            connection.writer.transport.abort()
+            server, port2 = await start_responder()
+            connection.port = port2
+            assert (await connection.request('GET', 'b')).body == b'/b'
+            assert connection.connects == 2
+        finally:
+            connection.close()
+            server.close()
+    asyncio.run(run())
+
+
+def test_close_drops_posts_in_progress():
+    async def run():
+        server, port = await start_responder(slow=('/stalled',), delay=5.0)
+        client = birddog_rest.BirddogClient(port, mergeDelay=0.01, timeout=10.0)
+        try:
+            stalled = client.post('127.0.0.1', 'stalled', {"a": 1})
+            await asyncio.sleep(0.1) # on its way to the camera
+            waiting = client.post('127.0.0.1', 'stalled', {"b": 2})
+            other = client.post('127.0.0.2', 'page', {"c": 3})
+            client.close('127.0.0.1')
+            assert await asyncio.wait_for(stalled, 1.0) is None
+            assert await asyncio.wait_for(waiting, 1.0) is None
+            assert not other.done()
+            await asyncio.sleep(0)
+            assert list(client.flushing) == [('127.0.0.2', 'page')]
+        finally:
+            client.close()
+            server.close()
+        assert other.result() is None
+    asyncio.run(run())
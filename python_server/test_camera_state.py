@@ -0,0 +1,65 @@
+'''
+Description:
+    Tests for camera_state and the poller keeping it right.
+'''
+import asyncio
+
+import camera_state
+import status_poller
+
+
+def test_command_is_suppressed_while_unchanged():
+    state = camera_state.CameraState('1')
+    assert state.command('tally', 1)
+    assert not state.command('tally', 1)
+    assert state.command('tally', 0)
+
+
+def test_revert_forgets_a_value_the_camera_did_not_take():
+    changes = []
+    state = camera_state.CameraState('1', lambda camId, name, value: changes.append((name, value)))
+    state.command('focusMode', 'manual')
+    state.revert('focusMode', 'manual')
+    assert state.get('focusMode') is None
+    assert changes == [('focusMode', 'manual'), ('focusMode', None)]
+    assert state.command('focusMode', 'manual') # not suppressed any more
+
+
+def test_revert_keeps_a_newer_value():
+    state = camera_state.CameraState('1')
+    state.command('zoom', ('tele', 2))
+    state.command('zoom', ('stop',))
+    state.revert('zoom', ('tele', 2)) # superseded by the stop
+    assert state.get('zoom') == ('stop',)
+
+
+def test_forget_keeps_online():
+    state = camera_state.CameraState('1')
+    state.observe('online', True)
+    state.command('tally', 1)
+    state.forget()
+    assert state.get('online') is True and state.get('tally') is None
+    state.forget('online')
+    assert state.get('online') is None
+
+
+class FakeCamera:
+    def __init__(self, reply):
+        self.reply = reply
+
+    async def send_inquiry(self, payload, name):
+        return self.reply
+
+
+def test_poll_corrects_a_state_the_poller_has_seen_before():
+    state = camera_state.CameraState('1')
+    camera = FakeCamera({'focusMode': 'auto'})
+    poller = status_poller.StatusPoller({'1': camera}, lambda camId, name, value: state.observe(name, value),
+                                        inquiries={'lens': (b'', lambda data: data)},
+                                        current=lambda camId, name: state.get(name))
+    asyncio.run(poller.poll('1'))
+    assert state.get('focusMode') == 'auto'
+    # told manual, but the camera refused and nothing reverted it
+    state.command('focusMode', 'manual')
+    asyncio.run(poller.poll('1'))
+    assert state.get('focusMode') == 'auto'
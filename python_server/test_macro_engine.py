@@ -0,0 +1,88 @@
+'''
+Description:
+    Tests for macro_engine: the timer wheel.
+'''
+import asyncio
+
+import macro_engine
+
+
+def run_wheel(schedule, slots=macro_engine.default_slots, wait=0.1):
+    # schedule(wheel, loop, ran) adds the timers, each callback
+    # appending to ran; returns ran once they had time to run
+    async def run():
+        loop = asyncio.get_running_loop()
+        wheel = macro_engine.TimerWheel(slots=slots)
+        ran = []
+        schedule(wheel, loop, ran)
+        await asyncio.sleep(wait)
+        assert not wheel.pending and wheel.handle is None
+        wheel.close()
+        return ran
+    return asyncio.run(run())
+
+def note(loop, ran, name, when):
+    # a callback recording its name, when it was due and when it ran
+    return lambda: ran.append((name, when, loop.time()))
+
+
+def test_timers_run_in_time_order_and_never_early():
+    def schedule(wheel, loop, ran):
+        start = loop.time()
+        for name, delay in (('c', 0.030), ('a', 0.005), ('d', 0.030), ('b', 0.0104), ('e', 0.0)):
+            when = start + delay
+            wheel.call_at(when, note(loop, ran, name, when))
+    ran = run_wheel(schedule)
+    assert [name for name, when, at in ran] == ['e', 'a', 'b', 'c', 'd']
+    for name, when, at in ran:
+        assert at >= when
+
+
+def test_cancelled_timers_never_run():
+    def schedule(wheel, loop, ran):
+        keep = wheel.call_later(0.01, note(loop, ran, 'kept', 0))
+        wheel.call_later(0.005, note(loop, ran, 'first', 0)).cancel()
+        later = wheel.call_later(0.02, note(loop, ran, 'later', 0))
+        later.cancel()
+        later.cancel()
+        assert wheel.pending == 1
+        # cancelled by a timer running in the same tick
+        wheel.call_at(keep.when, lambda: same.cancel())
+        same = wheel.call_at(keep.when, note(loop, ran, 'same tick', 0))
+    assert [name for name, when, at in run_wheel(schedule)] == ['kept']
+
+
+def test_timers_more_than_a_turn_ahead_wait_for_their_tick():
+    def schedule(wheel, loop, ran):
+        start = loop.time()
+        for name, delay in (('third', 0.035), ('first', 0.003), ('second', 0.019)):
+            when = start + delay
+            wheel.call_at(when, note(loop, ran, name, when))
+    ran = run_wheel(schedule, slots=8)
+    assert [name for name, when, at in ran] == ['first', 'second', 'third']
+    for name, when, at in ran:
+        assert at >= when
+
+
+def test_callbacks_can_add_timers_before_ones_waiting():
+    def schedule(wheel, loop, ran):
+        def add():
+            when = loop.time() + 0.002
+            wheel.call_at(when, note(loop, ran, 'added', when))
+        start = loop.time()
+        wheel.call_at(start + 0.002, add)
+        wheel.call_at(start + 0.03, note(loop, ran, 'waiting', start + 0.03))
+    ran = run_wheel(schedule, slots=16)
+    assert [name for name, when, at in ran] == ['added', 'waiting']
+    for name, when, at in ran:
+        assert at >= when
+
+
+def test_jitter_summary():
+    jitter = macro_engine.Jitter(maxSamples=3)
+    for seconds in (0.004, 0.001, 0.002, 0.003):
+        jitter.add(seconds)
+    assert jitter.count == 4
+    assert jitter.max == 0.004
+    assert jitter.quantile(0.5) == 0.002
+    assert jitter.summary() == 'p50 2.00 ms / p99 3.00 ms, max 4.00 ms of 4'
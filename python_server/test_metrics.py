@@ -0,0 +1,55 @@
+'''
+Description:
+    Tests for metrics: receive to dispatch latency.
+'''
+import asyncio
+import time
+
+import aiosc
+
+import metrics
+import osc_routes
+import osc_visca_server
+from test_osc_visca_server import load_configs
+
+
+def histogram(registry, name, camId, command):
+    return registry.histograms.get((name, camId, command))
+
+
+def test_dispatch_counts_from_the_receive_time_once():
+    registry = metrics.Metrics()
+    registry.enabled = True
+    async def run():
+        registry.begin('tally', '1', time.perf_counter() - 0.05)
+        registry.dispatched()
+        registry.dispatched() # a second camera of the same command
+    asyncio.run(run())
+    dispatch = histogram(registry, 'osc_dispatch_seconds', '1', 'tally')
+    assert dispatch.count == 1 and dispatch.total >= 0.05
+
+
+def test_protocol_stamps_the_arrival():
+    calls = []
+    protocol = osc_routes.OSCRouteProtocol(lambda *call: calls.append(call), lambda *call: calls.append(call))
+    before = time.perf_counter()
+    protocol.datagram_received(aiosc.pack_message('/1/tally', 1), ('10.0.0.1', 9000))
+    (addr, path, args, received), = calls
+    assert path == '/1/tally' and before <= received <= time.perf_counter()
+
+
+def test_fader_commands_are_dispatched(monkeypatch):
+    registry = metrics.Metrics()
+    registry.enabled = True
+    monkeypatch.setattr(metrics, 'registry', registry)
+    async def run():
+        server = osc_visca_server.Server(load_configs())
+        server.routes.compile(server.camipDic.keys()) # as start() does
+        posted = []
+        server.fader_mailbox.post = lambda *post: posted.append(post)
+        server.parse_osc_message(('10.0.0.1', 9000), '/1/pan_absolute_position', [18, 17, 10.0, 5.0],
+                                 time.perf_counter() - 0.02)
+        assert len(posted) == 1
+    asyncio.run(run())
+    dispatch = histogram(registry, 'osc_dispatch_seconds', '1', 'pan_absolute_position')
+    assert dispatch.count == 1 and dispatch.total >= 0.02
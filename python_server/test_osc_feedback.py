@@ -0,0 +1,79 @@
+'''
+Description:
+    Tests for osc_feedback: batching and per camera delivery.
+'''
+import asyncio
+import socket
+
+import aiosc
+import pytest
+
+import osc_feedback
+import osc_routes
+
+
+def receiver():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    return sock
+
+def received(sock):
+    # every OSC message waiting on sock, as (path, args)
+    messages = []
+    sock.settimeout(0.1)
+    try:
+        while True:
+            data = sock.recv(2048)
+            if data.startswith(b'#bundle'):
+                messages += [(path, tuple(args)) for when, path, args in osc_routes.parse_bundle(data)]
+            else:
+                path, args = aiosc.parse_message(data)
+                messages.append((path, tuple(args)))
+    except socket.timeout:
+        pass
+    return messages
+
+def channel_for(*subscribers):
+    # subscribers: (socket, cameras or None); they all listen on
+    # 127.0.0.1, so they are registered under made up IPs
+    registry = osc_feedback.SubscriberRegistry(0)
+    for i, (sock, cameras) in enumerate(subscribers):
+        registry.subscribers['10.0.0.%d' % i] = osc_feedback.Subscriber(
+            sock.getsockname(), None if cameras is None else frozenset(cameras), configured=True)
+    return osc_feedback.FeedbackChannel(registry)
+
+
+def test_same_path_from_two_cameras_reaches_each_cameras_subscriber():
+    one, two, every = receiver(), receiver(), receiver()
+    async def run():
+        channel = channel_for((one, ["1"]), (two, ["2"]), (every, None))
+        channel.publish('/zoom_pos', 10, camId="1")
+        channel.publish('/zoom_pos', 20, camId="2")
+        channel.publish('/zoom_pos', 11, camId="1") # newest value wins, per camera
+        await asyncio.sleep(channel.flushInterval * 3)
+        channel.close()
+    asyncio.run(run())
+    assert received(one) == [('/zoom_pos', (11,))]
+    assert received(two) == [('/zoom_pos', (20,))]
+    assert sorted(received(every)) == [('/zoom_pos', (11,)), ('/zoom_pos', (20,))]
+
+
+def test_updates_not_about_a_camera_go_to_everyone():
+    one = receiver()
+    async def run():
+        channel = channel_for((one, ["1"]))
+        channel.publish('/status', 'ok')
+        channel.publish('/led_online_2', 1, camId="2")
+        await asyncio.sleep(channel.flushInterval * 3)
+        channel.close()
+    asyncio.run(run())
+    assert received(one) == [('/status', ('ok',))]
+
+
+@pytest.mark.parametrize('clients', [[{"port": 9000}], [{"ip": "10.0.0.2", "port": "x"}], {"ip": "10.0.0.2"}])
+def test_bad_clients_leave_the_registry_unchanged(clients):
+    registry = osc_feedback.SubscriberRegistry(8000)
+    registry.configure([{"ip": "10.0.0.1"}])
+    with pytest.raises(ValueError):
+        registry.configure(clients)
+    assert list(registry.subscribers) == ["10.0.0.1"]
@@ -0,0 +1,48 @@
+'''
+Description:
+    Tests for osc_visca_server: applying a config, control surface feedback.
+'''
+import asyncio
+import copy
+import os
+
+import pytest
+
+import osc_visca_server
+
+
+def load_configs():
+    return osc_visca_server.load_config(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), osc_visca_server.default_config_file))
+
+
+@pytest.mark.parametrize('bad', [{"oscClients": [{"port": 9000}]}, {"oscClientTimeout": "long"}, {"commandWindow": "2"}])
+def test_bad_config_changes_nothing(bad):
+    async def run():
+        configs = load_configs()
+        server = osc_visca_server.Server(configs)
+        changed = copy.deepcopy(configs)
+        changed.update(bad)
+        changed["camInfo"]["camera1"]["ip"] = "10.9.9.9"
+        with pytest.raises(ValueError):
+            server.apply_config(changed)
+        assert server.configs is configs
+        assert server.camipDic["1"] == configs["camInfo"]["camera1"]["ip"]
+    asyncio.run(run())
+
+
+def test_leds_follow_the_camera_state():
+    async def run():
+        server = osc_visca_server.Server(load_configs())
+        sent = []
+        server.send_osc = lambda osc_command, value, camId=None: sent.append((osc_command, value))
+        state = server.states["1"]
+        server.camera_health_changed("1", False)
+        assert sent == [("led_online_1", 0)]
+        assert state.get('online') is False
+        state.command('panTilt', ('home',))
+        state.observe('focusMode', 'auto')
+        state.forget() # what the camera does, not whether it's online
+        assert state.get('online') is False
+        assert sent[1:] == [("led_1", 1), ("led_af_1", 1), ("led_af_1", 0)]
+    asyncio.run(run())
@@ -0,0 +1,64 @@
+'''
+Description:
+    Tests for preset_store: the store file and scene planning.
+'''
+import json
+
+import preset_store
+import visca_encoder
+
+
+def test_load_skips_bad_entries(tmp_path):
+    path = tmp_path / 'presets.json'
+    good = {"pan": 1, "tilt": 2, "zoom": 3, "focus": 4, "focusMode": "auto"}
+    path.write_text(json.dumps({"1": {"3": good, "4": {"pan": 1}},
+                                "2": {"5": dict(good, extra=1), "6": good},
+                                "3": []}))
+    store = preset_store.PresetStore(str(path))
+    assert store.get("1", 3) == preset_store.Preset(**good)
+    assert store.get("1", 4) is None
+    assert store.get("2", 5) is None
+    assert store.get("2", 6) == preset_store.Preset(**good)
+
+
+motion = {"panRate": 100.0, "tiltRate": 50.0, "zoomTime": 3.0}
+
+def preset(pan, tilt, zoom=0):
+    # degrees and 0 - 100 zoom -> a P200 Preset
+    ranges = visca_encoder.camera_models['P200']
+    panPosition, tiltPosition = ranges.pan_to_position(pan, tilt)
+    return preset_store.Preset(panPosition, tiltPosition, ranges.zoom_to_position(zoom), 0, 'auto')
+
+def scene(*moves):
+    # moves: (from, to) Presets, one camera each
+    ranges = visca_encoder.camera_models['P200']
+    return {str(camId): (ranges, motion, current, target) for camId, (current, target) in enumerate(moves, 1)}
+
+
+def test_cameras_arrive_together():
+    seconds, moves = preset_store.plan_scene(scene((preset(-50, 0), preset(50, 0)),
+                                                   (preset(0, 0), preset(30, 10)),
+                                                   (preset(10, 10), preset(10, 10))))
+    # 100 degrees at 100 degrees per second is the longest way
+    assert abs(seconds - 1.0) < 0.01
+    assert moves["1"].panSpeed == visca_encoder.top_pan_speed
+    assert moves["2"].panSpeed < visca_encoder.top_pan_speed
+    assert moves["2"].tiltSpeed < visca_encoder.top_tilt_speed
+    for move in moves.values():
+        assert move.seconds <= seconds * (1 + preset_store.arrival_tolerance)
+    assert abs(moves["2"].seconds - seconds) < 0.1
+    assert moves["3"] == preset_store.Move(visca_encoder.top_pan_speed, visca_encoder.top_tilt_speed, 0.0)
+
+
+def test_zoom_sets_the_shortest_scene():
+    seconds, moves = preset_store.plan_scene(scene((preset(0, 0, 0), preset(20, 0, 100))))
+    assert abs(seconds - motion["zoomTime"]) < 0.01
+    assert moves["1"].panSpeed < visca_encoder.top_pan_speed / 4
+    assert abs(moves["1"].seconds - seconds) < 0.01
+
+
+def test_scene_takes_at_least_the_time_asked_for():
+    seconds, moves = preset_store.plan_scene(scene((preset(0, 0), preset(50, 0))), seconds=2.0)
+    assert seconds == 2.0
+    assert moves["1"].panSpeed == visca_encoder.top_pan_speed // 4
+    assert abs(moves["1"].seconds - 2.0) < 0.05
@@ -0,0 +1,46 @@
+'''
+Description:
+    Tests for shard_supervisor: handling the OSC it receives, and macros.
+'''
+import asyncio
+
+import aiosc
+
+import shard_supervisor
+from test_osc_visca_server import load_configs
+
+
+def test_only_unparsable_datagrams_count_as_malformed(caplog, tmp_path):
+    supervisor = shard_supervisor.Supervisor(load_configs(), str(tmp_path / 'config.json'))
+    supervisor.osc_received(b'/1/tally\x00', ('10.0.0.1', 9000))
+    supervisor.osc_received(b'#bundle\x00\x00', ('10.0.0.1', 9000))
+    assert supervisor.malformed == 2
+
+    def broken(camId):
+        raise KeyError(camId)
+    supervisor.workers_for = broken
+    supervisor.osc_received(aiosc.pack_message('/1/tally', 1), ('10.0.0.1', 9000))
+    assert supervisor.malformed == 2
+    assert 'not forwarded' in caplog.text and 'KeyError' in caplog.text
+
+
+def test_macros_run_once_in_the_supervisor(tmp_path):
+    async def run():
+        supervisor = shard_supervisor.Supervisor(load_configs(), str(tmp_path / 'config.json'))
+        supervisor.owner = {'1': None, '2': None}
+        sent, events = [], []
+        supervisor.forward_bundle = lambda messages, addr: sent.extend(path for _, path, _ in messages)
+        supervisor.macro_event = lambda command, argument: events.append(command)
+        supervisor.macros.onEvent = supervisor.macro_event
+        assert supervisor.resolve_step('/9/pan_stop', []) is None
+        supervisor.macros.define({'both': [{'at': 0, 'path': '/1/zoom_stop'}, {'at': 0, 'path': '/2/pan_stop'},
+                                           {'at': 10, 'path': '/0/memory_recall', 'args': [3]}],
+                                  'lost': [{'at': 0, 'path': '/9/pan_stop'}]})
+        supervisor.local_command('2', 'macro_run', ('10.0.0.1', 9000), ['both'])
+        supervisor.local_command('1', 'macro_run', ('10.0.0.1', 9000), ['lost'])
+        await asyncio.sleep(0.1)
+        supervisor.macros.close()
+        return sent, events
+    sent, events = asyncio.run(run())
+    assert sent == ['/1/zoom_stop', '/2/pan_stop', '/0/memory_recall']
+    assert events.count('macro_running') == 1 and events.count('macro_done') == 1
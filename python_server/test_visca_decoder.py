@@ -0,0 +1,73 @@
+'''
+Description:
+    Tests for visca_decoder, on reply datagrams written out by hand from
+    the reply layouts in the VISCA spec.
+'''
+import visca_decoder
+import visca_encoder
+
+
+def reply(hex_payload, sequence_number=7):
+    # a VISCA-over-IP reply datagram around hex_payload
+    payload = bytes.fromhex(hex_payload)
+    return visca_encoder.header.pack(visca_encoder.PAYLOAD_REPLY, len(payload), sequence_number) + payload
+
+ack = reply('90 41 FF')
+syntax_error = reply('90 60 02 FF')
+not_executable = reply('90 61 41 FF')
+
+#                 y0 50 0p 0q 0r 0s 0H 0L 0t 0u 0v 0w 00 WW VV FF
+lens_auto = reply('90 50 01 02 03 04 0A 0B 00 0C 0D 0E 00 01 04 FF')
+lens_manual = reply('90 50 00 00 00 00 01 00 00 00 00 00 00 00 03 FF')
+#                   y0 50 0p 0p 0q 0q 0r 0s tt 0u vv ww 00 xx 0z FF
+camera_block = reply('90 50 0A 0B 01 02 05 03 0D 06 11 0A 00 04 07 FF')
+#                y0 50 0w 0w 0w 0w 0z 0z 0z 0z FF
+pan_tilt = reply('90 50 0F 09 02 0A 00 04 08 00 FF')
+
+
+def test_lens_control():
+    assert visca_decoder.decode_lens_control(lens_auto) == visca_decoder.LensControl(
+        zoomPosition=0x1234, focusNearLimit=0xAB, focusPosition=0x0CDE, focusMode='auto',
+        recallExecuting=False, focusExecuting=False, zoomExecuting=True)
+    lens = visca_decoder.decode_lens_control(lens_manual)
+    assert lens.focusMode == 'manual' and lens.focusNearLimit == 0x10
+    assert lens.recallExecuting and lens.focusExecuting and not lens.zoomExecuting
+
+
+def test_camera_control():
+    assert visca_decoder.decode_camera_control(camera_block) == visca_decoder.CameraControl(
+        rGain=0xAB, bGain=0x12, whiteBalance='manual', apertureGain=3, exposureMode='bright',
+        backLight=True, exposureComp=True, shutter=0x11, iris=0x0A, gain=4, exposureCompPosition=7)
+
+
+def test_pan_tilt_position():
+    assert visca_decoder.decode_pan_tilt_position(pan_tilt) == visca_decoder.PanTiltPosition(0xF92A, 0x0480)
+
+
+def test_single_values():
+    assert visca_decoder.decode_lens_position(reply('90 50 04 00 00 00 FF')) == 0x4000
+    assert visca_decoder.decode_focus_mode(reply('90 50 02 FF')) == 'auto'
+    assert visca_decoder.decode_focus_mode(reply('90 50 03 FF')) == 'manual'
+    assert visca_decoder.decode(visca_decoder.Pan_tiltPosInq, pan_tilt).panPosition == 0xF92A
+
+
+def test_wrong_lengths_are_rejected():
+    for decoder, good in ((visca_decoder.decode_lens_control, lens_auto),
+                          (visca_decoder.decode_camera_control, camera_block),
+                          (visca_decoder.decode_pan_tilt_position, pan_tilt)):
+        assert decoder(good[:-2] + b'\xFF') is None   # a field short
+        assert decoder(good[:-1] + b'\x00\xFF') is None # a field too many
+        assert decoder(good[:-1] + b'\x00') is None     # no terminator
+        assert decoder(None) is None
+    assert visca_decoder.decode_lens_control(pan_tilt) is None
+    assert visca_decoder.decode_pan_tilt_position(lens_auto) is None
+
+
+def test_error_replies_are_rejected():
+    for data in (ack, syntax_error, not_executable):
+        assert visca_decoder.decode_lens_control(data) is None
+        assert visca_decoder.decode_pan_tilt_position(data) is None
+        assert visca_decoder.decode_focus_mode(data) is None
+    # an error reply of a completion's length
+    assert visca_decoder.decode_pan_tilt_position(reply('90 60 0F 09 02 0A 00 04 08 00 FF')) is None
+    assert visca_decoder.decode(visca_decoder.CAM_CameraBlockInq, syntax_error) is None
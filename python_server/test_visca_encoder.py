@@ -0,0 +1,91 @@
+'''
+Description:
+    Tests for visca_encoder: every frame matches the hex templates the
+    server used before the encoder.
+'''
+import visca_encoder as visca
+
+# --------------------------------------------------------
+#  Legacy hex templates and conversions
+# --------------------------------------------------------
+legacy_pan = {
+'pan_up' : '81 01 06 01 VV WW 03 01 FF'        ,
+'pan_down' : '81 01 06 01 VV WW 03 02 FF'      ,
+'pan_left' : '81 01 06 01 VV WW 01 03 FF'      ,
+'pan_right' : '81 01 06 01 VV WW 02 03 FF'     ,
+'pan_up_left' : '81 01 06 01 VV WW 01 01 FF'   ,
+'pan_up_right' : '81 01 06 01 VV WW 02 01 FF'  ,
+'pan_down_left' : '81 01 06 01 VV WW 01 02 FF' ,
+'pan_down_right' : '81 01 06 01 VV WW 02 02 FF',
+'pan_stop' : '81 01 06 01 VV WW 03 03 FF'
+}
+legacy_pan_absolute = '81 01 06 02 VV WW 0Y1 0Y2 0Y3 0Y4 0Z1 0Z2 0Z3 0Z4 FF'
+legacy_zoom_direct = '81 01 04 47 0p 0q 0r 0s FF'
+legacy_focus_direct = '81 01 04 48 0p 0q 0r 0s FF'
+legacy_memory_recall = '81 01 04 3F 02 0p FF'
+legacy_tally = {0: '81 0A 02 02 03 FF', 1: '81 0A 02 02 02 FF', 2: '81 0A 02 02 01 FF'}
+
+def legacy_pan_to_hex(numP, numT):
+    scaleP = int(round((numP + 175)/350*(0x10000 + 0x06d6 - 0xF92A)))
+    scaleT = int(round((numT + 30)/120*(0x10000 + 0x0480 - 0xfe80)))
+    return hex((0xF92A + scaleP) & 0xffff)[2:].zfill(4), hex((0xfe80 + scaleT) & 0xffff)[2:].zfill(4)
+
+def legacy_zoom_to_hex(numZ):
+    return hex(int(round(numZ/100*0x4000)) & 0xffff)[2:].zfill(4)
+
+def legacy_lens(template, absZ):
+    return template.replace('p', absZ[0]).replace('q', absZ[1]).replace('r', absZ[2]).replace('s', absZ[3])
+
+def legacy_frame(message_string, sequence_number):
+    payload = bytearray.fromhex(message_string)
+    return bytes(bytearray.fromhex('01 00') + len(payload).to_bytes(2, 'big') + sequence_number.to_bytes(4, 'big') + payload)
+
+
+def test_pan_drive():
+    for direction, template in legacy_pan.items():
+        for panSpeed, tiltSpeed in ((1, 1), (12, 9), (18, 17)):
+            legacy = template.replace('VV', str(panSpeed).zfill(2)).replace('WW', str(tiltSpeed).zfill(2))
+            assert visca.pan_drive(direction, panSpeed, tiltSpeed) == bytes.fromhex(legacy), (direction, panSpeed)
+    assert visca.pan_stop == bytes.fromhex(legacy_pan['pan_stop'].replace('VV', '15').replace('WW', '15'))
+
+
+def test_pan_absolute():
+    for numP, numT in ((-175, -30), (0, 0), (45.0, 10.0), (175, 90), (-12.3, 61.7)):
+        absP, absT = legacy_pan_to_hex(numP, numT)
+        legacy = legacy_pan_absolute.replace('VV', '18').replace('WW', '17')
+        legacy = legacy.replace('Y1', absP[0]).replace('Y2', absP[1]).replace('Y3', absP[2]).replace('Y4', absP[3])
+        legacy = legacy.replace('Z1', absT[0]).replace('Z2', absT[1]).replace('Z3', absT[2]).replace('Z4', absT[3])
+        assert visca.pan_absolute_degrees(18, 17, numP, numT) == bytes.fromhex(legacy), (numP, numT)
+
+
+def test_pan_to_position():
+    for numP, numT in ((-175, -30), (-90.5, 0), (0, 0), (33.3, 45), (175, 90)):
+        absP, absT = legacy_pan_to_hex(numP, numT)
+        assert visca.p200.pan_to_position(numP, numT) == (int(absP, 16), int(absT, 16))
+        assert visca.pan_to_position(numP, numT) == (int(absP, 16), int(absT, 16))
+
+
+def test_zoom_and_focus_direct():
+    for numZ in (0, 1, 42.0, 50, 99.9, 100):
+        absZ = legacy_zoom_to_hex(numZ)
+        assert visca.zoom_to_position(numZ) == int(absZ, 16)
+        assert visca.zoom_direct(visca.zoom_to_position(numZ)) == bytes.fromhex(legacy_lens(legacy_zoom_direct, absZ))
+        assert visca.focus_direct(visca.focus_to_position(numZ)) == bytes.fromhex(legacy_lens(legacy_focus_direct, absZ))
+
+
+def test_memory_recall():
+    for memory in range(16):
+        assert visca.memory_recall(memory) == bytes.fromhex(legacy_memory_recall.replace('p', hex(memory)[2:]))
+
+
+def test_tally():
+    for state, legacy in legacy_tally.items():
+        assert visca.tally(state) == bytes.fromhex(legacy)
+    assert visca.tally(7) == bytes.fromhex(legacy_tally[0])
+
+
+def test_frames():
+    for sequence_number in (1, 0x1234, 0xFFFFFFFF):
+        assert visca.build_command(sequence_number, visca.memory_recall(5)) == \
+            legacy_frame(legacy_memory_recall.replace('p', '5'), sequence_number)
+        assert visca.build_command(sequence_number, visca.tally(1)) == legacy_frame(legacy_tally[1], sequence_number)
@@ -0,0 +1,120 @@
+'''
+Description:
+    Tests for visca_scheduler: priority order and superseded motion.
+'''
+import asyncio
+
+import visca_encoder
+import visca_scheduler
+from visca_scheduler import STOP, CONTROL, PRESET, MOTION
+
+
+async def waiting(scheduler, priority, commandClass, name, log):
+    # holds a slot just long enough to note the order it was granted in
+    async with scheduler.slot(priority, commandClass) as granted:
+        log.append((name, granted))
+
+async def settle():
+    # a few loop turns: waiters granted or superseded get to run
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+async def queue(scheduler, commands, log):
+    # every command in commands waits behind one already in progress
+    await scheduler.acquire(CONTROL)
+    tasks = [asyncio.ensure_future(waiting(scheduler, priority, commandClass, name, log))
+             for name, priority, commandClass in commands]
+    await settle()
+    return tasks
+
+
+def test_classify():
+    assert visca_scheduler.classify(visca_encoder.pan_stop) == (STOP, 'panTilt')
+    assert visca_scheduler.classify(visca_encoder.zoom_stop) == (STOP, 'zoom')
+    assert visca_scheduler.classify(visca_encoder.focus_stop) == (STOP, 'focus')
+    assert visca_scheduler.classify(visca_encoder.zoom_tele_variable(3)) == (MOTION, 'zoom')
+    assert visca_scheduler.classify(visca_encoder.pan_home) == (PRESET, None)
+    assert visca_scheduler.classify(visca_encoder.focus_auto) == (CONTROL, None)
+
+
+def test_waiting_commands_go_in_priority_order():
+    async def run():
+        scheduler = visca_scheduler.CommandScheduler('1')
+        log = []
+        tasks = await queue(scheduler, [('motion', MOTION, 'panTilt'), ('control', CONTROL, None),
+                                        ('preset', PRESET, 'preset'), ('stop', STOP, 'zoom'),
+                                        ('control 2', CONTROL, None)], log)
+        assert scheduler.depth() == 5
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        assert scheduler.idle()
+        return log
+    assert asyncio.run(run()) == [('stop', True), ('control', True), ('control 2', True),
+                                  ('preset', True), ('motion', True)]
+
+
+def test_newer_motion_supersedes_waiting_motion_of_its_class():
+    async def run():
+        scheduler = visca_scheduler.CommandScheduler('1')
+        log = []
+        tasks = await queue(scheduler, [('zoom 1', MOTION, 'zoom'), ('pan', MOTION, 'panTilt'),
+                                        ('zoom 2', MOTION, 'zoom')], log)
+        assert log == [('zoom 1', False)]
+        assert scheduler.superseded == 1
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        return log
+    assert asyncio.run(run()) == [('zoom 1', False), ('pan', True), ('zoom 2', True)]
+
+
+def test_stop_drops_the_moves_it_stops_and_recall_drops_all_motion():
+    async def run():
+        scheduler = visca_scheduler.CommandScheduler('1')
+        log = []
+        tasks = await queue(scheduler, [('pan', MOTION, 'panTilt'), ('zoom', MOTION, 'zoom'),
+                                        ('pan stop', STOP, 'panTilt'), ('focus', MOTION, 'focus')], log)
+        assert log == [('pan', False)]
+        tasks.append(asyncio.ensure_future(waiting(scheduler, PRESET, None, 'recall', log)))
+        await settle()
+        assert sorted(log) == [('focus', False), ('pan', False), ('zoom', False)]
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        return log[3:]
+    assert asyncio.run(run()) == [('pan stop', True), ('recall', True)]
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def run():
+        scheduler = visca_scheduler.CommandScheduler('1')
+        log = []
+        tasks = await queue(scheduler, [('control', CONTROL, None), ('motion', MOTION, 'zoom')], log)
+        tasks[0].cancel()
+        await settle()
+        assert scheduler.depth() == 1
+        scheduler.release()
+        await tasks[1]
+        assert scheduler.idle()
+        return log
+    assert asyncio.run(run()) == [('motion', True)]
+
+
+def test_motion_in_progress_is_preempted_by_newer_commands():
+    async def run():
+        scheduler = visca_scheduler.CommandScheduler('1', capacity=2)
+        assert await scheduler.acquire(MOTION, 'zoom')
+        claim = scheduler.claim(MOTION, 'zoom')
+        assert not scheduler.preempted(MOTION, 'zoom', claim)
+        # a second slot is free: the newer zoom goes straight away
+        assert await scheduler.acquire(MOTION, 'zoom')
+        newer = scheduler.claim(MOTION, 'zoom')
+        assert scheduler.preempted(MOTION, 'zoom', claim)
+        assert not scheduler.preempted(MOTION, 'zoom', newer)
+        assert not scheduler.preempted(CONTROL, None)
+        # a stop waiting for a slot preempts motion of its class only
+        stop = asyncio.ensure_future(scheduler.acquire(STOP, 'panTilt'))
+        await asyncio.sleep(0)
+        assert scheduler.preempted(MOTION, 'panTilt')
+        assert not scheduler.preempted(MOTION, 'zoom', newer)
+        scheduler.release()
+        assert await stop
+    asyncio.run(run())
@@ -0,0 +1,138 @@
+'''
+Description:
+    Tests for visca_transport: reply routing, and retries against a
+    scripted camera on the loopback.
+'''
+import asyncio
+
+import visca_encoder
+import visca_transport
+
+ack = b'\x90\x41\xff'
+completion = b'\x90\x51\xff'
+buffer_full = b'\x90\x60\x03\xff'
+
+
+class ScriptedCamera(asyncio.DatagramProtocol):
+    '''Answers every command with reply(sequence number, payload), a
+    list of reply payloads.'''
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.received = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        _, _, sequence_number = visca_encoder.header.unpack_from(data)
+        self.received.append((sequence_number, data[8:]))
+        for payload in self.reply(sequence_number, data[8:]):
+            self.transport.sendto(visca_encoder.header.pack(visca_encoder.PAYLOAD_REPLY, len(payload), sequence_number) + payload, addr)
+
+
+async def scripted_camera(reply):
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(lambda: ScriptedCamera(reply), local_addr=('127.0.0.1', 0))
+    camera = visca_transport.ViscaCamera('1', '127.0.0.1', transport.get_extra_info('sockname')[1],
+                                         replyRouter=visca_transport.ViscaReplyRouter())
+    return camera, protocol, transport
+
+
+def busy_for(n):
+    # buffer full for the first n commands, then ACK and completion
+    def reply(sequence_number, payload):
+        reply.count += 1
+        return [buffer_full] if reply.count <= n else [ack, completion]
+    reply.count = 0
+    return reply
+
+
+def test_stop_is_retried_past_the_buffer_full_limit(monkeypatch):
+    monkeypatch.setattr(visca_transport, 'buffer_full_backoff', 0.001)
+    monkeypatch.setattr(visca_transport, 'buffer_full_max_backoff', 0.004)
+    async def run():
+        camera, protocol, transport = await scripted_camera(busy_for(8))
+        try:
+            result = await camera.send(visca_encoder.pan_stop)
+            assert visca_transport.acknowledged(result)
+            assert len(protocol.received) == 9
+        finally:
+            camera.close()
+            transport.close()
+    asyncio.run(run())
+
+
+def test_motion_gives_up_on_buffer_full(monkeypatch):
+    monkeypatch.setattr(visca_transport, 'buffer_full_backoff', 0.001)
+    monkeypatch.setattr(visca_transport, 'buffer_full_max_backoff', 0.004)
+    async def run():
+        camera, protocol, transport = await scripted_camera(busy_for(8))
+        try:
+            result = await camera.send(visca_encoder.zoom_tele_variable(3))
+            assert not visca_transport.acknowledged(result)
+            assert len(protocol.received) == 4 # 1, 2 and 4 ms of backoff
+        finally:
+            camera.close()
+            transport.close()
+    asyncio.run(run())
+
+
+def datagram(sequence_number, payload, payloadType=visca_encoder.PAYLOAD_REPLY):
+    # a VISCA-over-IP datagram as the camera would send it
+    return visca_encoder.header.pack(payloadType, len(payload), sequence_number) + payload
+
+
+def test_replies_are_routed_by_sequence_number():
+    async def run():
+        router = visca_transport.ViscaReplyRouter()
+        camera = ('10.0.0.1', 52381)
+        first = router.expect('10.0.0.1', 'command', 1)
+        second = router.expect('10.0.0.1', 'command', 2)
+        # second's reply arrives first
+        router.route('command', datagram(2, ack), camera)
+        router.route('command', datagram(2, completion), camera)
+        assert second.ack.result() == datagram(2, ack)
+        assert second.done.result() == datagram(2, completion)
+        assert not first.ack.done()
+        router.route('command', datagram(1, completion), camera)
+        # no ACK first: the completion resolves both
+        assert first.ack.result() == first.done.result() == datagram(1, completion)
+        assert not router.pending
+    asyncio.run(run())
+
+
+def test_replies_nobody_waits_for_are_dropped():
+    async def run():
+        router = visca_transport.ViscaReplyRouter()
+        pending = router.expect('10.0.0.1', 'command', 5)
+        router.route('command', datagram(4, completion), ('10.0.0.1', 52381))   # an old command's
+        router.route('command', datagram(5, completion), ('10.0.0.2', 52381))   # another camera's
+        router.route('inquiry', datagram(5, completion), ('10.0.0.1', 52381))   # another socket's
+        assert router.stale == 3
+        router.route('command', b'\x90\x51\xff', ('10.0.0.1', 52381))
+        router.route('command', datagram(5, completion)[:-1], ('10.0.0.1', 52381))
+        router.route('command', datagram(5, completion, visca_encoder.PAYLOAD_COMMAND), ('10.0.0.1', 52381))
+        assert router.malformed == 3
+        assert not pending.ack.done()
+        router.fail('10.0.0.1', 'command')
+        assert pending.done.result() is None
+        assert not router.pending
+    asyncio.run(run())
+
+
+def test_stop_fails_once_the_camera_stays_busy(monkeypatch):
+    monkeypatch.setattr(visca_transport, 'buffer_full_backoff', 0.001)
+    monkeypatch.setattr(visca_transport, 'buffer_full_max_backoff', 0.004)
+    monkeypatch.setattr(visca_transport, 'buffer_full_stop_deadline', 0.05)
+    async def run():
+        camera, protocol, transport = await scripted_camera(busy_for(10**6))
+        try:
+            failures = camera.breaker.failures
+            result = await asyncio.wait_for(camera.send(visca_encoder.pan_stop), 1.0)
+            assert not visca_transport.acknowledged(result)
+            assert camera.breaker.failures == failures + 1
+        finally:
+            camera.close()
+            transport.close()
+    asyncio.run(run())
@@ -0,0 +1,171 @@
+'''
+Description:
+    Records the server's traffic for later inspection and replay
+    (replay_traffic.py): every OSC datagram received, every VISCA frame
+    sent to a camera and every datagram a camera sends back.
+
+        python osc_visca_server.py osc_visca_config.json --record service.rec
+
+    The file is append-only binary: a header (magic, version, wall clock
+    start time), then one record per datagram
+
+        kind (1 byte) | time (8 bytes, ns since the start, monotonic)
+        | IPv4 address (4 bytes) | length (2 bytes) | datagram
+
+    little endian, the address being the OSC sender's or the camera's.
+
+    Nothing is written on the hot path: record() stamps the datagram and
+    puts it on a queue, a writer thread packs and writes what has queued
+    up and flushes it (a crash loses at most what is still queued). With
+    the recorder off, the cost is one attribute check per datagram.
+    Should the disk fall behind, records past max_pending are dropped and
+    counted rather than queued without end.
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import queue
+import socket
+import struct
+import threading
+import time
+from collections import namedtuple
+
+import server_log
+
+# --------------------------------------------------------
+#  Settings
+# --------------------------------------------------------
+log = server_log.logger('recorder')
+magic = b'RVTRAFIC'
+version = 1
+file_header = struct.Struct('<8sBd')   # magic, version, wall clock start
+record_header = struct.Struct('<BQ4sH') # kind, ns since start, IPv4, length
+max_pending = 100000 # records queued for the writer before new ones are dropped
+
+# record kinds
+OSC_IN = 1
+VISCA_COMMAND = 2 # sent on a camera's command socket
+VISCA_INQUIRY = 3 # sent on its inquiry socket
+COMMAND_REPLY = 4 # received on the command socket
+INQUIRY_REPLY = 5 # received on the inquiry socket
+
+kind_names = {OSC_IN: 'osc', VISCA_COMMAND: 'command', VISCA_INQUIRY: 'inquiry',
+              COMMAND_REPLY: 'command reply', INQUIRY_REPLY: 'inquiry reply'}
+sent_kinds = {'command': VISCA_COMMAND, 'inquiry': VISCA_INQUIRY}       # by socket name
+received_kinds = {'command': COMMAND_REPLY, 'inquiry': INQUIRY_REPLY}
+
+# a record read back: time in seconds since the start of the recording
+Record = namedtuple('Record', 'kind time ip data')
+
+no_address = bytes(4)
+
+
+def pack_address(ip):
+    try:
+        return socket.inet_aton(ip)
+    except (OSError, TypeError):
+        return no_address
+
+
+# ==============================================================
+#  Recorder
+# ==============================================================
+class TrafficRecorder:
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.queue = None
+        self.thread = None
+        self.started = 0 # monotonic ns at the start of the recording
+        self.records = 0
+        self.dropped = 0
+
+    def start(self, path):
+        self.path = path
+        self.queue = queue.SimpleQueue()
+        self.started = time.monotonic_ns()
+        recording = open(path, 'wb')
+        recording.write(file_header.pack(magic, version, time.time()))
+        self.thread = threading.Thread(target=self.write_loop, args=(recording,), name='traffic_recorder', daemon=True)
+        self.thread.start()
+        self.enabled = True
+        log.info('Recording traffic to %s', path)
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.queue.put(None)
+        self.thread.join()
+        log.info('Recorded %d datagrams to %s (%d dropped)', self.records, self.path, self.dropped)
+
+    # --------------------------------------------------------
+    # Hot path: callers check enabled first
+    # --------------------------------------------------------
+    def record(self, kind, ip, data):
+        if self.queue.qsize() >= max_pending:
+            self.dropped += 1
+            return
+        self.queue.put((kind, time.monotonic_ns(), ip, data))
+
+    # --------------------------------------------------------
+    # Writer thread: everything queued since the last write
+    # goes out in one write and flush
+    # --------------------------------------------------------
+    def write_loop(self, recording):
+        get = self.queue.get
+        with recording:
+            running = True
+            while running:
+                batch = [get()]
+                while len(batch) < 1000:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                chunks = []
+                for item in batch:
+                    if item is None:
+                        running = False
+                        continue
+                    kind, stamp, ip, data = item
+                    data = data[:0xFFFF]
+                    chunks.append(record_header.pack(kind, stamp - self.started, pack_address(ip), len(data)))
+                    chunks.append(data)
+                    self.records += 1
+                recording.write(b''.join(chunks))
+                recording.flush()
+
+# the server's recorder, off unless started
+recorder = TrafficRecorder()
+
+
+# ==============================================================
+#  Reading a recording
+# ==============================================================
+def read_recording(path):
+    '''(wall clock start, iterator of Records) for a recording. A
+    truncated last record (the server was killed mid-write) ends it.'''
+    recording = open(path, 'rb')
+    head = recording.read(file_header.size)
+    if len(head) < file_header.size:
+        recording.close()
+        raise ValueError('%s is not a traffic recording' % path)
+    fileMagic, fileVersion, startedAt = file_header.unpack(head)
+    if fileMagic != magic or fileVersion != version:
+        recording.close()
+        raise ValueError('%s is not a version %d traffic recording' % (path, version))
+    return startedAt, read_records(recording)
+
+def read_records(recording):
+    with recording:
+        while True:
+            head = recording.read(record_header.size)
+            if len(head) < record_header.size:
+                return
+            kind, stamp, address, length = record_header.unpack(head)
+            data = recording.read(length)
+            if len(data) < length:
+                return
+            yield Record(kind, stamp / 1e9, socket.inet_ntoa(address), data)
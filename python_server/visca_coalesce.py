@@ -0,0 +1,98 @@
+'''
+Description:
+    Latest-value-wins mailbox for fader driven absolute commands.
+
+    Open Stage Control faders fire pan_absolute_position, zoom_direct and
+    focus_direct many times a second. Only the newest target matters, so
+    each (camera, command class) pair keeps a single pending slot: a new
+    value overwrites whatever has not been sent yet. One drain task per
+    slot sends the pending value, waits for the send to finish and for the
+    minimum interval (1 / maxRate) to pass, then sends whatever is newest.
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import asyncio
+import contextvars
+
+import server_log
+
+# --------------------------------------------------------
+#  Settings
+# --------------------------------------------------------
+log = server_log.logger('fader')
+default_max_rate = 20.0 # VISCA packets per second, per camera and command class
+
+
+# ==============================================================
+#  Mailbox
+# ==============================================================
+class LatestValueMailbox:
+    '''Per camera, per command class slot holding only the newest message.
+
+    send is a coroutine function called as send(message, camId).
+    '''
+
+    def __init__(self, send, maxRate=default_max_rate):
+        self.send = send
+        self.cameraIntervals = {} # camId -> minimum interval, overriding minInterval
+        self.set_max_rate(maxRate)
+        self.pending = {}   # (camId, commandClass) -> (newest unsent message, its context)
+        self.draining = {}  # (camId, commandClass) -> drain task
+        self.posted = 0
+        self.coalesced = 0  # messages overwritten before they were sent
+
+    def set_max_rate(self, maxRate, camId=None):
+        # 0 or None means no rate limit (still one packet in flight at a time)
+        minInterval = 1.0/maxRate if maxRate else 0.0
+        if camId is None:
+            self.minInterval = minInterval
+        else:
+            self.cameraIntervals[camId] = minInterval
+
+    def clear_max_rate(self, camId):
+        # back to the rate for all cameras
+        self.cameraIntervals.pop(camId, None)
+
+    # --------------------------------------------------------
+    # Post a new target, replacing any unsent one
+    # --------------------------------------------------------
+    def post(self, camId, commandClass, message):
+        key = (camId, commandClass)
+        self.posted += 1
+        if key in self.pending:
+            self.coalesced += 1
+        # keep the poster's context (metrics trace) with the message
+        self.pending[key] = (message, contextvars.copy_context())
+        if key not in self.draining:
+            self.draining[key] = asyncio.ensure_future(self._drain(key))
+
+    # --------------------------------------------------------
+    # Drop an unsent target, e.g. when a stop for the same
+    # command class goes out and must not be overtaken
+    # --------------------------------------------------------
+    def discard(self, camId, commandClass):
+        self.pending.pop((camId, commandClass), None)
+
+    def discard_camera(self, camId):
+        # every unsent target of a camera that is going away
+        for key in [key for key in self.pending if key[0] == camId]:
+            del self.pending[key]
+        self.cameraIntervals.pop(camId, None)
+
+    async def _drain(self, key):
+        loop = asyncio.get_running_loop()
+        camId = key[0]
+        try:
+            while key in self.pending:
+                message, context = self.pending.pop(key)
+                started = loop.time()
+                try:
+                    await context.run(asyncio.ensure_future, self.send(message, camId))
+                except Exception as e:
+                    log.warning('Fader send to camera %s failed: %s', camId, e)
+                wait = self.cameraIntervals.get(camId, self.minInterval) - (loop.time() - started)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+        finally:
+            del self.draining[key]
@@ -0,0 +1,145 @@
+'''
+Description:
+    Binary VISCA reply decoder for the Birddog P200.
+
+    Inquiry replies are parsed straight from the reply datagram with
+    precompiled struct formats into named tuples, instead of slicing the
+    hexlified reply and comparing strings. The lens control and camera
+    control block inquiries each return a dozen fields in one reply, so
+    together with the pan/tilt position inquiry three parallel inquiries
+    (one round trip) refresh everything the server tracks about a camera.
+
+    Reply layouts, after the 8 byte VISCA-over-IP header:
+
+        lens control block      y0 50 0p 0q 0r 0s 0H 0L 0t 0u 0v 0w 00 WW VV FF
+            pqrs zoom position, HL focus near limit, tuvw focus position,
+            WW bit 0 focus mode (1 auto, 0 manual),
+            VV bit 0 memory recall, bit 1 focus, bit 2 zoom executing
+        camera control block    y0 50 0p 0p 0q 0q 0r 0s tt 0u vv ww 00 xx 0z FF
+            pp R gain, qq B gain, r white balance mode, s aperture gain,
+            tt exposure mode, u bit 2 back light, bit 1 exposure comp on,
+            vv shutter, ww iris, xx gain, z exposure comp position
+        pan/tilt position       y0 50 0w 0w 0w 0w 0z 0z 0z 0z FF
+        zoom / focus position   y0 50 0p 0q 0r 0s FF
+        focus mode              y0 50 02 FF auto, y0 50 03 FF manual
+
+    Every decoder takes the raw reply datagram (or None when the camera
+    didn't answer) and returns None unless it is a well formed
+    completion of the expected length. Positions are the camera's 16 bit
+    values; degrees depend on the camera's model, see CameraRanges in
+    visca_encoder.
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import struct
+from collections import namedtuple
+
+import visca_encoder as visca
+
+# --------------------------------------------------------
+#  Inquiries
+# --------------------------------------------------------
+CAM_LensBlockInq = visca.inquiry_lens_control
+CAM_CameraBlockInq = visca.inquiry_camera_control
+Pan_tiltPosInq = bytes.fromhex('81 09 06 12 FF')
+CAM_ZoomPosInq = bytes.fromhex('81 09 04 47 FF')
+CAM_FocusPosInq = bytes.fromhex('81 09 04 48 FF')
+
+# --------------------------------------------------------
+#  Reply layouts (the fields between y0 50 and FF)
+# --------------------------------------------------------
+lens_block = struct.Struct('>IBBIBBB')
+camera_block = struct.Struct('>HHBBBBBBBBB')
+pan_tilt_position = struct.Struct('>II')
+lens_position = struct.Struct('>I')
+
+white_balance_modes = {0: 'auto', 1: 'indoor', 2: 'outdoor', 3: 'one push', 4: 'atw', 5: 'manual'}
+exposure_modes = {0x00: 'full auto', 0x03: 'manual', 0x0A: 'shutter priority', 0x0B: 'iris priority', 0x0D: 'bright'}
+
+LensControl = namedtuple('LensControl', 'zoomPosition focusNearLimit focusPosition focusMode '
+                                        'recallExecuting focusExecuting zoomExecuting')
+CameraControl = namedtuple('CameraControl', 'rGain bGain whiteBalance apertureGain exposureMode '
+                                            'backLight exposureComp shutter iris gain exposureCompPosition')
+PanTiltPosition = namedtuple('PanTiltPosition', 'panPosition tiltPosition')
+
+
+# --------------------------------------------------------
+#  Field helpers
+# --------------------------------------------------------
+def reply_fields(data, length):
+    # the bytes between y0 50 and FF, None unless the reply is a
+    # completion with exactly length of them
+    if data is None or len(data) != 8 + 2 + length + 1:
+        return None
+    if data[9] & 0xF0 != 0x50 or data[-1] != 0xFF:
+        return None
+    return memoryview(data)[10:-1]
+
+def gather_int(value):
+    # 0x0A0B0C0D -> 0xABCD, inverse of visca_encoder.spread_nibbles
+    return ((value >> 12) & 0xF000) | ((value >> 8) & 0x0F00) | ((value >> 4) & 0x00F0) | (value & 0x000F)
+
+def gather_byte(value):
+    # 0x0A0B -> 0xAB
+    return ((value >> 4) & 0xF0) | (value & 0x0F)
+
+
+# --------------------------------------------------------
+#  Decoders: raw reply datagram -> named tuple / value
+# --------------------------------------------------------
+def decode_lens_control(data):
+    fields = reply_fields(data, lens_block.size)
+    if fields is None:
+        return None
+    zoom, nearHigh, nearLow, focus, _, mode, executing = lens_block.unpack(fields)
+    return LensControl(gather_int(zoom), (nearHigh << 4) | (nearLow & 0x0F), gather_int(focus),
+                       'auto' if mode & 0x01 else 'manual',
+                       bool(executing & 0x01), bool(executing & 0x02), bool(executing & 0x04))
+
+def decode_camera_control(data):
+    fields = reply_fields(data, camera_block.size)
+    if fields is None:
+        return None
+    rGain, bGain, wb, aperture, ae, flags, shutter, iris, _, gain, comp = camera_block.unpack(fields)
+    return CameraControl(gather_byte(rGain), gather_byte(bGain), white_balance_modes.get(wb, wb), aperture,
+                         exposure_modes.get(ae, ae), bool(flags & 0x04), bool(flags & 0x02),
+                         shutter, iris, gain, comp)
+
+def decode_pan_tilt_position(data):
+    fields = reply_fields(data, pan_tilt_position.size)
+    if fields is None:
+        return None
+    pan, tilt = pan_tilt_position.unpack(fields)
+    return PanTiltPosition(gather_int(pan), gather_int(tilt))
+
+def decode_lens_position(data):
+    fields = reply_fields(data, lens_position.size)
+    if fields is None:
+        return None
+    return gather_int(lens_position.unpack(fields)[0])
+
+def decode_focus_mode(data):
+    fields = reply_fields(data, 1)
+    if fields is None:
+        return None
+    return {0x02: 'auto', 0x03: 'manual'}.get(fields[0])
+
+# inquiry payload -> decoder
+decoders = {
+    CAM_LensBlockInq: decode_lens_control,
+    CAM_CameraBlockInq: decode_camera_control,
+    Pan_tiltPosInq: decode_pan_tilt_position,
+    CAM_ZoomPosInq: decode_lens_position,
+    CAM_FocusPosInq: decode_lens_position,
+    visca.CAM_FocusModeInq: decode_focus_mode,
+}
+
+def decode(inquiry, data):
+    # typed value for a known inquiry, the raw field bytes otherwise
+    decoder = decoders.get(bytes(inquiry))
+    if decoder is not None:
+        return decoder(data)
+    if data is None or len(data) < 11:
+        return None
+    return bytes(data[10:-1])
@@ -0,0 +1,300 @@
+'''
+Description:
+    Binary VISCA frame encoder for the Birddog P200.
+
+    Payloads are prebuilt bytes; variable fields are packed with
+    precompiled struct formats and int math instead of hex-string
+    templating. Frames that never change (stop, home, tally, ...) are
+    module level constants, and commands with a small argument domain
+    (jog speeds, memory numbers) are cached after their first use.
+
+    Positions are 16 bit values sent one nibble per byte (0p 0q 0r 0s);
+    spread_nibbles() turns 0x1234 into 0x01020304 so a single 'I' field
+    in a struct format writes all four bytes.
+
+    Run bench_visca_encoder.py for the per-command encode cost.
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import struct
+from functools import lru_cache
+
+# --------------------------------------------------------
+#  VISCA-over-IP header
+#  payload type (2) | payload length (2) | sequence number (4)
+# --------------------------------------------------------
+header = struct.Struct('>HHI')
+
+PAYLOAD_COMMAND = 0x0100
+PAYLOAD_INQUIRY = 0x0110
+PAYLOAD_REPLY = 0x0111
+PAYLOAD_CONTROL = 0x0200
+PAYLOAD_CONTROL_REPLY = 0x0201
+
+def as_payload(message):
+    # accept a prebuilt payload or a legacy hex string ('81 01 04 00 02 FF')
+    if isinstance(message, str):
+        return bytes.fromhex(message)
+    return bytes(message)
+
+def build_message(payload_type, sequence_number, payload):
+    # asyncio may hold on to the datagram if the socket is busy, so every
+    # frame is its own bytes object rather than a shared mutable buffer
+    return header.pack(payload_type, len(payload), sequence_number & 0xFFFFFFFF) + payload
+
+def build_command(sequence_number, payload):
+    return header.pack(PAYLOAD_COMMAND, len(payload), sequence_number & 0xFFFFFFFF) + payload
+
+def build_inquiry(sequence_number, payload):
+    return header.pack(PAYLOAD_INQUIRY, len(payload), sequence_number & 0xFFFFFFFF) + payload
+
+
+# --------------------------------------------------------
+#  Fixed payloads (never change, built once)
+# --------------------------------------------------------
+# --- Misc ---
+camera_on = bytes.fromhex('81 01 04 00 02 FF')
+camera_off = bytes.fromhex('81 01 04 00 03 FF')
+information_display_off = bytes.fromhex('81 01 7E 01 18 03 FF')
+IF_Clear = bytes.fromhex('88 01 00 01 FF') #	I/F Clear
+command_cancel = bytes.fromhex('81 21 FF')
+network_set = bytes.fromhex('88 30 01 FF')
+
+# --- Focus ---
+focus_stop = bytes.fromhex('81 01 04 08 00 FF')
+focus_far = bytes.fromhex('81 01 04 08 02 FF')
+focus_near = bytes.fromhex('81 01 04 08 03 FF')
+focus_auto = bytes.fromhex('81 01 04 38 02 FF')
+focus_manual = bytes.fromhex('81 01 04 38 03 FF')
+focus_infinity = bytes.fromhex('81 01 04 18 02 FF')
+focus_one_push = bytes.fromhex('81 01 04 18 01 FF')
+
+# --- Zoom ---
+zoom_stop = bytes.fromhex('81 01 04 07 00 FF')
+zoom_tele = bytes.fromhex('81 01 04 07 02 FF')
+zoom_wide = bytes.fromhex('81 01 04 07 03 FF')
+
+# --- Pan/Tilt ---
+pan_stop = bytes.fromhex('81 01 06 01 15 15 03 03 FF')
+pan_home = bytes.fromhex('81 01 06 04 FF')
+pan_reset = bytes.fromhex('81 01 06 05 FF')
+
+# --- Tally ---
+tally_blink = bytes.fromhex('81 0A 02 02 01 FF')
+tally_on = bytes.fromhex('81 0A 02 02 02 FF')
+tally_off = bytes.fromhex('81 0A 02 02 03 FF')
+tallyDic = {0: tally_off, 1: tally_on, 2: tally_blink}
+
+# --- Inquiries ---
+CAM_FocusModeInq = bytes.fromhex('81 09 04 38 FF') #	y0 50 02 FF	Auto Focus
+                                                   #   y0 50 03 FF	Manual Focus
+CAM_PowerInq = bytes.fromhex('81 09 04 00 FF')     #   y0 50 02 FF	On, y0 50 03 FF Standby
+CAM_versionInq = bytes.fromhex('81 09 00 02 FF')
+inquiry_lens_control = bytes.fromhex('81 09 7E 7E 00 FF')
+# response: 81 50 0p 0q 0r 0s 0H 0L 0t 0u 0v 0w 00 xx xx FF
+inquiry_camera_control = bytes.fromhex('81 09 7E 7E 01 FF')
+
+
+# --------------------------------------------------------
+#  Variable payload layouts
+# --------------------------------------------------------
+# 81 01 06 01 VV WW XX YY FF
+_pan_drive = struct.Struct('>4sBB2sB')
+_pan_drive_prefix = bytes.fromhex('81 01 06 01')
+# 81 01 06 02 VV WW 0Y 0Y 0Y 0Y 0Z 0Z 0Z 0Z FF
+_pan_absolute = struct.Struct('>4sBBIIB')
+_pan_absolute_prefix = bytes.fromhex('81 01 06 02')
+# 81 01 04 47 0p 0q 0r 0s FF / 81 01 04 48 0p 0q 0r 0s FF
+_lens_direct = struct.Struct('>4sIB')
+_zoom_direct_prefix = bytes.fromhex('81 01 04 47')
+_focus_direct_prefix = bytes.fromhex('81 01 04 48')
+# 81 01 04 47 0p 0q 0r 0s 0t 0u 0v 0w FF
+_zoom_focus_direct = struct.Struct('>4sIIB')
+
+panDirections = {
+'pan_up' : b'\x03\x01'        ,
+'pan_down' : b'\x03\x02'      ,
+'pan_left' : b'\x01\x03'      ,
+'pan_right' : b'\x02\x03'     ,
+'pan_up_left' : b'\x01\x01'   ,
+'pan_up_right' : b'\x02\x01'  ,
+'pan_down_left' : b'\x01\x02' ,
+'pan_down_right' : b'\x02\x02',
+'pan_stop' : b'\x03\x03'
+}
+
+
+# --------------------------------------------------------
+#  Field helpers
+# --------------------------------------------------------
+def spread_nibbles(value):
+    # 0xABCD -> 0x0A0B0C0D, i.e. one nibble in the low half of each byte
+    value &= 0xFFFF
+    return ((value & 0xF000) << 12) | ((value & 0x0F00) << 8) | ((value & 0x00F0) << 4) | (value & 0x000F)
+
+def gather_nibbles(data):
+    # inverse of spread_nibbles for 4 reply bytes (0p 0q 0r 0s)
+    return ((data[0] & 0x0F) << 12) | ((data[1] & 0x0F) << 8) | ((data[2] & 0x0F) << 4) | (data[3] & 0x0F)
+
+top_pan_speed = 0x18
+top_tilt_speed = 0x17
+
+def speed_byte(speed):
+    # The panel's pan/tilt speeds were always written straight into the
+    # hex template ('VV'), so 18 from OSC means 0x18 on the wire.
+    speed = min(99, max(0, int(speed)))
+    return ((speed // 10) << 4) | (speed % 10)
+
+
+# --------------------------------------------------------
+#  Absolute position conversion (BIRDDOG P200)
+#  Returns 16 bit ints, ready for spread_nibbles()
+# --------------------------------------------------------
+minPD = -175
+maxPD = 175
+rangePD = maxPD - minPD
+minTD = -30
+maxTD = 90
+rangeTD = maxTD - minTD
+
+minP = 0xF92A # -175
+maxP = 0x06d6 # +175
+rangeP = 0x10000 + maxP - minP
+
+minT = 0xfe80 # -90
+maxT = 0x0480 # +90
+rangeT = 0x10000 + maxT - minT
+
+minZD = 0
+maxZD = 100
+rangeZD = maxZD - minZD
+minZ = 0x0000
+maxZ = 0x4000
+rangeZ = maxZ - minZ
+
+# --------------------------------------------------------
+#  Other models (or different limits) get their own
+#  CameraRanges, see camera_models and ranges in the config
+# --------------------------------------------------------
+class CameraRanges:
+    '''Degrees (pan/tilt) and 0 - 100 (zoom/focus) <-> 16 bit positions.'''
+
+    fields = ('minPD', 'maxPD', 'minTD', 'maxTD', 'minP', 'maxP', 'minT', 'maxT', 'minZD', 'maxZD', 'minZ', 'maxZ')
+    __slots__ = fields + ('rangePD', 'rangeTD', 'rangeP', 'rangeT', 'rangeZD', 'rangeZ')
+
+    def __init__(self, minPD, maxPD, minTD, maxTD, minP, maxP, minT, maxT, minZD, maxZD, minZ, maxZ):
+        self.minPD, self.maxPD, self.minTD, self.maxTD = minPD, maxPD, minTD, maxTD
+        self.minP, self.maxP, self.minT, self.maxT = minP, maxP, minT, maxT
+        self.minZD, self.maxZD, self.minZ, self.maxZ = minZD, maxZD, minZ, maxZ
+        self.rangePD = maxPD - minPD
+        self.rangeTD = maxTD - minTD
+        self.rangeP = (maxP - minP) & 0xffff # pan and tilt positions wrap through 0
+        self.rangeT = (maxT - minT) & 0xffff
+        self.rangeZD = maxZD - minZD
+        self.rangeZ = maxZ - minZ
+
+    def replace(self, **overrides):
+        # a copy with some limits changed, e.g. from the config
+        settings = {name: getattr(self, name) for name in self.fields}
+        for name, value in overrides.items():
+            if name not in settings:
+                raise ValueError('unknown range %r' % name)
+            settings[name] = int(value, 16) if isinstance(value, str) else value
+        return CameraRanges(**settings)
+
+    def __eq__(self, other):
+        return isinstance(other, CameraRanges) and all(getattr(self, name) == getattr(other, name) for name in self.fields)
+
+    def pan_to_position(self, numP, numT):
+        scaleP = int(round((numP - self.minPD)/self.rangePD*self.rangeP))
+        scaleT = int(round((numT - self.minTD)/self.rangeTD*self.rangeT))
+        return (self.minP + scaleP) & 0xffff, (self.minT + scaleT) & 0xffff
+
+    def zoom_to_position(self, numZ):
+        return (self.minZ + int(round((numZ - self.minZD)/self.rangeZD*self.rangeZ))) & 0xffff
+
+    # zoom and focus are same range
+    focus_to_position = zoom_to_position
+
+    def position_to_pan(self, panPosition, tiltPosition):
+        numP = self.minPD + ((panPosition - self.minP) & 0xFFFF) / self.rangeP * self.rangePD
+        numT = self.minTD + ((tiltPosition - self.minT) & 0xFFFF) / self.rangeT * self.rangeTD
+        return numP, numT
+
+    def position_to_zoom(self, position):
+        return self.minZD + (position - self.minZ) / self.rangeZ * self.rangeZD
+
+
+p200 = CameraRanges(minPD, maxPD, minTD, maxTD, minP, maxP, minT, maxT, minZD, maxZD, minZ, maxZ)
+
+# "model" in a camera's config picks its ranges
+camera_models = {'P200': p200}
+
+def pan_to_position(numP, numT):
+    return p200.pan_to_position(numP, numT)
+
+def zoom_to_position(numZ):
+    return p200.zoom_to_position(numZ)
+
+# zoom and focus are same range
+focus_to_position = zoom_to_position
+
+
+# --------------------------------------------------------
+#  Command encoders
+# --------------------------------------------------------
+@lru_cache(maxsize=None)
+def pan_drive(direction, panSpeed, tiltSpeed):
+    return _pan_drive.pack(_pan_drive_prefix, speed_byte(panSpeed), speed_byte(tiltSpeed), panDirections[direction], 0xFF)
+
+def pan_absolute(panSpeed, tiltSpeed, panPosition, tiltPosition):
+    return pan_absolute_speeds(speed_byte(panSpeed), speed_byte(tiltSpeed), panPosition, tiltPosition)
+
+def pan_absolute_speeds(panSpeed, tiltSpeed, panPosition, tiltPosition):
+    # speeds as sent, 1 - top_pan_speed / top_tilt_speed
+    return _pan_absolute.pack(_pan_absolute_prefix, panSpeed, tiltSpeed,
+                              spread_nibbles(panPosition), spread_nibbles(tiltPosition), 0xFF)
+
+def pan_absolute_degrees(panSpeed, tiltSpeed, numP, numT):
+    panPosition, tiltPosition = pan_to_position(numP, numT)
+    return pan_absolute(panSpeed, tiltSpeed, panPosition, tiltPosition)
+
+def zoom_direct(position):
+    return _lens_direct.pack(_zoom_direct_prefix, spread_nibbles(position), 0xFF)
+
+def focus_direct(position):
+    return _lens_direct.pack(_focus_direct_prefix, spread_nibbles(position), 0xFF)
+
+def zoom_focus_direct(zoomPosition, focusPosition):
+    return _zoom_focus_direct.pack(_zoom_direct_prefix, spread_nibbles(zoomPosition), spread_nibbles(focusPosition), 0xFF)
+
+@lru_cache(maxsize=None)
+def zoom_tele_variable(speed):
+    # p=0 (Low) to 7 (High)
+    return bytes((0x81, 0x01, 0x04, 0x07, 0x20 | min(7, max(0, int(speed))), 0xFF))
+
+@lru_cache(maxsize=None)
+def zoom_wide_variable(speed):
+    return bytes((0x81, 0x01, 0x04, 0x07, 0x30 | min(7, max(0, int(speed))), 0xFF))
+
+@lru_cache(maxsize=None)
+def focus_far_variable(speed):
+    # 0 low to 7 high
+    return bytes((0x81, 0x01, 0x04, 0x08, 0x20 | min(7, max(0, int(speed))), 0xFF))
+
+@lru_cache(maxsize=None)
+def focus_near_variable(speed):
+    return bytes((0x81, 0x01, 0x04, 0x08, 0x30 | min(7, max(0, int(speed))), 0xFF))
+
+@lru_cache(maxsize=None)
+def memory_recall(memory):
+    return bytes((0x81, 0x01, 0x04, 0x3F, 0x02, int(memory) & 0x7F, 0xFF))
+
+@lru_cache(maxsize=None)
+def memory_set(memory):
+    return bytes((0x81, 0x01, 0x04, 0x3F, 0x01, int(memory) & 0x7F, 0xFF))
+
+def tally(state):
+    # 2: blink, 1: on, anything else: off
+    return tallyDic.get(state, tally_off)
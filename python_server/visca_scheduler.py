@@ -0,0 +1,227 @@
+'''
+Description:
+    Per camera priority scheduling of VISCA commands.
+
+    Commands used to go out strictly in arrival order behind one lock per
+    camera, so a button release's pan_stop could wait behind a queue of
+    joystick moves while the camera kept going. Each camera now has a
+    CommandScheduler instead: a command waits for a free slot, and when
+    slots are busy waiting commands are granted in priority order,
+
+        stop     pan/zoom/focus stop, command cancel, IF_Clear
+        control  tally, power and other settings
+        preset   memory recall / set, home
+        motion   joystick, zoom/focus drive, fader targets
+
+    first come first served within a class. A command also supersedes the
+    motion still waiting in its class (a newer jog speed replaces an older
+    one, a stop drops the moves it stops, a preset recall drops all
+    waiting motion): superseded commands are never sent and return False
+    from acquire(). A motion command already being retried stops retrying
+    once preempted() says something newer or waiting supersedes it.
+
+    capacity is the camera's window: how many of its commands may be
+    waiting for their ACK at once (see visca_transport.command_window).
+
+    Queue depth is available per camera (depth()), and every grant records
+    how long the command waited in the visca_scheduler_wait_seconds
+    histogram, per priority class.
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import asyncio
+import contextlib
+import heapq
+import itertools
+import time
+
+import metrics
+
+# --------------------------------------------------------
+#  Priority classes (lower goes first)
+# --------------------------------------------------------
+STOP = 0
+CONTROL = 1
+PRESET = 2
+MOTION = 3
+priority_names = {STOP: 'stop', CONTROL: 'control', PRESET: 'preset', MOTION: 'motion'}
+
+motion_classes = ('panTilt', 'zoom', 'focus')
+
+
+# --------------------------------------------------------
+#  Payload -> (priority, command class)
+#  command class is the camera_state field the command
+#  drives, None if it doesn't move anything
+# --------------------------------------------------------
+def classify(payload):
+    prefix = payload[:4]
+    if prefix == b'\x81\x01\x06\x01':
+        # pan drive, 03 03 is stop
+        return (STOP if payload[6:8] == b'\x03\x03' else MOTION), 'panTilt'
+    if prefix in (b'\x81\x01\x04\x07', b'\x81\x01\x04\x08'):
+        commandClass = 'zoom' if prefix[3] == 0x07 else 'focus'
+        return (STOP if payload[4] == 0x00 else MOTION), commandClass
+    if prefix == b'\x81\x01\x06\x02':
+        return MOTION, 'panTilt'
+    if prefix == b'\x81\x01\x04\x47':
+        return MOTION, 'zoom'
+    if prefix == b'\x81\x01\x04\x48':
+        return MOTION, 'focus'
+    if payload[:5] == b'\x81\x01\x04\x3F\x02' or payload[:4] in (b'\x81\x01\x06\x04', b'\x81\x01\x06\x05'):
+        return PRESET, None # recall, home, reset
+    if payload[:5] == b'\x81\x01\x04\x3F\x01':
+        return PRESET, 'preset' # memory set, leaves waiting motion alone
+    if payload[:3] == b'\x81\x21' or payload[:4] == b'\x88\x01\x00\x01':
+        return STOP, None # command cancel, IF_Clear
+    return CONTROL, None
+
+
+# ==============================================================
+#  Scheduler
+# ==============================================================
+class Ticket:
+    __slots__ = ('priority', 'order', 'commandClass', 'grant', 'queuedAt')
+
+    def __init__(self, priority, order, commandClass, grant):
+        self.priority = priority
+        self.order = order
+        self.commandClass = commandClass
+        self.grant = grant
+        self.queuedAt = time.perf_counter()
+
+    def __lt__(self, other):
+        return (self.priority, self.order) < (other.priority, other.order)
+
+
+class CommandScheduler:
+    '''capacity commands of one camera may be in progress at once.'''
+
+    def __init__(self, camId, capacity=1):
+        self.camId = camId
+        self.capacity = capacity
+        self.active = 0
+        self.queue = []   # heap of Tickets, superseded ones are skipped when popped
+        self.waiting = 0  # Tickets in the queue still waiting for a grant
+        self.order = itertools.count()
+        self.superseded = 0
+        self.generation = {} # command class -> commands granted for it so far
+
+    def depth(self):
+        return self.waiting
+
+    # --------------------------------------------------------
+    # Acquire a slot: True once granted, False if superseded
+    # --------------------------------------------------------
+    async def acquire(self, priority, commandClass=None):
+        self.supersede(priority, commandClass)
+        if self.active < self.capacity and not self.waiting:
+            self.active += 1
+            self.observe(priority, 0.0)
+            return True
+
+        ticket = Ticket(priority, next(self.order), commandClass, asyncio.get_running_loop().create_future())
+        heapq.heappush(self.queue, ticket)
+        self.waiting += 1
+        try:
+            return await ticket.grant
+        except asyncio.CancelledError:
+            if not ticket.grant.cancelled() and ticket.grant.done():
+                if ticket.grant.result():
+                    self.release() # granted just as the caller gave up
+            else:
+                self.waiting -= 1
+            raise
+
+    def release(self):
+        self.active -= 1
+        self.grant()
+
+    def set_capacity(self, capacity):
+        # a bigger window lets waiting commands go straight away, a
+        # smaller one takes effect as the commands in progress finish
+        self.capacity = capacity
+        self.grant()
+
+    def idle(self):
+        return not self.active and not self.waiting
+
+    def grant(self):
+        while self.active < self.capacity and self.queue:
+            ticket = heapq.heappop(self.queue)
+            if ticket.grant.done():
+                continue # superseded or cancelled
+            self.waiting -= 1
+            self.active += 1
+            ticket.grant.set_result(True)
+            self.observe(ticket.priority, time.perf_counter() - ticket.queuedAt)
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority, commandClass=None):
+        granted = await self.acquire(priority, commandClass)
+        try:
+            yield granted
+        finally:
+            if granted:
+                self.release()
+
+    # --------------------------------------------------------
+    # Drop waiting motion the new command makes pointless
+    # --------------------------------------------------------
+    def supersede(self, priority, commandClass):
+        if not self.waiting or priority == CONTROL:
+            return
+        if commandClass is not None:
+            classes = (commandClass,)
+        elif priority in (STOP, PRESET):
+            classes = motion_classes
+        else:
+            return
+        for ticket in self.queue:
+            if ticket.priority == MOTION and ticket.commandClass in classes and not ticket.grant.done():
+                ticket.grant.set_result(False)
+                self.waiting -= 1
+                self.superseded += 1
+                metrics.registry.count('visca_superseded_total', self.camId)
+
+    # --------------------------------------------------------
+    # With more than one slot, a newer command for the same
+    # axis can be granted while an older one is still being
+    # retried: claim() on grant, and the older one sees it
+    # in preempted() and stops
+    # --------------------------------------------------------
+    def claim(self, priority, commandClass):
+        if commandClass is not None:
+            classes = (commandClass,)
+        elif priority in (STOP, PRESET):
+            classes = motion_classes
+        else:
+            return ()
+        generation = self.generation
+        for name in classes:
+            generation[name] = generation.get(name, 0) + 1
+        return tuple((name, generation[name]) for name in classes)
+
+    def preempted(self, priority, commandClass, claim=()):
+        # would a newer or waiting command supersede this one? Lets
+        # a motion command in progress give up its retries
+        if priority != MOTION:
+            return False
+        for name, generation in claim:
+            if self.generation[name] != generation:
+                return True
+        if not self.waiting:
+            return False
+        for ticket in self.queue:
+            if ticket.grant.done():
+                continue
+            if ticket.commandClass == commandClass and ticket.priority in (STOP, MOTION):
+                return True
+            if ticket.commandClass is None and ticket.priority in (STOP, PRESET):
+                return True
+        return False
+
+    def observe(self, priority, seconds):
+        if metrics.registry.enabled:
+            metrics.registry.observe('visca_scheduler_wait_seconds', self.camId, priority_names[priority], seconds)
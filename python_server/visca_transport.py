@@ -0,0 +1,439 @@
+'''
+Description:
+    asyncio VISCA-over-IP transport for the Birddog P200.
+
+    Every camera gets its own pair of UDP endpoints (one for commands, one
+    for inquiries), each wrapped in a DatagramProtocol. Sending a command
+    never blocks the receive loop: it returns once the camera has
+    acknowledged it (or straight away with skipCheck), and the camera's
+    completion can be awaited separately. A slow or missing camera only
+    ever makes its own callers wait.
+
+    All replies go through one ViscaReplyRouter, which parses the
+    VISCA-over-IP header and hands ACK, completion and error replies to
+    the command waiting on (camera IP, socket, sequence number). Replies
+    nobody is waiting for any more (late, duplicated, from a previous
+    try) are counted and dropped.
+
+    Sockets are created lazily: a ViscaCamera costs nothing until it is
+    opened, either explicitly or by its first command or inquiry.
+'''
+# --------------------------------------------------------
+#  Libraries
+# --------------------------------------------------------
+import asyncio
+import binascii  # for printing the visca messages
+import time
+
+import visca_encoder
+import visca_scheduler
+import camera_health
+import metrics
+import traffic_recorder
+import server_log
+
+# --------------------------------------------------------
+#  Transport Settings
+# --------------------------------------------------------
+log = server_log.logger('visca')
+camera_port = 52381
+command_timeout = 1.0     # longest wait for a command's ACK (see camera_health for the adaptive one)
+completion_timeout = 30.0 # seconds to keep waiting for a completion after the ACK
+inquiry_timeout = 5.0     # longest wait for an inquiry reply
+command_retries = 5
+command_window = 2        # commands per camera waiting for their ACK at once
+inquiry_window = 4        # inquiries per camera waiting for their reply at once
+buffer_full_backoff = 0.02      # seconds before resending after "buffer full", doubles each time
+buffer_full_max_backoff = 0.64  # give up once the backoff would pass this (stops keep trying at this)
+buffer_full_stop_deadline = 5.0 # seconds a stop keeps trying through "buffer full" before it fails
+
+IF_Clear = visca_encoder.IF_Clear
+
+no_response = 'No response from camera'
+camera_offline = 'Camera offline' # returned straight away while the circuit breaker is open
+
+
+# --------------------------------------------------------
+#  Helpers
+# --------------------------------------------------------
+def reply_kind(data):
+    # VISCA reply payloads look like y0 4z FF (ACK), y0 5z .. FF (completion)
+    # or y0 6z ee FF (error), behind the 8 byte VISCA-over-IP header
+    if len(data) < 11:
+        return None
+    return data[9] & 0xF0
+
+def completed(received_message):
+    # send(waitForCompletion=True) result: did the camera report the
+    # command done (y0 5z), rather than an error or nothing?
+    return isinstance(received_message, bytes) and received_message[18:19] == b'5'
+
+def acknowledged(received_message):
+    # send() result: did the camera take the command (ACK or
+    # completion, or sent without waiting for one)?
+    return received_message == 'skipped check' or (
+        isinstance(received_message, bytes) and received_message[18:19] in (b'4', b'5'))
+
+def buffer_full(data):
+    # y0 6z 03 FF: no free command socket on the camera
+    return len(data) >= 12 and data[9] & 0xF0 == 0x60 and data[10] == 0x03
+
+
+# ==============================================================
+#  Reply demultiplexer
+# ==============================================================
+class PendingCommand:
+    '''Futures for one sent command: ack resolves on the ACK (or on the
+    completion/error if no ACK came first), done on the completion or
+    error. Both resolve to the raw reply, or None if the socket failed.'''
+
+    __slots__ = ('key', 'ack', 'done')
+
+    def __init__(self, key, loop):
+        self.key = key
+        self.ack = loop.create_future()
+        self.done = loop.create_future()
+
+    def resolve(self, data, final):
+        if not self.ack.done():
+            self.ack.set_result(data)
+        if final and not self.done.done():
+            self.done.set_result(data)
+
+
+class ViscaReplyRouter:
+    '''Routes replies by (camera ip, socket name, sequence number).'''
+
+    def __init__(self):
+        self.pending = {}
+        self.stale = 0     # replies nobody was waiting for
+        self.malformed = 0 # datagrams that aren't VISCA-over-IP replies
+
+    def expect(self, ip, channel, sequence_number):
+        key = (ip, channel, sequence_number)
+        pending = PendingCommand(key, asyncio.get_running_loop())
+        self.pending[key] = pending
+        return pending
+
+    def release(self, pending):
+        if self.pending.get(pending.key) is pending:
+            del self.pending[pending.key]
+
+    def route(self, channel, data, addr):
+        if len(data) < 9:
+            self.malformed += 1
+            return
+        payload_type, payload_length, sequence_number = visca_encoder.header.unpack_from(data)
+        if payload_type not in (visca_encoder.PAYLOAD_REPLY, visca_encoder.PAYLOAD_CONTROL_REPLY) or len(data) != 8 + payload_length:
+            self.malformed += 1
+            return
+
+        pending = self.pending.get((addr[0], channel, sequence_number))
+        if pending is None:
+            self.stale += 1
+            return
+
+        if payload_type == visca_encoder.PAYLOAD_REPLY and reply_kind(data) == 0x40:
+            pending.resolve(data, final=False) # ACK, the completion follows
+        else:
+            # completion, error, or a reply with no ACK/completion pair
+            # (IF_Clear echoes, control replies)
+            pending.resolve(data, final=True)
+            del self.pending[pending.key]
+
+    def fail(self, ip, channel):
+        # the socket reported an error (e.g. ICMP port unreachable from a
+        # camera that is powered off): everything waiting on it gives up
+        for key in [key for key in self.pending if key[0] == ip and key[1] == channel]:
+            self.pending.pop(key).resolve(None, final=True)
+
+# one receive path for every camera
+router = ViscaReplyRouter()
+
+
+# ==============================================================
+#  Datagram protocol (one per camera socket)
+# ==============================================================
+class ViscaProtocol(asyncio.DatagramProtocol):
+    '''Hands every datagram from its camera to the reply router.'''
+
+    def __init__(self, camId, ip, channel, replyRouter=router):
+        super().__init__()
+        self.camId = camId
+        self.ip = ip
+        self.channel = channel
+        self.router = replyRouter
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if addr[0] != self.ip:
+            return # not from our camera
+        if traffic_recorder.recorder.enabled:
+            traffic_recorder.recorder.record(traffic_recorder.received_kinds[self.channel], self.ip, data)
+        self.router.route(self.channel, data, addr)
+
+    def error_received(self, exc):
+        self.router.fail(self.ip, self.channel)
+
+    def connection_lost(self, exc):
+        self.router.fail(self.ip, self.channel)
+
+    def sendto(self, message):
+        if traffic_recorder.recorder.enabled:
+            traffic_recorder.recorder.record(traffic_recorder.sent_kinds[self.channel], self.ip, message)
+        self.transport.sendto(message)
+
+
+# ==============================================================
+#  Camera
+# ==============================================================
+class ViscaCamera:
+    '''One VISCA-over-IP camera with its own command and inquiry sockets.'''
+
+    def __init__(self, camId, ip, port=camera_port, replyRouter=router, window=command_window, onHealthChange=None):
+        self.camId = camId
+        self.ip = ip
+        self.port = port
+        self.router = replyRouter
+        self.seqNum = 1
+        self.inquirySeqNum = 1
+        self.command = None
+        self.inquiry = None
+        self.opening = None # Task creating the sockets
+        self.scheduler = visca_scheduler.CommandScheduler(camId, window)
+        self.inquirySlots = None
+        self.rtt = camera_health.RttEstimator()
+        self.breaker = camera_health.CircuitBreaker(camId, self.probe, onHealthChange)
+
+    @property
+    def opened(self):
+        return self.inquiry is not None
+
+    async def open(self):
+        # safe to call from several tasks at once, the sockets are made once
+        if self.opening is None:
+            self.opening = asyncio.ensure_future(self._open())
+        try:
+            await asyncio.shield(self.opening)
+        except Exception:
+            self.opening = None # let the next caller try again
+            raise
+        return self
+
+    async def _open(self):
+        loop = asyncio.get_running_loop()
+        self.inquirySlots = asyncio.Semaphore(inquiry_window)
+        _, self.command = await loop.create_datagram_endpoint(
+            lambda: ViscaProtocol(self.camId, self.ip, 'command', self.router), remote_addr=(self.ip, self.port))
+        _, self.inquiry = await loop.create_datagram_endpoint(
+            lambda: ViscaProtocol(self.camId, self.ip, 'inquiry', self.router), remote_addr=(self.ip, self.port))
+
+    def close(self):
+        self.breaker.stop()
+        if self.opening is not None and not self.opening.done():
+            self.opening.cancel()
+        self.opening = None
+        for protocol in (self.command, self.inquiry):
+            if protocol is not None and protocol.transport is not None:
+                protocol.transport.close()
+        self.command = None
+        self.inquiry = None
+
+    def readdress(self, ip, port=None):
+        # the camera moved: closing the old sockets fails whatever was
+        # waiting on them, the new ones are opened on next use. What was
+        # learnt about the old address (RTT, failures) is dropped
+        self.close()
+        self.ip = ip
+        if port is not None:
+            self.port = port
+        self.seqNum = 1
+        self.inquirySeqNum = 1
+        self.rtt = camera_health.RttEstimator()
+        self.breaker.online = True
+        self.breaker.failures = 0
+
+    def next_sequence_number(self):
+        sequence_number = self.seqNum
+        self.seqNum = (self.seqNum + 1) & 0xFFFFFFFF
+        return sequence_number
+
+    # --------------------------------------------------------
+    # Send Visca Command
+    # Returns once the camera has acknowledged the command.
+    # Up to window commands per camera are waiting for their
+    # ACK at once, each tracked by its own sequence number, so
+    # e.g. a pan and a zoom don't wait for each other. With
+    # waitForCompletion it also waits (outside the window
+    # slot) for the completion.
+    # Every try gets a fresh sequence number, so a late reply
+    # to an earlier try is simply dropped as stale.
+    # Commands wait for their slot in priority order (see
+    # visca_scheduler); one superseded while waiting is not
+    # sent and returns 'superseded', and a retry is dropped
+    # once a newer command for the same axis went out.
+    # "Buffer full" (both of the camera's command sockets are
+    # busy) is retried after a growing backoff; a stop keeps
+    # trying for up to buffer_full_stop_deadline, then fails
+    # and counts against the circuit breaker.
+    # ACK timeouts come from the camera's RTT estimate and
+    # double on every retry; while the camera is offline
+    # (circuit breaker open) commands fail straight away.
+    # --------------------------------------------------------
+    async def send(self, payload, skipCheck=False, retries=command_retries, waitForCompletion=False, priority=None):
+        if self.breaker.open and not skipCheck:
+            return camera_offline
+        if not self.opened:
+            await self.open()
+        received_message = no_response
+        pending = None
+        trace = metrics.current_trace.get() # None unless metrics are on
+        defaultPriority, commandClass = visca_scheduler.classify(payload)
+        if priority is None:
+            priority = defaultPriority
+        async with self.scheduler.slot(priority, commandClass) as granted:
+            if not granted:
+                return 'superseded'
+            claim = self.scheduler.claim(priority, commandClass)
+            backoff = buffer_full_backoff
+            busySince = None
+            tries = 0
+            # If we dont get an acknoledge try again
+            while tries < retries:
+                if tries or backoff > buffer_full_backoff:
+                    if self.scheduler.preempted(priority, commandClass, claim):
+                        received_message = 'superseded'
+                        break
+                    if self.breaker.open:
+                        received_message = camera_offline
+                        break
+                if tries:
+                    metrics.registry.count('visca_retries_total', self.camId)
+                sequence_number = self.next_sequence_number()
+                visca_message = visca_encoder.build_command(sequence_number, payload)
+                if skipCheck:
+                    self.command.sendto(visca_message)
+                    log.debug('%s sent to %s:%d seq %d', server_log.Hex(visca_message), self.ip, self.port, sequence_number)
+                    if trace is not None:
+                        metrics.registry.sent(trace, self.camId, time.perf_counter())
+                    received_message = 'skipped check'
+                    break
+
+                pending = self.router.expect(self.ip, 'command', sequence_number)
+                self.command.sendto(visca_message)
+                log.debug('%s sent to %s:%d seq %d', server_log.Hex(visca_message), self.ip, self.port, sequence_number)
+                sentAt = time.perf_counter()
+                if trace is not None:
+                    metrics.registry.sent(trace, self.camId, sentAt)
+                try:
+                    data = await asyncio.wait_for(pending.ack, self.rtt.timeout(command_timeout, tries))
+                except asyncio.TimeoutError:
+                    data = None
+                if data is None:
+                    self.router.release(pending)
+                    pending = None
+                    received_message = no_response
+                    metrics.registry.count('visca_timeouts_total', self.camId)
+                    log.info('%s %s', received_message, self.ip)
+                    tries += 1
+                    continue
+
+                if tries == 0:
+                    self.rtt.observe(time.perf_counter() - sentAt)
+                self.breaker.success()
+                received_message = binascii.hexlify(data)
+                if reply_kind(data) == 0x60:
+                    pending = None
+                    if buffer_full(data):
+                        if busySince is None:
+                            busySince = time.perf_counter()
+                        if backoff <= buffer_full_max_backoff or (priority == visca_scheduler.STOP and
+                                time.perf_counter() - busySince < buffer_full_stop_deadline):
+                            # both camera sockets busy: wait for one to complete
+                            metrics.registry.count('visca_buffer_full_total', self.camId)
+                            await asyncio.sleep(min(backoff, buffer_full_max_backoff))
+                            backoff *= 2
+                            continue
+                        if priority == visca_scheduler.STOP:
+                            # busy for this long is as bad as no answer
+                            self.breaker.failure()
+                    # the camera understood and refused it, retrying won't help
+                    log.warning('Error from %s %s', self.ip, received_message)
+                    metrics.registry.count('visca_errors_total', self.camId)
+                    break
+                if trace is not None:
+                    metrics.registry.acked(trace, self.camId, sentAt)
+                    pending.done.add_done_callback(
+                        lambda done, sentAt=sentAt: done.result() is not None and metrics.registry.completed(trace, self.camId, sentAt))
+                # keep listening for the completion for a while, then let go
+                asyncio.get_running_loop().call_later(completion_timeout, self.router.release, pending)
+                break
+            else:
+                self.breaker.failure() # ran out of retries
+
+        if waitForCompletion and pending is not None:
+            try:
+                data = await asyncio.wait_for(asyncio.shield(pending.done), completion_timeout)
+            except asyncio.TimeoutError:
+                data = None
+            received_message = no_response if data is None else binascii.hexlify(data)
+        return received_message
+
+    # --------------------------------------------------------
+    # Send Visca Inquiry
+    # Returns the raw reply datagram, or None. Inquiries have
+    # their own socket and sequence numbers, so they go out
+    # in parallel with commands (and with each other).
+    # None straight away while the camera is offline, except
+    # for the circuit breaker's own probe
+    # --------------------------------------------------------
+    async def send_inquiry(self, payload, name='inquiry', probe=False):
+        if self.breaker.open and not probe:
+            return None
+        if not self.opened:
+            await self.open()
+        async with self.inquirySlots:
+            sequence_number = self.inquirySeqNum
+            self.inquirySeqNum = (self.inquirySeqNum + 1) & 0xFFFFFFFF
+            pending = self.router.expect(self.ip, 'inquiry', sequence_number)
+            self.inquiry.sendto(visca_encoder.build_inquiry(sequence_number, payload))
+            sentAt = time.perf_counter()
+            # block inquiries take the camera longer than an ACK
+            timeout = camera_health.probe_timeout if probe else self.rtt.timeout(inquiry_timeout, 1)
+            try:
+                data = await asyncio.wait_for(pending.done, timeout)
+            except asyncio.TimeoutError:
+                data = None
+            finally:
+                self.router.release(pending)
+            if not probe:
+                if data is None:
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+            if metrics.registry.enabled:
+                if data is None:
+                    metrics.registry.count('visca_inquiry_timeouts_total', self.camId)
+                else:
+                    metrics.registry.observe('visca_inquiry_seconds', self.camId, name, time.perf_counter() - sentAt)
+            return data
+
+    async def probe(self):
+        # cheap inquiry for the circuit breaker: is anybody there?
+        return await self.send_inquiry(camera_health.probe_payload, 'probe', probe=True) is not None
+
+    async def reset_sequence_number(self, skipCheck=False):
+        received_message = await self.send(IF_Clear, skipCheck=skipCheck)
+        self.seqNum = 1
+        return received_message
+
+
+async def open_cameras(camipDic, port=camera_port, window=command_window, onHealthChange=None):
+    # every camera's sockets are opened in parallel
+    cameras = {camId: ViscaCamera(camId, ip, port, window=window, onHealthChange=onHealthChange)
+               for camId, ip in camipDic.items()}
+    await asyncio.gather(*[camera.open() for camera in cameras.values()])
+    return cameras